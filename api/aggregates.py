@@ -0,0 +1,362 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import (
+    InShipment,
+    OutShipment,
+    ShipmentTotals,
+    DailyShipmentRollup,
+    MonthlyShipmentRollup,
+)
+
+
+MODEL_KEYS = {
+    InShipment: "in_shipment",
+    OutShipment: "out_shipment",
+}
+
+# Date that places a shipment in a rollup bucket
+BUCKET_FIELDS = {
+    InShipment: "arrival_date",
+    OutShipment: "export_date",
+}
+
+# Fields whose values are summed into the totals and rollups
+VALUE_FIELDS = ("weight", "payment_fees", "ground_fees")
+
+# Fields that pick the rollup row a shipment belongs to (besides the bucket date)
+DIMENSION_FIELDS = ("company_name", "destination")
+
+GRANULARITIES = {
+    "day": DailyShipmentRollup,
+    "month": MonthlyShipmentRollup,
+}
+
+ZERO = Decimal("0")
+CENT = Decimal("0.01")
+
+
+def model_key(model) -> str:
+    return MODEL_KEYS[model]
+
+
+def source_fields(model):
+    """Every shipment field that feeds the totals or the rollups"""
+    return VALUE_FIELDS + DIMENSION_FIELDS + (BUCKET_FIELDS[model],)
+
+
+def _snapshot_from(model, values):
+    snap = {field: Decimal(values[field] or 0) for field in VALUE_FIELDS}
+    snap.update({field: values[field] for field in DIMENSION_FIELDS})
+    bucket_field = BUCKET_FIELDS[model]
+    snap["bucket_date"] = model._meta.get_field(bucket_field).to_python(values[bucket_field])
+    return snap
+
+
+def snapshot(instance):
+    """Capture the aggregate contribution of a shipment as currently loaded"""
+    model = type(instance)
+    return _snapshot_from(model, {field: getattr(instance, field) for field in source_fields(model)})
+
+
+def load_snapshot(instance):
+    """Read the stored aggregate contribution of a shipment from the database"""
+    model = type(instance)
+    row = model.objects.filter(pk=instance.pk).values(*source_fields(model)).first()
+    if row is None:
+        return None
+    return _snapshot_from(model, row)
+
+
+def _apply(model, lookup, deltas, extra=None):
+    """
+    Add ``deltas`` to the row matching ``lookup`` with a single UPDATE so
+    concurrent writers never lose each other's changes, creating the row if
+    it does not exist yet.
+    """
+    values = {field: F(field) + delta for field, delta in deltas.items()}
+    values.update(extra or {})
+    if model.objects.filter(**lookup).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas, **(extra or {}))
+    except IntegrityError:
+        # Another writer created the row first
+        model.objects.filter(**lookup).update(**values)
+
+
+def _deltas(shipments, snap, sign=1):
+    return {
+        "total_shipments": shipments,
+        "total_weight": sign * snap["weight"],
+        "total_payment_fees": sign * snap["payment_fees"],
+        "total_ground_fees": sign * snap["ground_fees"],
+    }
+
+
+def apply_totals(key, deltas=None):
+    """Add ``deltas`` to the running totals row of ``key`` and bump its timestamp and version"""
+    _apply(ShipmentTotals, {"model": key}, {**(deltas or {}), "version": 1}, {"last_updated": timezone.now()})
+
+
+def apply_rollups(key, snap, shipments, sign=1):
+    """Add (``sign=1``) or remove (``sign=-1``) a shipment's contribution to its daily and monthly buckets"""
+    bucket_date = snap["bucket_date"]
+    if bucket_date is None:
+        return
+    deltas = _deltas(shipments, snap, sign)
+    for rollup, bucket in (
+        (DailyShipmentRollup, bucket_date),
+        (MonthlyShipmentRollup, bucket_date.replace(day=1)),
+    ):
+        lookup = {
+            "model": key,
+            "bucket": bucket,
+            "company_name": snap["company_name"],
+            "destination": snap["destination"],
+        }
+        _apply(rollup, lookup, deltas)
+        if sign < 0:
+            rollup.objects.filter(**lookup, total_shipments__lte=0).delete()
+
+
+def record_created(instance):
+    key = model_key(type(instance))
+    snap = snapshot(instance)
+    apply_totals(key, _deltas(1, snap))
+    apply_rollups(key, snap, 1)
+
+
+def record_updated(instance, old):
+    """``old`` is the snapshot taken before the save, or None if no aggregate field changed"""
+    key = model_key(type(instance))
+    if old is None:
+        apply_totals(key)
+        return
+    new = snapshot(instance)
+    apply_totals(key, {
+        "total_weight": new["weight"] - old["weight"],
+        "total_payment_fees": new["payment_fees"] - old["payment_fees"],
+        "total_ground_fees": new["ground_fees"] - old["ground_fees"],
+    })
+    if new != old:
+        apply_rollups(key, old, -1, sign=-1)
+        apply_rollups(key, new, 1)
+
+
+def record_deleted(instance):
+    key = model_key(type(instance))
+    snap = snapshot(instance)
+    apply_totals(key, _deltas(-1, snap, sign=-1))
+    apply_rollups(key, snap, -1, sign=-1)
+
+
+def record_bulk_created(instances):
+    """Account for rows inserted with ``bulk_create`` (no signals) with one update per touched row"""
+    if not instances:
+        return
+    model = type(instances[0])
+    key = model_key(model)
+    snaps = [snapshot(instance) for instance in instances]
+
+    totals = {"weight": ZERO, "payment_fees": ZERO, "ground_fees": ZERO}
+    buckets = {}
+    for snap in snaps:
+        for field in VALUE_FIELDS:
+            totals[field] += snap[field]
+        if snap["bucket_date"] is None:
+            continue
+        group = buckets.setdefault(
+            (snap["bucket_date"], snap["company_name"], snap["destination"]),
+            {"count": 0, "weight": ZERO, "payment_fees": ZERO, "ground_fees": ZERO},
+        )
+        group["count"] += 1
+        for field in VALUE_FIELDS:
+            group[field] += snap[field]
+
+    apply_totals(key, _deltas(len(snaps), totals))
+    for (bucket_date, company_name, destination), group in buckets.items():
+        snap = {"bucket_date": bucket_date, "company_name": company_name, "destination": destination, **group}
+        apply_rollups(key, snap, group["count"])
+
+
+# Rebuild / verification
+
+def _sums():
+    return {
+        "total_shipments": Count("id"),
+        "total_weight": Sum("weight"),
+        "total_payment_fees": Sum("payment_fees"),
+        "total_ground_fees": Sum("ground_fees"),
+    }
+
+
+def _cents(value):
+    # SQLite sums decimal columns as floats; the stored columns have two places
+    return Decimal(value or ZERO).quantize(CENT)
+
+
+def _clean(values):
+    values["total_shipments"] = values["total_shipments"] or 0
+    for field in ("total_weight", "total_payment_fees", "total_ground_fees"):
+        values[field] = _cents(values[field])
+    return values
+
+
+def compute_totals(model):
+    """Aggregate the totals for ``model`` from scratch (full table scan)"""
+    return _clean(model.objects.aggregate(**_sums()))
+
+
+def compute_rollups(model, granularity, **filters):
+    """
+    Aggregate the rollup rows for ``model`` from scratch, keyed by (bucket,
+    company, destination). ``filters`` on the dimension fields limit it to
+    some of the rows.
+    """
+    bucket_field = BUCKET_FIELDS[model]
+    bucket = F(bucket_field) if granularity == "day" else TruncMonth(bucket_field)
+    sums = _sums()
+    rows = (
+        model.objects.filter(**{f"{bucket_field}__isnull": False}, **filters)
+        .order_by()
+        .values(rollup_bucket=bucket, company=F("company_name"), dest=F("destination"))
+        .annotate(**sums)
+    )
+    return {
+        (row["rollup_bucket"], row["company"], row["dest"]): _clean({field: row[field] for field in sums})
+        for row in rows
+    }
+
+
+def rebuild_totals(model):
+    """Recompute and store the totals row for ``model``; returns the stored values"""
+    with transaction.atomic():
+        values = compute_totals(model)
+        ShipmentTotals.objects.update_or_create(
+            model=model_key(model),
+            defaults={**values, "last_updated": timezone.now()},
+        )
+        ShipmentTotals.objects.filter(pk=model_key(model)).update(version=F("version") + 1)
+    return values
+
+
+def rebuild_rollups(model, **filters):
+    """
+    Replace every daily and monthly rollup row of ``model`` (or those
+    matching ``filters`` on the dimension fields, which the shipment and
+    rollup tables share) with freshly aggregated ones
+    """
+    key = model_key(model)
+    with transaction.atomic():
+        for granularity, rollup in GRANULARITIES.items():
+            rollup.objects.filter(model=key, **filters).delete()
+            rollup.objects.bulk_create(
+                [
+                    rollup(model=key, bucket=bucket, company_name=company, destination=dest, **values)
+                    for (bucket, company, dest), values in compute_rollups(model, granularity, **filters).items()
+                ],
+                batch_size=1000,
+            )
+
+
+def verify_totals(model):
+    """Return a dict of ``field: (stored, actual)`` for every mismatching field"""
+    actual = compute_totals(model)
+    row = ShipmentTotals.objects.filter(pk=model_key(model)).values(*actual).first() or {}
+    mismatches = {}
+    for field, value in actual.items():
+        stored = row.get(field)
+        if stored is None or stored != value:
+            mismatches[field] = (stored, value)
+    return mismatches
+
+
+def verify_rollups(model):
+    """Return ``(granularity, bucket, company, destination): (stored, actual)`` for every mismatching rollup row"""
+    key = model_key(model)
+    mismatches = {}
+    for granularity, rollup in GRANULARITIES.items():
+        actual = compute_rollups(model, granularity)
+        stored = {
+            (row.pop("bucket"), row.pop("company_name"), row.pop("destination")): row
+            for row in rollup.objects.filter(model=key).values(
+                "bucket", "company_name", "destination", *_sums()
+            )
+        }
+        for row_key in actual.keys() | stored.keys():
+            if actual.get(row_key) != stored.get(row_key):
+                mismatches[(granularity,) + row_key] = (stored.get(row_key), actual.get(row_key))
+    return mismatches
+
+
+# Reads
+
+def get_versions(keys):
+    """``{key: (version, last_updated)}`` of the totals rows of ``keys``, in one query"""
+    return {
+        key: (version, last_updated)
+        for key, version, last_updated in ShipmentTotals.objects.filter(pk__in=keys).values_list(
+            "model", "version", "last_updated"
+        )
+    }
+
+
+def get_totals(model):
+    """Totals for the ``stats`` endpoints, read with a single primary-key lookup"""
+    row = ShipmentTotals.objects.filter(pk=model_key(model)).first()
+    if row is None:
+        return {
+            "total_shipments": 0,
+            "total_weight": 0.0,
+            "total_payment_fees": 0.0,
+            "total_ground_fees": 0.0,
+            "last_updated": datetime.now().isoformat(),
+        }
+    last_updated = row.last_updated or datetime.now()
+    return {
+        "total_shipments": row.total_shipments,
+        "total_weight": float(row.total_weight or 0),
+        "total_payment_fees": float(row.total_payment_fees or 0),
+        "total_ground_fees": float(row.total_ground_fees or 0),
+        "last_updated": last_updated.isoformat(),
+    }
+
+
+def get_timeseries(model, granularity="day", date_from=None, date_to=None, company_name=None, destination=None):
+    """Per-bucket totals for ``model`` read from the rollup tables"""
+    rollup = GRANULARITIES[granularity]
+    queryset = rollup.objects.filter(model=model_key(model))
+    if date_from:
+        if granularity == "month":
+            date_from = date_from.replace(day=1)
+        queryset = queryset.filter(bucket__gte=date_from)
+    if date_to:
+        queryset = queryset.filter(bucket__lte=date_to)
+    if company_name:
+        queryset = queryset.filter(company_name=company_name)
+    if destination:
+        queryset = queryset.filter(destination=destination)
+
+    rows = queryset.order_by("bucket").values("bucket").annotate(
+        shipments=Sum("total_shipments"),
+        weight=Sum("total_weight"),
+        payment_fees=Sum("total_payment_fees"),
+        ground_fees=Sum("total_ground_fees"),
+    )
+    return [
+        {
+            "bucket": row["bucket"].isoformat(),
+            "total_shipments": row["shipments"] or 0,
+            "total_weight": float(_cents(row["weight"])),
+            "total_payment_fees": float(_cents(row["payment_fees"])),
+            "total_ground_fees": float(_cents(row["ground_fees"])),
+        }
+        for row in rows
+    ]
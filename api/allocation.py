@@ -0,0 +1,119 @@
+from collections import defaultdict
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_save
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import InShipment, OutShipment
+from .signals import broadcast_event
+from . import aggregates, cache, references, search
+
+
+# Columns written by an allocation; post_save receivers see them as update_fields
+ALLOCATION_FIELDS = frozenset(['exported_count', 'export', 'updated_at'])
+
+
+def allocate_packages(in_shipment_id, count):
+    """
+    Reserve ``count`` packages of an inbound shipment with a single
+    conditional UPDATE (``exported_count + count <= package_count``), so
+    parallel exports can never over-allocate and the row is only locked for
+    the rest of the (short) write transaction, not across a read-modify-write.
+    Returns False if not enough packages remain.
+    """
+    return InShipment.objects.filter(
+        pk=in_shipment_id,
+        package_count__gte=F('exported_count') + count,
+    ).update(
+        exported_count=F('exported_count') + count,
+        export=Case(
+            When(package_count__lte=F('exported_count') + count, then=Value(True)),
+            default=Value(False),
+        ),
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def remaining_packages(in_shipment_id):
+    row = InShipment.objects.filter(pk=in_shipment_id).values('package_count', 'exported_count').first()
+    if row is None:
+        return 0
+    return max(0, row['package_count'] - row['exported_count'])
+
+
+def allocation_error(count, in_shipment_id):
+    remaining = remaining_packages(in_shipment_id)
+    return {"package_count": f"عدد الطرود المطلوب تصديره ({count}) يتجاوز المتبقي ({remaining})."}
+
+
+def notify_allocated(in_shipment):
+    """
+    The conditional UPDATE bypasses ``save()``, so reload the inbound
+    shipment and send its post_save by hand for the totals and broadcast
+    receivers.
+    """
+    in_shipment.refresh_from_db(fields=list(ALLOCATION_FIELDS))
+    post_save.send(
+        sender=InShipment,
+        instance=in_shipment,
+        created=False,
+        update_fields=ALLOCATION_FIELDS,
+        raw=False,
+        using=in_shipment._state.db,
+    )
+
+
+def with_export_date(validated_data):
+    validated_data['export_date'] = validated_data.get('export_date') or date.today()
+    return validated_data
+
+
+@transaction.atomic
+def create_allocations(items):
+    """
+    Create several partial exports, possibly across several inbound
+    shipments, all or nothing. Requests against the same inbound shipment
+    are summed into one conditional UPDATE, and inbound shipments are
+    updated in id order so concurrent multi-allocations cannot deadlock.
+
+    ``items`` are validated ``OutShipmentSerializer`` data. Raises
+    ``serializers.ValidationError`` with one entry per item on failure.
+    """
+    requested = defaultdict(int)
+    for data in items:
+        requested[data['in_shipment'].pk] += data['package_count']
+
+    failed = {}
+    for in_shipment_id in sorted(requested):
+        if not allocate_packages(in_shipment_id, requested[in_shipment_id]):
+            failed[in_shipment_id] = allocation_error(requested[in_shipment_id], in_shipment_id)
+    if failed:
+        raise serializers.ValidationError([failed.get(data['in_shipment'].pk, {}) for data in items])
+
+    instances = [OutShipment(**with_export_date(dict(data))) for data in items]
+    for instance in instances:
+        search.populate_lookup_fields(instance, "out_shipment")
+    references.populate_references(instances)
+    try:
+        with transaction.atomic():
+            created = OutShipment.objects.bulk_create(instances)
+    except IntegrityError:
+        raise serializers.ValidationError({"sub_bill_number": "رقم البوليصة الفرعية مستخدم بالفعل."})
+    aggregates.record_bulk_created(created)
+    cache.invalidate("out_shipment")
+
+    in_shipments = {data['in_shipment'].pk: data['in_shipment'] for data in items}
+    for in_shipment_id in sorted(in_shipments):
+        notify_allocated(in_shipments[in_shipment_id])
+
+    broadcast_event(
+        "out_shipment",
+        "bulk_created",
+        ids=[instance.id for instance in created],
+        bill_numbers={instance.sub_bill_number for instance in created},
+        master_bill_numbers={instance.bill_number for instance in created},
+    )
+    return created
@@ -0,0 +1,233 @@
+import copy
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 10000
+# Invalidations kept in the shared file; a process that fell further behind clears its cache
+INVALIDATION_LOG_SIZE = 1000
+
+
+class AuthCache:
+    """
+    ``(kind, key) -> user`` for API tokens and session keys, so a request or
+    WebSocket connect with a known credential resolves its user without
+    touching the database. Entries expire after ``ttl`` seconds and the
+    least recently used are evicted past ``max_entries``.
+
+    Entries live in each process. Logout, token deletion and user changes
+    clear the matching entries here and, with a ``path``, append the
+    invalidation to a SQLite file shared by every worker on the host; every
+    process applies the invalidations it has not seen yet before trusting a
+    hit. Without a ``path`` other processes drop their entries when the TTL
+    runs out.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS invalidations ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, key TEXT NOT NULL)"
+    )
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = str(path) if path is not None else None
+        self.local = threading.local()
+        # Last shared invalidation applied here
+        self.seen = 0
+        if self.path is not None:
+            connection = self.connection()
+            connection.execute(self.SCHEMA)
+            self.seen = self._last_invalidation(connection)
+        self.entries = OrderedDict()
+        # user id -> keys cached for that user
+        self.by_user = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def _last_invalidation(connection):
+        return connection.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()[0]
+
+    def sync(self):
+        """Apply the invalidations other processes (and this one) shared since the last call"""
+        if self.path is None:
+            return
+        connection = self.connection()
+        seen = self.seen
+        rows = connection.execute("SELECT id, kind, key FROM invalidations WHERE id > ? ORDER BY id", [seen]).fetchall()
+        if not rows:
+            return
+        with self.lock:
+            if rows[0][0] > seen + 1:
+                # Ids only skip where invalidations were pruned before this process saw them
+                self.entries.clear()
+                self.by_user.clear()
+            for _, kind, key in rows:
+                if kind == "user":
+                    self._discard_user(int(key))
+                else:
+                    self._discard((kind, key))
+            self.seen = max(self.seen, rows[-1][0])
+
+    def _share(self, kind, key):
+        if self.path is None:
+            return
+        connection = self.connection()
+        last = connection.execute("INSERT INTO invalidations (kind, key) VALUES (?, ?)", [kind, str(key)]).lastrowid
+        if last % INVALIDATION_LOG_SIZE == 0:
+            connection.execute("DELETE FROM invalidations WHERE id <= ?", [last - INVALIDATION_LOG_SIZE])
+
+    def get(self, kind, key):
+        """``(user, auth)`` or None. The user is a copy, requests may change it"""
+        self.sync()
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._discard((kind, key))
+                self.misses += 1
+                return None
+            self.entries.move_to_end((kind, key))
+            self.hits += 1
+        user, auth, _ = entry
+        return copy.copy(user), auth
+
+    def set(self, kind, key, user, auth=None):
+        # Invalidations shared before the user was loaded must not drop the new entry
+        self.sync()
+        with self.lock:
+            self._discard((kind, key))
+            self.entries[(kind, key)] = (user, auth, time.monotonic() + self.ttl)
+            self.by_user.setdefault(user.pk, set()).add((kind, key))
+            while len(self.entries) > self.max_entries:
+                self._discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _discard(self, cache_key):
+        entry = self.entries.pop(cache_key, None)
+        if entry is not None:
+            keys = self.by_user.get(entry[0].pk)
+            if keys is not None:
+                keys.discard(cache_key)
+                if not keys:
+                    del self.by_user[entry[0].pk]
+
+    def _discard_user(self, user_id):
+        for cache_key in list(self.by_user.get(user_id, ())):
+            self._discard(cache_key)
+
+    def invalidate(self, kind, key):
+        with self.lock:
+            self._discard((kind, key))
+        self._share(kind, key)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            self._discard_user(user_id)
+        self._share("user", user_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_user.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+
+_auth_cache = None
+_auth_cache_lock = threading.Lock()
+
+
+def get_auth_cache():
+    """The cache configured by ``settings.AUTH_CACHE``"""
+    global _auth_cache
+    if _auth_cache is None:
+        with _auth_cache_lock:
+            if _auth_cache is None:
+                config = getattr(settings, "AUTH_CACHE", {})
+                _auth_cache = AuthCache(
+                    ttl=config.get("TTL", DEFAULT_TTL),
+                    max_entries=config.get("MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+                    path=config.get("PATH"),
+                )
+    return _auth_cache
+
+
+@receiver(setting_changed)
+def reset_auth_cache(setting, **kwargs):
+    global _auth_cache
+    if setting == "AUTH_CACHE":
+        _auth_cache = None
+
+
+def session_user(request):
+    """
+    The user logged in to ``request``'s session, cached by session key.
+    Anonymous users are not cached: the key changes on login anyway.
+    """
+    session_key = request.session.session_key
+    if session_key is None:
+        return get_user(request)
+    cache = get_auth_cache()
+    cached = cache.get("session", session_key)
+    if cached is not None:
+        return cached[0]
+    user = get_user(request)
+    if user.is_authenticated:
+        cache.set("session", session_key, user)
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` that looks the token up in the auth cache first"""
+
+    def authenticate_credentials(self, key):
+        cache = get_auth_cache()
+        cached = cache.get("token", key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        cache.set("token", key, user, token)
+        return user, token
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """``SessionAuthentication`` that resolves the session's user through the auth cache"""
+
+    def authenticate(self, request):
+        user = session_user(request._request)
+        if not user or not user.is_active:
+            return None
+        self.enforce_csrf(request)
+        return (user, None)
@@ -0,0 +1,220 @@
+import json
+import time
+
+from django.db import IntegrityError, transaction
+from rest_framework import serializers
+
+from .models import InShipment
+from .serializers import InShipmentBulkItemSerializer
+from . import aggregates, cache, references, search
+
+
+# Largest number of rows accepted by one bulk request
+BULK_MAX_ROWS = 5000
+
+# Rows per INSERT statement / per ``__in`` lookup (keeps SQLite under its variable limit)
+BATCH_SIZE = 500
+
+
+def existing_sub_bill_numbers(numbers):
+    """Which of ``numbers`` are already taken, with one query per batch"""
+    numbers = list(numbers)
+    existing = set()
+    for start in range(0, len(numbers), BATCH_SIZE):
+        existing.update(
+            InShipment.objects.filter(sub_bill_number__in=numbers[start:start + BATCH_SIZE])
+            .order_by()
+            .values_list('sub_bill_number', flat=True)
+        )
+    return existing
+
+
+def duplicate_sub_bill_number_message():
+    field = InShipment._meta.get_field('sub_bill_number')
+    return field.error_messages['unique'] % {
+        'model_name': InShipment._meta.verbose_name,
+        'field_label': field.verbose_name,
+    }
+
+
+def validate_in_shipment_rows(rows, start_index=0):
+    """
+    Validate a batch of inbound shipment rows. Field validation runs per row,
+    but ``sub_bill_number`` uniqueness is checked against the database with a
+    single set-based query and against the rest of the batch in memory.
+
+    Returns ``(valid, errors)`` where ``valid`` is a list of ``(index,
+    validated_data)`` and ``errors`` a list of ``{"index": ..., "errors": ...}``.
+    """
+    valid, errors = [], []
+    for offset, row in enumerate(rows):
+        index = start_index + offset
+        serializer = InShipmentBulkItemSerializer(data=row)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            errors.append({"index": index, "errors": serializer.errors})
+
+    taken = existing_sub_bill_numbers({data['sub_bill_number'] for _, data in valid})
+    duplicate_message = duplicate_sub_bill_number_message()
+    seen = set()
+    unique = []
+    for index, data in valid:
+        number = data['sub_bill_number']
+        if number in taken or number in seen:
+            errors.append({
+                "index": index,
+                "errors": {"sub_bill_number": [duplicate_message]},
+            })
+        else:
+            seen.add(number)
+            unique.append((index, data))
+
+    errors.sort(key=lambda error: error["index"])
+    return unique, errors
+
+
+@transaction.atomic
+def insert_in_shipments(validated_rows):
+    """
+    Insert validated rows with ``bulk_create`` in one transaction. Per-row
+    signals do not fire, so the derived columns, running totals and rollups
+    are maintained here; callers send one summary broadcast.
+
+    Raises ``ValidationError`` when a ``sub_bill_number`` was taken by another
+    request after validation; nothing is inserted then (see
+    ``conflicting_rows``).
+    """
+    instances = [InShipment(**data) for data in validated_rows]
+    for instance in instances:
+        search.populate_lookup_fields(instance, "in_shipment")
+    references.populate_references(instances)
+    try:
+        with transaction.atomic():
+            created = InShipment.objects.bulk_create(instances, batch_size=BATCH_SIZE)
+    except IntegrityError:
+        raise serializers.ValidationError({"sub_bill_number": [duplicate_sub_bill_number_message()]})
+    aggregates.record_bulk_created(created)
+    cache.invalidate("in_shipment")
+    return created
+
+
+def conflicting_rows(valid, detail):
+    """
+    Row errors for the ``(index, validated_data)`` pairs whose
+    ``sub_bill_number`` is taken now, after ``insert_in_shipments`` raised
+    ``detail`` for the batch
+    """
+    taken = existing_sub_bill_numbers({data['sub_bill_number'] for _, data in valid})
+    return [{"index": index, "errors": detail} for index, data in valid if data['sub_bill_number'] in taken]
+
+
+# Row errors kept in an import report; the counts always cover every row
+IMPORT_MAX_ERRORS = 100
+
+
+class ImportReport:
+    """Progress of an NDJSON import, updated after every committed chunk"""
+
+    def __init__(self, start_line=0):
+        self.start_line = start_line
+        self.line = start_line
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return (self.imported + self.failed) / elapsed if elapsed else 0.0
+
+    def add_errors(self, errors):
+        self.failed += len(errors)
+        room = IMPORT_MAX_ERRORS - len(self.errors)
+        if room > 0:
+            self.errors.extend(errors[:room])
+
+    def as_dict(self):
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "start_line": self.start_line,
+            "next_line": self.line,
+            "elapsed": round(self.elapsed, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "errors": self.errors,
+        }
+
+
+def iter_ndjson_chunks(lines, chunk_size, start_line=0):
+    """
+    Yield ``(end_line, rows, errors)`` for every ``chunk_size`` records of an
+    NDJSON stream, skipping the first ``start_line`` lines. ``rows`` are
+    ``(line_number, record)`` pairs; lines that are not JSON objects become
+    errors straight away. Blank lines count as lines but carry no record.
+    """
+    rows, errors = [], []
+    line_number = 0
+    for line_number, raw in enumerate(lines, start=1):
+        if line_number <= start_line:
+            continue
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8-sig" if line_number == 1 else "utf-8", errors="replace")
+        raw = raw.strip()
+        if raw:
+            try:
+                record = json.loads(raw)
+            except ValueError as exc:
+                errors.append({"index": line_number, "errors": {"detail": f"Invalid JSON: {exc}"}})
+            else:
+                if isinstance(record, dict):
+                    rows.append((line_number, record))
+                else:
+                    errors.append({"index": line_number, "errors": {"detail": "Expected a JSON object."}})
+        if len(rows) + len(errors) >= chunk_size:
+            yield line_number, rows, errors
+            rows, errors = [], []
+    if rows or errors:
+        yield line_number, rows, errors
+
+
+def import_ndjson(lines, chunk_size=1000, start_line=0, on_chunk=None):
+    """
+    Import inbound shipments from NDJSON ``lines``. Every chunk is validated
+    with the set-based checks of ``validate_in_shipment_rows`` and inserted in
+    its own transaction, so a failure only loses the chunk in progress;
+    invalid rows, and rows whose ``sub_bill_number`` another writer took in
+    the meantime, are skipped and reported by line number. ``on_chunk(report)``
+    runs after each commit (checkpointing, progress output). No per-row
+    signals fire: callers send one summary broadcast at the end.
+    """
+    report = ImportReport(start_line)
+    for end_line, rows, errors in iter_ndjson_chunks(lines, chunk_size, start_line):
+        line_numbers = [line_number for line_number, _ in rows]
+        valid, row_errors = validate_in_shipment_rows([record for _, record in rows])
+        created = []
+        while valid:
+            try:
+                created = insert_in_shipments([data for _, data in valid])
+                break
+            except serializers.ValidationError as exc:
+                conflicts = conflicting_rows(valid, exc.detail)
+                if not conflicts:
+                    raise
+                row_errors += conflicts
+                conflicted = {error["index"] for error in conflicts}
+                valid = [(index, data) for index, data in valid if index not in conflicted]
+        for error in row_errors:
+            error["index"] = line_numbers[error["index"]]
+
+        report.imported += len(created)
+        report.add_errors(sorted(errors + row_errors, key=lambda error: error["index"]))
+        report.line = end_line
+        if on_chunk is not None:
+            on_chunk(report)
+    return report
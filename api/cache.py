@@ -0,0 +1,348 @@
+import abc
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.dispatch import receiver
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from . import timing
+
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class BaseResponseCache(abc.ABC):
+    """
+    Rendered JSON responses keyed by request, tagged with the tables they
+    were built from (``in_shipment``, ``company``, ...). Writes to a table
+    invalidate its tag. Every tag carries a generation number that the write
+    bumps, and a response is only stored if its tags' generations did not
+    move while it was being built, so a write that commits mid-request
+    cannot leave a stale entry behind.
+
+    Hit/miss counters are kept per process.
+    """
+    name = None
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abc.abstractmethod
+    def generations(self, tags):
+        """Current generation of each of ``tags``, in order"""
+
+    @abc.abstractmethod
+    def get(self, key):
+        """``(content_type, body)`` or None"""
+
+    @abc.abstractmethod
+    def set(self, key, tags, generations, content_type, body):
+        """Store the body, unless a tag moved past its ``generations`` entry"""
+
+    @abc.abstractmethod
+    def invalidate(self, tag):
+        """Bump ``tag``'s generation and drop the entries built from it"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Drop every entry"""
+
+    @abc.abstractmethod
+    def usage(self):
+        """``(entries, bytes)`` currently stored"""
+
+    def stats(self):
+        entries, size = self.usage()
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class MemoryResponseCache(BaseResponseCache):
+    """LRU cache in this process, bounded by the total size of the stored bodies"""
+    name = "memory"
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tag_generations = {}
+        self.size = 0
+
+    def generations(self, tags):
+        with self.lock:
+            return tuple(self.tag_generations.get(tag, 0) for tag in tags)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, tags, generations, content_type, body):
+        size = len(key) + len(body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if tuple(self.tag_generations.get(tag, 0) for tag in tags) != tuple(generations):
+                return
+            self._discard(key)
+            self.entries[key] = (frozenset(tags), content_type, body, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[3]
+
+    def invalidate(self, tag):
+        with self.lock:
+            self.tag_generations[tag] = self.tag_generations.get(tag, 0) + 1
+            for key in [key for key, entry in self.entries.items() if tag in entry[0]]:
+                self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def usage(self):
+        with self.lock:
+            return len(self.entries), self.size
+
+
+class SQLiteResponseCache(BaseResponseCache):
+    """
+    LRU cache in a SQLite file shared by every worker process on the host.
+    Entries are evicted oldest-access first once the bodies exceed
+    ``max_bytes``.
+    """
+    name = "sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS entries ("
+        "key TEXT PRIMARY KEY, tags TEXT NOT NULL, content_type TEXT NOT NULL, "
+        "body BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)",
+        "CREATE TABLE IF NOT EXISTS generations (tag TEXT PRIMARY KEY, generation INTEGER NOT NULL)",
+    )
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.path = str(path)
+        self.local = threading.local()
+        with self.connection() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return _Transaction(connection)
+
+    @staticmethod
+    def _tags(tags):
+        return "|" + "|".join(tags) + "|"
+
+    @staticmethod
+    def _generations(connection, tags):
+        rows = dict(connection.execute(
+            f"SELECT tag, generation FROM generations WHERE tag IN ({','.join('?' * len(tags))})", list(tags)
+        ).fetchall()) if tags else {}
+        return tuple(rows.get(tag, 0) for tag in tags)
+
+    def generations(self, tags):
+        with self.connection() as connection:
+            return self._generations(connection, tags)
+
+    def get(self, key):
+        with self.connection() as connection:
+            row = connection.execute("SELECT content_type, body FROM entries WHERE key = ?", [key]).fetchone()
+            if row is not None:
+                connection.execute("UPDATE entries SET accessed = ? WHERE key = ?", [time.time(), key])
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], bytes(row[1])
+
+    def set(self, key, tags, generations, content_type, body):
+        size = len(key) + len(body)
+        if size > self.max_bytes:
+            return
+        with self.connection() as connection:
+            if self._generations(connection, tags) != tuple(generations):
+                return
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, tags, content_type, body, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                [key, self._tags(tags), content_type, body, size, time.time()],
+            )
+            excess = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0] - self.max_bytes
+            if excess <= 0:
+                return
+            victims = []
+            for victim, victim_size in connection.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                victims.append(victim)
+                excess -= victim_size
+                if excess <= 0:
+                    break
+            connection.executemany("DELETE FROM entries WHERE key = ?", [[victim] for victim in victims])
+            self.evictions += len(victims)
+
+    def invalidate(self, tag):
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT INTO generations (tag, generation) VALUES (?, 1) "
+                "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1",
+                [tag],
+            )
+            connection.execute("DELETE FROM entries WHERE tags LIKE ?", [f"%|{tag}|%"])
+
+    def clear(self):
+        with self.connection() as connection:
+            connection.execute("DELETE FROM entries")
+
+    def usage(self):
+        with self.connection() as connection:
+            return connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT`` around a block on an autocommit connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+BACKENDS = {
+    "memory": MemoryResponseCache,
+    "sqlite": SQLiteResponseCache,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    The configured cache (``settings.RESPONSE_CACHE``), or None when caching
+    is disabled (``"BACKEND": None``).
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, "RESPONSE_CACHE", {})
+                backend = config.get("BACKEND", "sqlite")
+                if backend is None:
+                    return None
+                options = {"max_bytes": config.get("MAX_BYTES", DEFAULT_MAX_BYTES)}
+                if backend == "sqlite":
+                    options["path"] = config.get("PATH", settings.BASE_DIR / "response_cache.sqlite3")
+                _cache = BACKENDS[backend](**options)
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_response_cache(setting, **kwargs):
+    global _cache
+    if setting == "RESPONSE_CACHE":
+        _cache = None
+
+
+def invalidate(tag):
+    """
+    Drop every cached response built from ``tag``'s table: right away, and
+    again once the current transaction commits, since a reader may cache
+    the pre-commit rows in between.
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        cache.invalidate(tag)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: cache.invalidate(tag))
+
+
+def cache_key(request):
+    user = getattr(request, "user", None)
+    scope = user.pk if user is not None and user.is_authenticated else "anon"
+    query = sorted((name, sorted(values)) for name, values in request.GET.lists())
+    # List bodies embed absolute next/previous links; the database name keeps
+    # a shared cache file from serving another database's rows (e.g. tests)
+    origin = [request.scheme, request.get_host(), connection.settings_dict["NAME"]]
+    raw = json.dumps(
+        [*origin, request.path, query, scope, request.accepted_media_type], separators=(",", ":"), default=str
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def cached_response(view_method):
+    """
+    Viewset method decorator serving JSON responses from the response cache.
+    The view's ``depends_on`` names the tables (signal tags) a response is
+    built from; ``X-Cache`` tells whether it was a hit.
+    """
+    @functools.wraps(view_method)
+    def wrapped(self, request, *args, **kwargs):
+        cache = get_response_cache()
+        renderer = getattr(request, "accepted_renderer", None)
+        if cache is None or not isinstance(renderer, JSONRenderer):
+            return view_method(self, request, *args, **kwargs)
+
+        key = cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            content_type, body = entry
+            return HttpResponse(body, content_type=content_type, headers={"X-Cache": "HIT"})
+
+        tags = tuple(self.depends_on)
+        generations = cache.generations(tags)
+        response = view_method(self, request, *args, **kwargs)
+        if not isinstance(response, Response) or response.status_code != 200:
+            return response
+
+        with timing.span("render"):
+            body = renderer.render(response.data, request.accepted_media_type, self.get_renderer_context())
+        content_type = f"{renderer.media_type}; charset={renderer.charset}" if renderer.charset else renderer.media_type
+        cache.set(key, tags, generations, content_type, body)
+        return HttpResponse(body, content_type=content_type, headers={"X-Cache": "MISS"})
+    return wrapped
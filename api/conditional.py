@@ -0,0 +1,52 @@
+import functools
+import hashlib
+import json
+
+from django.views.decorators.http import condition
+
+from . import aggregates
+
+
+def _validators(request, keys):
+    """
+    ``(etag, last_modified)`` for a GET that depends on the shipment tables
+    in ``keys``. Every write bumps the table's version in ``ShipmentTotals``
+    (deletes and bulk writes included), so one primary-key lookup tells
+    whether anything changed. The path and the normalized query string
+    (filters, search, ordering, cursor, fields) are hashed in as well.
+    """
+    cache_attr = '_shipment_validators'
+    cached = getattr(request, cache_attr, None)
+    if cached is not None:
+        return cached
+
+    versions = aggregates.get_versions(keys)
+    state = [versions.get(key, (0, None)) for key in keys]
+    query = sorted((name, sorted(values)) for name, values in request.GET.lists())
+    digest = hashlib.sha1(json.dumps(
+        [request.path, query, request.META.get('HTTP_ACCEPT', ''), [version for version, _ in state]],
+        separators=(',', ':'),
+    ).encode('utf-8')).hexdigest()
+    last_modified = max((updated for _, updated in state if updated is not None), default=None)
+
+    cached = (f'"{digest}"', last_modified)
+    setattr(request, cache_attr, cached)
+    return cached
+
+
+def conditional_get(view_method):
+    """
+    Viewset method decorator answering ``If-None-Match`` / ``If-Modified-Since``
+    with ``304 Not Modified`` before the view runs any query, and setting
+    ``ETag`` / ``Last-Modified`` on full responses. The tables the response
+    depends on are the view's ``depends_on``.
+    """
+    @functools.wraps(view_method)
+    def wrapped(self, request, *args, **kwargs):
+        keys = self.depends_on
+        view = condition(
+            etag_func=lambda request, *args, **kwargs: _validators(request, keys)[0],
+            last_modified_func=lambda request, *args, **kwargs: _validators(request, keys)[1],
+        )(functools.partial(view_method, self))
+        return view(request, *args, **kwargs)
+    return wrapped
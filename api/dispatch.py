@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import event_log
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_COALESCE_WINDOW = 0.1
+DEFAULT_MAX_BATCH = 100
+
+
+class EventDispatcher:
+    """
+    Sends channel-layer messages from a background thread so requests never
+    wait on fan-out. The thread owns an event loop. Messages submitted with
+    ``logged=True`` are first appended to the event log, which sets their
+    ``seq``.
+
+    Events queued within ``coalesce_window`` seconds of each other (at most
+    ``max_batch``) are coalesced before fan-out: each group gets a single
+    ``shipments.batch`` message holding its events in order, or the event
+    itself when there is only one. A burst therefore costs one
+    ``group_send`` per group instead of one per event and group.
+
+    The queue is bounded: when it is full, new events are dropped and
+    counted, and the request is not blocked. Logged events that are dropped
+    (or fail to be stored) leave a gap mark in the event log, so clients
+    resuming across it are told to reload.
+
+    Nothing flushes the queue at exit: ``atexit`` runs after the thread pool
+    ``asyncio.to_thread`` needs is shut down. Scripts and management
+    commands that write call ``flush_dispatcher()`` before they return.
+    """
+
+    def __init__(self, max_size=DEFAULT_QUEUE_SIZE, coalesce_window=DEFAULT_COALESCE_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.max_size = max_size
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counter_lock = threading.Lock()
+        self.enqueued = 0
+        self.dispatched = 0
+        self.dropped = 0
+        # Logged events dropped or not stored since the last gap mark
+        self.unlogged = 0
+        self.failed = 0
+        self.group_sends = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+
+    def submit(self, groups, message, logged=False):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait((time.monotonic(), groups, message, logged))
+        except queue.Full:
+            with self.counter_lock:
+                self.dropped += 1
+                if logged:
+                    self.unlogged += 1
+            logger.warning("Event queue full, dropping %s event", message.get("type"))
+            return
+        with self.counter_lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _ensure_thread(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="event-dispatcher", daemon=True)
+                self.thread.start()
+
+    def _next_batch(self):
+        """The next queued item, plus whatever else arrives within the coalescing window"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.coalesce_window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            batch = self._next_batch()
+            now = time.monotonic()
+            for queued_at, _, _, _ in batch:
+                lag = now - queued_at
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                self.total_lag += lag
+            try:
+                if any(logged for _, _, _, logged in batch):
+                    close_old_connections()
+                    self._record_gap()
+                # group -> its messages, in queue order
+                by_group = {}
+                for _, groups, message, logged in batch:
+                    if logged:
+                        seq = event_log.record(message)
+                        if seq is not None:
+                            message["seq"] = seq
+                        else:
+                            with self.counter_lock:
+                                self.unlogged += 1
+                    for group in groups:
+                        by_group.setdefault(group, []).append(message)
+                channel_layer = get_channel_layer()
+                if channel_layer is not None:
+                    for group, messages in by_group.items():
+                        message = messages[0] if len(messages) == 1 else {"type": "shipments.batch", "events": messages}
+                        loop.run_until_complete(channel_layer.group_send(group, message))
+                        self.group_sends += 1
+                self.dispatched += len(batch)
+            except Exception:
+                self.failed += len(batch)
+                logger.exception("Failed to dispatch %d events", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _record_gap(self):
+        with self.counter_lock:
+            missing, self.unlogged = self.unlogged, 0
+        if missing and event_log.record_gap(missing) is None:
+            with self.counter_lock:
+                self.unlogged += missing
+
+    def flush(self, timeout=5):
+        """Wait (up to ``timeout`` seconds) until every queued event has been sent"""
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        handled = self.dispatched + self.failed
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "queue_size": self.max_size,
+            "enqueued": self.enqueued,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "group_sends": self.group_sends,
+            "lag_last_ms": round(self.last_lag * 1000, 2),
+            "lag_max_ms": round(self.max_lag * 1000, 2),
+            "lag_avg_ms": round(self.total_lag / handled * 1000, 2) if handled else None,
+        }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                config = getattr(settings, "SHIPMENT_EVENTS", {})
+                _dispatcher = EventDispatcher(
+                    config.get("DISPATCH_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+                    config.get("COALESCE_WINDOW", DEFAULT_COALESCE_WINDOW),
+                    config.get("MAX_BATCH", DEFAULT_MAX_BATCH),
+                )
+    return _dispatcher
+
+
+def flush_dispatcher(timeout=5):
+    """Send every queued event, if anything was queued; call before the process exits"""
+    if _dispatcher is not None:
+        _dispatcher.flush(timeout)
@@ -0,0 +1,72 @@
+import logging
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Max, Min
+
+from .models import ShipmentEvent
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOG_SIZE = 10000
+
+# Old rows are pruned every this many events rather than on every insert
+PRUNE_EVERY = 100
+
+# Payload type of the row marking events that were never logged
+GAP_TYPE = "shipments.gap"
+
+
+def log_size():
+    return getattr(settings, "SHIPMENT_EVENTS", {}).get("LOG_SIZE", DEFAULT_LOG_SIZE)
+
+
+def record(payload):
+    """
+    Append ``payload`` to the log and return its sequence number, or
+    ``None`` if it could not be stored (the event is still broadcast; the
+    dispatcher then records a gap, see ``record_gap``).
+    """
+    try:
+        seq = ShipmentEvent.objects.create(payload=payload).id
+        if seq % PRUNE_EVERY == 0:
+            ShipmentEvent.objects.filter(id__lte=seq - log_size()).delete()
+    except DatabaseError:
+        logger.exception("Failed to record %s event", payload.get("model"))
+        return None
+    return seq
+
+
+def record_gap(missing):
+    """
+    Mark that ``missing`` events were never logged (dropped or not stored):
+    a client resuming from before the mark is told to reload.
+    """
+    return record({"type": GAP_TYPE, "missing": missing})
+
+
+def latest_seq():
+    return ShipmentEvent.objects.aggregate(seq=Max("id"))["seq"] or 0
+
+
+def events_after(seq, limit=None):
+    """
+    The logged payloads after ``seq`` (at most ``limit``), oldest first and
+    with their ``seq`` set, or ``None`` when the log no longer reaches back
+    that far (or ``seq`` is ahead of it, e.g. after the database was reset,
+    or a gap was recorded among them) and the client has to reload instead.
+    """
+    bounds = ShipmentEvent.objects.aggregate(first=Min("id"), last=Max("id"))
+    first, last = bounds["first"], bounds["last"] or 0
+    if seq > last:
+        return None
+    if seq == last:
+        return []
+    if first is None or seq < first - 1:
+        return None
+    rows = ShipmentEvent.objects.filter(id__gt=seq).order_by("id").values_list("id", "payload")
+    events = [{**payload, "seq": event_id} for event_id, payload in (rows[:limit] if limit is not None else rows)]
+    if any(event.get("type") == GAP_TYPE for event in events):
+        return None
+    return events
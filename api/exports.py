@@ -0,0 +1,235 @@
+import csv
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+# Rows fetched per database round trip while streaming
+CHUNK_SIZE = 2000
+
+# Bytes buffered before a chunk is handed to the client
+FLUSH_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = {
+    "in_shipment": [
+        ("id", "ID"),
+        ("bill_number", None),
+        ("sub_bill_number", None),
+        ("arrival_date", None),
+        ("company_name", None),
+        ("package_count", None),
+        ("exported_count", None),
+        ("weight", None),
+        ("destination", None),
+        ("payment_fees", None),
+        ("ground_fees", None),
+        ("customs_certificate", None),
+        ("contract_status", None),
+        ("disbursement_date", None),
+        ("receiver_name", None),
+        ("export", "تم التصدير"),
+        ("created_at", "تاريخ الإنشاء"),
+    ],
+    "out_shipment": [
+        ("id", "ID"),
+        ("in_shipment__bill_number", "رقم البوليصة الواردة"),
+        ("bill_number", None),
+        ("sub_bill_number", None),
+        ("arrival_date", None),
+        ("export_date", None),
+        ("company_name", None),
+        ("package_count", None),
+        ("weight", None),
+        ("destination", None),
+        ("payment_fees", None),
+        ("ground_fees", None),
+        ("customs_certificate", None),
+        ("contract_status", None),
+        ("disbursement_date", None),
+        ("receiver_name", None),
+        ("created_at", "تاريخ الإنشاء"),
+    ],
+}
+
+# Spreadsheet applications run text cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_columns(model, model_key):
+    """``(lookups, headers)`` for an export; headers default to the field's (Arabic) help text"""
+    lookups, headers = [], []
+    for lookup, header in EXPORT_COLUMNS[model_key]:
+        if header is None:
+            field = model._meta.get_field(lookup)
+            header = field.help_text or field.verbose_name
+        lookups.append(lookup)
+        headers.append(str(header))
+    return lookups, headers
+
+
+def iter_rows(queryset, lookups):
+    """Stream rows as tuples, ``CHUNK_SIZE`` at a time, without building model instances"""
+    return queryset.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+
+def text_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return timezone.localtime(value).isoformat() if timezone.is_aware(value) else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # A leading apostrophe keeps user-entered text from running as a formula
+        return "'" + value
+    return str(value)
+
+
+class _Sink:
+    """Write-only file object that collects bytes until the generator takes them"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+
+class _TextSink:
+    def __init__(self, sink):
+        self.sink = sink
+
+    def write(self, text):
+        return self.sink.write(text.encode("utf-8"))
+
+
+def stream_csv(headers, rows):
+    sink = _Sink()
+    writer = csv.writer(_TextSink(sink))
+    # BOM so spreadsheet applications detect UTF-8 (Arabic text)
+    sink.write("\ufeff".encode("utf-8"))
+    writer.writerow(headers)
+    yield sink.pop()
+    for row in rows:
+        writer.writerow([text_value(value) for value in row])
+        if sink.size >= FLUSH_SIZE:
+            yield sink.pop()
+    yield sink.pop()
+
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Shipments" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, Decimal, float)):
+        return f"<c><v>{value}</v></c>"
+    text = _INVALID_XML.sub("", text_value(value))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return "<row>" + "".join(_xlsx_cell(value) for value in values) + "</row>"
+
+
+def stream_xlsx(headers, rows):
+    """
+    Write an XLSX workbook (a zip archive) straight into the response. The
+    sink cannot seek, so ``zipfile`` emits data descriptors and the sheet is
+    deflated as it is written; only ``FLUSH_SIZE`` bytes are ever buffered.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        yield sink.pop()
+
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + _xlsx_row(headers)
+            ).encode("utf-8"))
+            for row in rows:
+                sheet.write(_xlsx_row(row).encode("utf-8"))
+                if sink.size >= FLUSH_SIZE:
+                    yield sink.pop()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.pop()
+
+
+STREAMS = {
+    "csv": stream_csv,
+    "xlsx": stream_xlsx,
+}
+
+
+def export_response(queryset, model_key, file_format):
+    """Stream ``queryset`` (already filtered, searched and ordered) as a CSV or XLSX download"""
+    lookups, headers = export_columns(queryset.model, model_key)
+    content = STREAMS[file_format](headers, iter_rows(queryset, lookups))
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    filename = f"{queryset.model._meta.db_table}_{timezone.localdate():%Y%m%d}.{file_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,95 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def _param_list(request, name):
+    if request is None:
+        return None
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def requested_fields(request):
+    """Field names from ``?fields=a,b`` (read requests only), or None for every field"""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    names = _param_list(request, FIELDS_PARAM)
+    return set(names) if names else None
+
+
+def expanded_fields(request):
+    """Relations named in ``?expand=``"""
+    return set(_param_list(request, EXPAND_PARAM) or ())
+
+
+class SparseFieldsMixin:
+    """
+    Serializer mixin for ``?fields=`` and ``?expand=``.
+
+    ``expandable_fields`` maps a relation to the serializer that renders it
+    when named in ``?expand=``; otherwise the relation stays the declared
+    (primary key) field. ``computed_field_sources`` lists the model columns a
+    ``source='*'`` field such as ``status`` is computed from, so the view
+    can fetch just the columns the chosen fields need (``queryset_columns``).
+    Only the top-level serializer reads the request; nested ones render in full.
+    """
+    expandable_fields = {}
+    computed_field_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+
+        for name in expanded_fields(request) & set(self.expandable_fields):
+            self.fields[name] = self.expandable_fields[name](read_only=True)
+
+        wanted = requested_fields(request)
+        if wanted is not None:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+def queryset_columns(serializer, prefix=''):
+    """
+    ``(only, select_related)`` lookups covering every readable field of
+    ``serializer``, following expanded (nested) serializers through a join.
+    """
+    only, related = [f'{prefix}id'], []
+    computed = getattr(serializer, 'computed_field_sources', {})
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in computed:
+            only.extend(f'{prefix}{source}' for source in computed[name])
+            continue
+        if field.source == '*':
+            continue
+        source = prefix + field.source.replace('.', '__')
+        only.append(source)
+        if isinstance(field, serializers.BaseSerializer):
+            related.append(source)
+            nested_only, nested_related = queryset_columns(field, f'{source}__')
+            only.extend(nested_only)
+            related.extend(nested_related)
+    return only, related
+
+
+def restrict_queryset(queryset, serializer, keep=()):
+    """
+    Fetch only the columns ``serializer`` renders, plus ``keep`` (the
+    columns the list is ordered and paginated by), and join only the
+    relations it expands.
+    """
+    only, related = queryset_columns(serializer)
+    queryset = queryset.select_related(None)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(*dict.fromkeys(only + list(keep)))
@@ -1,25 +1,49 @@
 import django_filters
+from django_filters.constants import EMPTY_VALUES
+
 from .models import InShipment, OutShipment
+from .search import normalize_bill_number
+
+
+class BillNumberFilter(django_filters.CharFilter):
+    """Case-insensitive exact match on an indexed ``*_key`` column"""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return super().filter(qs, normalize_bill_number(value))
+
+
+class IndexedBooleanFilter(django_filters.BooleanFilter):
+    """
+    ``field IN (value)`` instead of Django's bare ``WHERE field`` for True,
+    which SQLite cannot match to an index on the column
+    """
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        return qs.filter(**{f'{self.field_name}__in': [value]})
 
 
 class InShipmentFilter(django_filters.FilterSet):
     """FilterSet for InShipment model"""
-    bill_number = django_filters.CharFilter(lookup_expr='iexact')
-    sub_bill_number = django_filters.CharFilter(lookup_expr='iexact')
-    export = django_filters.BooleanFilter()
+    bill_number = BillNumberFilter(field_name='bill_number_key')
+    sub_bill_number = BillNumberFilter(field_name='sub_bill_number_key')
+    export = IndexedBooleanFilter()
     
     class Meta:
         model = InShipment
-        fields = ['bill_number', 'sub_bill_number', 'export']
+        fields = ['bill_number', 'sub_bill_number', 'export', 'company_ref', 'destination_ref']
 
 
 class OutShipmentFilter(django_filters.FilterSet):
     """FilterSet for OutShipment model"""
-    bill_number = django_filters.CharFilter(field_name='in_shipment__bill_number', lookup_expr='iexact')
+    bill_number = BillNumberFilter(field_name='in_shipment__bill_number_key')
     
     class Meta:
         model = OutShipment
-        fields = ['bill_number']
+        fields = ['bill_number', 'company_ref', 'destination_ref']
     
     def filter_queryset(self, queryset):
         """Override to add distinct() for ManyToMany relationships"""
@@ -0,0 +1,139 @@
+import decimal
+
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from . import timing
+
+
+ISO_8601 = 'iso-8601'
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return None
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def _datetime_converter(field):
+    if getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() != ISO_8601:
+        return None
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None:
+        return None
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _date_converter(field):
+    if getattr(field, 'format', api_settings.DATE_FORMAT).lower() != ISO_8601:
+        return None
+    return lambda value: value if isinstance(value, str) else value.isoformat()
+
+
+# Converters for the field types shipments use, in ``isinstance`` order.
+# Each returns None when the field is configured in a way it does not
+# reproduce, and the field's own ``to_representation`` is used instead.
+CONVERTERS = (
+    (serializers.DecimalField, _decimal_converter),
+    (serializers.DateTimeField, _datetime_converter),
+    (serializers.DateField, _date_converter),
+    (serializers.BooleanField, lambda field: bool),
+    (serializers.IntegerField, lambda field: int),
+    (serializers.CharField, lambda field: str),
+    (serializers.PrimaryKeyRelatedField, lambda field: None if field.pk_field else _identity),
+)
+
+
+def _identity(value):
+    return value
+
+
+def field_converter(field):
+    """Plain function turning a ``values()`` column into what ``field`` would render"""
+    for field_class, factory in CONVERTERS:
+        if isinstance(field, field_class) and type(field).to_representation is field_class.to_representation:
+            return factory(field) or field.to_representation
+    return field.to_representation
+
+
+class ValuesListSerializer:
+    """
+    Read-only list serializer producing the same JSON as ``serializer``
+    (a shipment ``ModelSerializer``, already narrowed by ``?fields=`` /
+    ``?expand=``) from ``queryset.values()`` rows. The per-field work is
+    planned once per request: each column gets a precomputed converter, and
+    fields listed in the serializer's ``sql_fields`` (such as ``status``)
+    are computed by the database instead of a per-row method call.
+
+    ``keep`` names extra columns to select, e.g. the ones the paginator
+    builds its cursor from.
+    """
+
+    def __init__(self, serializer, keep=()):
+        self.lookups = {}
+        self.expressions = {}
+        self.plan = self._plan(serializer, '')
+        for name in keep:
+            self.lookups.setdefault(name, None)
+
+    def _plan(self, serializer, prefix):
+        plan = []
+        sql_fields = getattr(serializer, 'sql_fields', {})
+        self.lookups.setdefault(f'{prefix}id', None)
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in sql_fields:
+                alias = f'_sql_{len(self.expressions)}'
+                self.expressions[alias] = sql_fields[name](prefix)
+                plan.append((name, alias, bool, None))
+            elif isinstance(field, serializers.BaseSerializer):
+                source = prefix + field.source.replace('.', '__')
+                plan.append((name, f'{source}__id', None, self._plan(field, f'{source}__')))
+            elif field.source == '*':
+                raise ValueError(f'{type(serializer).__name__}.{name} needs an entry in sql_fields')
+            else:
+                lookup = prefix + field.source.replace('.', '__')
+                self.lookups.setdefault(lookup, None)
+                plan.append((name, lookup, field_converter(field), None))
+        return plan
+
+    def queryset(self, queryset):
+        """``queryset`` as dictionaries holding exactly the columns the plan reads"""
+        return queryset.values(*self.lookups, **self.expressions)
+
+    def _row(self, plan, row):
+        data = {}
+        for name, key, convert, nested in plan:
+            value = row[key]
+            if value is None:
+                data[name] = None
+            elif nested is not None:
+                data[name] = self._row(nested, row)
+            else:
+                data[name] = convert(value)
+        return data
+
+    def serialize(self, rows):
+        plan = self.plan
+        with timing.span("serialize"):
+            return [self._row(plan, row) for row in rows]
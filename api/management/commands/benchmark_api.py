@@ -0,0 +1,288 @@
+import contextlib
+import http.client
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from api.dispatch import flush_dispatcher
+from api.models import InShipment, OutShipment
+
+
+SCENARIOS = ("list", "search", "filter", "stats", "detail", "create_in_shipment", "create_out_shipment")
+
+
+class ClientTransport:
+    """Requests through Django's test client, in this process (no server, no network)"""
+    name = "in-process"
+
+    def __init__(self):
+        # A failing view is a 500 to count, as it would be over HTTP
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method, path, body=None):
+        if method == "GET":
+            response = self.client.get(path)
+        else:
+            response = getattr(self.client, method.lower())(
+                path, json.dumps(body) if body is not None else None, content_type="application/json"
+            )
+        return response.status_code, response.get("X-Cache"), response.content
+
+    def close(self):
+        pass
+
+
+class HTTPTransport:
+    """Requests to a running server over one keep-alive connection"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.name = base_url
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=60)
+        self.prefix = parts.path.rstrip("/")
+
+    def request(self, method, path, body=None):
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        self.connection.request(method, self.prefix + path, payload, headers)
+        response = self.connection.getresponse()
+        return response.status, response.getheader("X-Cache"), response.read()
+
+    def close(self):
+        self.connection.close()
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def shipment_body(sub_bill_number, package_count, **extra):
+    return {
+        "bill_number": f"{sub_bill_number}-MAWB",
+        "arrival_date": "2025-01-15",
+        "sub_bill_number": sub_bill_number,
+        "company_name": "شركة القياس",
+        "package_count": package_count,
+        "weight": "12.50",
+        "destination": "القاهرة",
+        "payment_fees": "100.00",
+        "customs_certificate": "CC-BENCH",
+        "contract_status": "نهائي",
+        "receiver_name": "مستلم",
+        "ground_fees": "20.00",
+        **extra,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency (p50/p95/p99) and throughput of the main API calls: list, search, filter, "
+        "stats, detail and creating in/out shipments. Runs in-process through the Django test client, "
+        "or against a running server with --base-url. Results are printed as JSON (or written with "
+        "--output) so runs can be compared across commits; seed data first with seed_shipments."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", help="Benchmark a running server, e.g. http://127.0.0.1:8000 (default: in-process)")
+        parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario (default 200)")
+        parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests per scenario first (default 10)")
+        parser.add_argument("--concurrency", type=int, default=1, help="Parallel clients (default 1)")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+        parser.add_argument("--seed", type=int, default=1, help="Seed for the request mix (default 1)")
+        parser.add_argument("--cold", action="store_true", help="Make every GET unique so the response cache never hits")
+        parser.add_argument(
+            "--keep", action="store_true",
+            help="Keep the shipments created by the create scenarios (all prefixed BENCH-<run id>-)",
+        )
+        parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options["scenarios"].split(",") if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        if min(options["requests"], options["concurrency"]) <= 0 or options["warmup"] < 0:
+            raise CommandError("--requests and --concurrency must be positive, --warmup not negative")
+
+        self.options = options
+        self.local = threading.local()
+        self.transports = []
+        self.transports_lock = threading.Lock()
+        self.run_id = uuid.uuid4().hex[:8]
+        self.counter = 0
+        self.counter_lock = threading.Lock()
+
+        main = self.transport()
+        try:
+            self.prepare(main, scenarios)
+            results = {}
+            for name in scenarios:
+                results[name] = self.run_scenario(name)
+                self.stderr.write(
+                    f"{name:<20} p50 {results[name]['p50_ms']:>8.2f}ms  p95 {results[name]['p95_ms']:>8.2f}ms  "
+                    f"p99 {results[name]['p99_ms']:>8.2f}ms  {results[name]['throughput_rps']:>8.1f} req/s"
+                )
+        finally:
+            if not options["keep"]:
+                self.cleanup()
+            for transport in self.transports:
+                transport.close()
+            # Events of the in-process writes, before the dispatcher thread dies
+            flush_dispatcher()
+
+        report = {
+            "commit": git_commit(),
+            "started_at": self.started_at,
+            "transport": main.name,
+            "debug": settings.DEBUG,
+            "concurrency": options["concurrency"],
+            "requests": options["requests"],
+            "warmup": options["warmup"],
+            "cold": options["cold"],
+            "seed": options["seed"],
+            "dataset": self.dataset,
+            "scenarios": results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(output + "\n")
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def transport(self):
+        """This thread's transport"""
+        transport = getattr(self.local, "transport", None)
+        if transport is None:
+            base_url = self.options["base_url"]
+            transport = self.local.transport = HTTPTransport(base_url) if base_url else ClientTransport()
+            with self.transports_lock:
+                self.transports.append(transport)
+        return transport
+
+    def call(self, transport, method, path, body=None, expected=200):
+        status, cache_status, content = transport.request(method, path, body)
+        if status != expected:
+            raise CommandError(f"{method} {path} returned {status}: {content[:200]!r}")
+        return json.loads(content) if content else None
+
+    def prepare(self, transport, scenarios):
+        """Sample ids and search terms from the data through the API"""
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        sample = self.call(transport, "GET", "/api/in-shipments/?page_size=500&fields=id,bill_number")["results"]
+        if not sample and {"search", "detail"} & set(scenarios):
+            raise CommandError("No inbound shipments to read; run seed_shipments first")
+        self.in_ids = [row["id"] for row in sample]
+        # A stretch of a real bill number, long enough for the trigram index
+        self.terms = sorted({row["bill_number"][-7:] for row in sample if len(row["bill_number"]) >= 3})
+        self.company_ids = [row["id"] for row in self.call(transport, "GET", "/api/companies/")] or [None]
+        self.dataset = {
+            "in_shipments": self.call(transport, "GET", "/api/in-shipments/stats/")["total_shipments"],
+            "out_shipments": self.call(transport, "GET", "/api/out-shipments/stats/")["total_shipments"],
+            "companies": len(self.company_ids),
+        }
+        if "create_out_shipment" in scenarios:
+            # One inbound shipment with a package for every export the scenario makes
+            packages = self.options["requests"] + self.options["warmup"]
+            in_shipment = self.call(
+                transport, "POST", "/api/in-shipments/",
+                shipment_body(f"BENCH-{self.run_id}-SOURCE", packages), expected=201,
+            )
+            self.export_source = in_shipment["id"]
+
+    def next_number(self):
+        with self.counter_lock:
+            self.counter += 1
+            return self.counter
+
+    def build_request(self, name, rng):
+        """``(method, path, body, expected status)`` for one request of ``name``"""
+        number = self.next_number()
+        bust = f"&bench={self.run_id}-{number}" if self.options["cold"] else ""
+        if name == "list":
+            return "GET", f"/api/in-shipments/?page_size=50{bust}", None, 200
+        if name == "search":
+            return "GET", f"/api/in-shipments/?search={rng.choice(self.terms)}{bust}", None, 200
+        if name == "filter":
+            company = rng.choice(self.company_ids)
+            company_filter = f"&company_ref={company}" if company is not None else ""
+            return "GET", f"/api/out-shipments/?ordering=-export_date{company_filter}{bust}", None, 200
+        if name == "stats":
+            return "GET", f"/api/in-shipments/stats/?{bust.lstrip('&')}", None, 200
+        if name == "detail":
+            return "GET", f"/api/in-shipments/{rng.choice(self.in_ids)}/?{bust.lstrip('&')}", None, 200
+        if name == "create_in_shipment":
+            return "POST", "/api/in-shipments/", shipment_body(f"BENCH-{self.run_id}-IN-{number}", 5), 201
+        return "POST", "/api/out-shipments/", shipment_body(
+            f"BENCH-{self.run_id}-OUT-{number}", 1, in_shipment_id=self.export_source
+        ), 201
+
+    def run_scenario(self, name):
+        options = self.options
+        rng = random.Random(f"{options['seed']}-{name}")
+        requests = [self.build_request(name, rng) for _ in range(options["warmup"] + options["requests"])]
+        warmup, measured = requests[:options["warmup"]], requests[options["warmup"]:]
+
+        def send(request):
+            method, path, body, expected = request
+            transport = self.transport()
+            started = time.perf_counter()
+            status, cache_status, _ = transport.request(method, path, body)
+            elapsed = time.perf_counter() - started
+            return elapsed, status == expected, cache_status == "HIT"
+
+        # One client runs in this thread: no hand-off cost in the numbers
+        with contextlib.ExitStack() as stack:
+            run = map
+            if options["concurrency"] > 1:
+                run = stack.enter_context(ThreadPoolExecutor(options["concurrency"])).map
+            list(run(send, warmup))
+            started = time.perf_counter()
+            outcomes = list(run(send, measured))
+            wall = time.perf_counter() - started
+
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in outcomes)
+        return {
+            "requests": len(outcomes),
+            "errors": sum(1 for _, ok, _ in outcomes if not ok),
+            "cache_hits": sum(1 for _, _, hit in outcomes if hit),
+            "p50_ms": round(statistics.median(latencies), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "max_ms": round(latencies[-1], 3),
+            "throughput_rps": round(len(outcomes) / wall, 1),
+        }
+
+    def cleanup(self):
+        # Through the ORM: exports cannot be deleted over the API. Rows made
+        # on a server with a different database are left for it to clean up
+        prefix = f"BENCH-{self.run_id}-"
+        for model in (OutShipment, InShipment):
+            model.objects.filter(sub_bill_number__startswith=prefix).delete()
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from consumers.layers import SQLiteChannelLayer
+
+
+GROUP = "benchmark"
+
+
+def _receiver(path, connections, expected, ready, results):
+    """One 'daphne worker': ``connections`` channels in the group, recording delivery latency"""
+    async def main():
+        layer = SQLiteChannelLayer(path=path, capacity=expected + 1)
+        channels = [await layer.new_channel() for _ in range(connections)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.release()
+
+        async def drain(channel):
+            latencies = []
+            while len(latencies) < expected:
+                message = await layer.receive(channel)
+                latencies.append(time.time() - message["sent"])
+            return latencies
+
+        try:
+            gathered = await asyncio.wait_for(asyncio.gather(*(drain(channel) for channel in channels)), 120)
+            results.put([latency for latencies in gathered for latency in latencies])
+        except asyncio.TimeoutError:
+            results.put(None)
+        await layer.close()
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure group_send latency and throughput of the SQLite channel layer across processes: "
+        "receiver processes hold the connections and a separate sender broadcasts to the group"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=2, help="Receiving worker processes (default 2)")
+        parser.add_argument("--connections", type=int, default=25, help="Channels per worker (default 25)")
+        parser.add_argument("--messages", type=int, default=500, help="group_send calls (default 500)")
+        parser.add_argument("--rate", type=float, default=0, help="group_send calls per second; 0 sends as fast as possible")
+
+    def handle(self, *args, **options):
+        processes, connections, messages = options["processes"], options["connections"], options["messages"]
+        if min(processes, connections, messages) <= 0:
+            raise CommandError("--processes, --connections and --messages must be positive")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "channels.sqlite3")
+            context = multiprocessing.get_context("fork")
+            ready, results = context.Semaphore(0), context.Queue()
+            workers = [
+                context.Process(target=_receiver, args=(path, connections, messages, ready, results))
+                for _ in range(processes)
+            ]
+            for worker in workers:
+                worker.start()
+            for _ in workers:
+                ready.acquire()
+
+            send_time = asyncio.run(self.send(path, messages, options["rate"]))
+            latencies = []
+            for _ in workers:
+                received = results.get()
+                if received is None:
+                    raise CommandError("A receiver timed out before getting every message")
+                latencies.extend(received)
+            total = time.perf_counter() - self.started
+            for worker in workers:
+                worker.join()
+
+        deliveries = len(latencies)
+        latencies.sort()
+        self.stdout.write(
+            f"{messages} group_send x {processes * connections} channels in {processes} processes "
+            f"= {deliveries} deliveries"
+        )
+        self.stdout.write(f"send:     {messages / send_time:,.0f} group_send/s")
+        self.stdout.write(f"delivery: {deliveries / total:,.0f} messages/s")
+        self.stdout.write(
+            "latency:  "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms  "
+            f"p95 {latencies[int(deliveries * 0.95) - 1] * 1000:.1f}ms  "
+            f"p99 {latencies[int(deliveries * 0.99) - 1] * 1000:.1f}ms  "
+            f"max {latencies[-1] * 1000:.1f}ms"
+        )
+
+    async def send(self, path, messages, rate):
+        layer = SQLiteChannelLayer(path=path)
+        interval = 1 / rate if rate else 0
+        self.started = time.perf_counter()
+        for number in range(messages):
+            await layer.group_send(GROUP, {"type": "benchmark", "number": number, "sent": time.time()})
+            if interval:
+                await asyncio.sleep(interval)
+        return time.perf_counter() - self.started
@@ -0,0 +1,122 @@
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api import search
+from api.listing import ValuesListSerializer
+from api.models import InShipment, OutShipment
+from api.serializers import InShipmentSerializer, OutShipmentSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the ModelSerializer list path with the values()-based one on generated shipments. "
+        "Rows are inserted inside a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            default="1000,10000,100000",
+            help="Comma-separated row counts to benchmark (default 1000,10000,100000)",
+        )
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the best one is reported")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options["rows"].split(","))
+        except ValueError:
+            raise CommandError("--rows must be a comma-separated list of integers")
+        if not sizes or sizes[0] <= 0:
+            raise CommandError("--rows must be positive")
+
+        try:
+            with transaction.atomic():
+                self.run(sizes, options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, sizes, repeat):
+        self.stdout.write(f"{'model':<14}{'rows':>9}{'serializer':>13}{'values':>11}{'speedup':>10}")
+        inserted = 0
+        for size in sizes:
+            self.insert(inserted, size)
+            inserted = size
+            for model, serializer_class in ((InShipment, InShipmentSerializer), (OutShipment, OutShipmentSerializer)):
+                queryset = model.objects.order_by("-created_at", "id")[:size]
+                reader = ValuesListSerializer(serializer_class(), keep=["created_at"])
+
+                old, old_time = self.measure(lambda: serializer_class(queryset, many=True).data, repeat)
+                new, new_time = self.measure(lambda: reader.serialize(reader.queryset(queryset)), repeat)
+                if JSONRenderer().render(old) != JSONRenderer().render(new):
+                    raise CommandError(f"{model.__name__}: the two paths rendered different JSON")
+
+                self.stdout.write(
+                    f"{model._meta.db_table:<14}{size:>9}{old_time * 1000:>11.0f}ms"
+                    f"{new_time * 1000:>9.0f}ms{old_time / new_time:>9.1f}x"
+                )
+
+    def measure(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = build()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def insert(self, start, stop):
+        """Add inbound shipments ``start..stop-1`` with one partial export each"""
+        in_shipments = []
+        for number in range(start, stop):
+            in_shipment = InShipment(
+                bill_number=f"BENCH-{number // 10}",
+                sub_bill_number=f"BENCH-IN-{number}",
+                arrival_date=date(2025, 1, 1) + timedelta(days=number % 365),
+                company_name=f"شركة {number % 50}",
+                package_count=10,
+                exported_count=1,
+                weight=Decimal(number % 1000) / 4,
+                destination=f"وجهة {number % 20}",
+                payment_fees=Decimal("150.25"),
+                ground_fees=Decimal("12.50"),
+                customs_certificate=f"CC-{number}",
+                contract_status="نهائي",
+                disbursement_date=date(2025, 6, 1) if number % 3 == 0 else None,
+                receiver_name="مستلم",
+            )
+            search.populate_lookup_fields(in_shipment, "in_shipment")
+            in_shipments.append(in_shipment)
+        in_shipments = InShipment.objects.bulk_create(in_shipments, batch_size=1000)
+
+        out_shipments = []
+        for in_shipment in in_shipments:
+            out_shipment = OutShipment(
+                in_shipment=in_shipment,
+                bill_number=in_shipment.bill_number,
+                sub_bill_number=in_shipment.sub_bill_number.replace("-IN-", "-OUT-"),
+                arrival_date=in_shipment.arrival_date,
+                export_date=in_shipment.arrival_date + timedelta(days=7),
+                company_name=in_shipment.company_name,
+                package_count=1,
+                weight=in_shipment.weight,
+                destination=in_shipment.destination,
+                payment_fees=in_shipment.payment_fees,
+                ground_fees=in_shipment.ground_fees,
+                customs_certificate=in_shipment.customs_certificate,
+                contract_status=in_shipment.contract_status,
+                disbursement_date=in_shipment.disbursement_date,
+                receiver_name=in_shipment.receiver_name,
+            )
+            search.populate_lookup_fields(out_shipment, "out_shipment")
+            out_shipments.append(out_shipment)
+        OutShipment.objects.bulk_create(out_shipments, batch_size=1000)
@@ -0,0 +1,71 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import bulk
+from api.dispatch import flush_dispatcher
+from api.signals import broadcast_event
+
+
+class Command(BaseCommand):
+    help = (
+        "Import historical inbound shipments from an NDJSON file (one JSON object per line). "
+        "Rows are validated and inserted in chunks, each in its own transaction, and progress "
+        "is checkpointed so an interrupted import resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file to import")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per transaction (default 1000)")
+        parser.add_argument(
+            "--checkpoint",
+            help="Checkpoint file (default: <path>.checkpoint)",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and import from the first line",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        checkpoint = options["checkpoint"] or f"{path}.checkpoint"
+        if options["chunk_size"] <= 0:
+            raise CommandError("--chunk-size must be positive")
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+
+        start_line = 0
+        if not options["restart"] and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                start_line = json.load(fh)["line"]
+            self.stdout.write(f"Resuming after line {start_line} ({checkpoint})")
+
+        def save_checkpoint(report):
+            with open(checkpoint, "w") as fh:
+                json.dump({"path": path, "line": report.line, "imported": report.imported, "failed": report.failed}, fh)
+            self.stdout.write(
+                f"line {report.line}: {report.imported} imported, {report.failed} failed, "
+                f"{report.rows_per_second:.0f} rows/s"
+            )
+
+        with open(path, "rb") as fh:
+            report = bulk.import_ndjson(fh, options["chunk_size"], start_line, on_chunk=save_checkpoint)
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['index']}: {json.dumps(error['errors'], ensure_ascii=False)}")
+        if report.failed > len(report.errors):
+            self.stderr.write(f"... {report.failed - len(report.errors)} more failed rows not shown")
+
+        if report.imported:
+            broadcast_event("in_shipment", "imported", count=report.imported)
+            # The dispatcher thread dies with the process: send the event now
+            flush_dispatcher()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.imported} rows ({report.failed} failed) in {report.elapsed:.1f}s "
+            f"- {report.rows_per_second:.0f} rows/s"
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import aggregates
+from api.models import InShipment, OutShipment
+
+
+class Command(BaseCommand):
+    help = "Rebuild the running shipment totals and time-bucketed rollups from scratch and verify them against the shipment tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the stored totals and rollups, do not rewrite them",
+        )
+
+    def handle(self, *args, **options):
+        failed = False
+        for model in (InShipment, OutShipment):
+            key = aggregates.model_key(model)
+            if not options["check"]:
+                aggregates.rebuild_totals(model)
+                aggregates.rebuild_rollups(model)
+                self.stdout.write(f"Rebuilt totals and rollups for {key}")
+
+            mismatches = aggregates.verify_totals(model)
+            for field, (stored, actual) in mismatches.items():
+                self.stderr.write(f"{key}.{field}: stored={stored} actual={actual}")
+
+            rollup_mismatches = aggregates.verify_rollups(model)
+            for row_key, (stored, actual) in rollup_mismatches.items():
+                self.stderr.write(f"{key} rollup {row_key}: stored={stored} actual={actual}")
+
+            if mismatches or rollup_mismatches:
+                failed = True
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Totals and rollups for {key} verified"))
+
+        if failed:
+            raise CommandError("Shipment totals do not match the shipment tables")
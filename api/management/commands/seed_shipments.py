@@ -0,0 +1,170 @@
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api import aggregates, cache, search
+from api.models import Company, Destination, InShipment, OutShipment
+
+
+CONTRACT_STATUSES = ("نهائي", "مؤقت", "تحت المراجعة", "ملغي")
+FIRST_ARRIVAL = date(2024, 1, 1)
+ARRIVAL_DAYS = 730
+
+# Bill numbers shared by this many consecutive inbound shipments
+SUBS_PER_BILL = 20
+
+# Out shipments per exported inbound shipment
+MAX_PARTS = 3
+
+
+def money(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic synthetic dataset: companies, destinations, inbound shipments and "
+        "partial exports. Rows are inserted with bulk_create, one transaction per batch, so it scales "
+        "to millions of rows; totals and rollups are rebuilt once at the end. The same --seed always "
+        "produces the same rows, all tagged with a SEED<seed>- prefix."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--in-shipments", type=int, default=10000, help="Inbound shipments (default 10000)")
+        parser.add_argument("--companies", type=int, default=50, help="Companies (default 50)")
+        parser.add_argument("--destinations", type=int, default=20, help="Destinations (default 20)")
+        parser.add_argument(
+            "--exported", type=float, default=0.6,
+            help="Share of inbound shipments with one to three partial exports (default 0.6)",
+        )
+        parser.add_argument("--seed", type=int, default=1, help="Random seed (default 1)")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Inbound shipments per transaction (default 5000)")
+        parser.add_argument("--clear", action="store_true", help="Delete the rows of an earlier run with the same --seed first")
+
+    def handle(self, *args, **options):
+        if min(options["in_shipments"], options["companies"], options["destinations"], options["batch_size"]) <= 0:
+            raise CommandError("--in-shipments, --companies, --destinations and --batch-size must be positive")
+        if not 0 <= options["exported"] <= 1:
+            raise CommandError("--exported must be between 0 and 1")
+
+        prefix = f"SEED{options['seed']}-"
+        existing = InShipment.objects.filter(sub_bill_number__startswith=prefix).exists()
+        if existing and not options["clear"]:
+            raise CommandError(f"Rows from --seed {options['seed']} already exist; pass --clear to replace them")
+        if existing:
+            self.clear(prefix)
+
+        rng = random.Random(options["seed"])
+        companies = self.ensure_names(Company, [f"{prefix}شركة {number:04d}" for number in range(options["companies"])])
+        destinations = self.ensure_names(
+            Destination, [f"{prefix}وجهة {number:04d}" for number in range(options["destinations"])]
+        )
+
+        started = time.perf_counter()
+        total, batch_size = options["in_shipments"], options["batch_size"]
+        in_count = out_count = 0
+        for start in range(0, total, batch_size):
+            with transaction.atomic():
+                created_in, created_out = self.insert_batch(
+                    rng, prefix, range(start, min(start + batch_size, total)), companies, destinations, options["exported"]
+                )
+            in_count += created_in
+            out_count += created_out
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{in_count}/{total} inbound, {out_count} outbound ({(in_count + out_count) / elapsed:,.0f} rows/s)"
+            )
+
+        for model in (InShipment, OutShipment):
+            aggregates.rebuild_totals(model)
+            aggregates.rebuild_rollups(model)
+        for tag in ("in_shipment", "out_shipment", "company", "destination"):
+            cache.invalidate(tag)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {in_count} inbound and {out_count} outbound shipments in {time.perf_counter() - started:.1f}s"
+        ))
+
+    def ensure_names(self, model, names):
+        """``[(name, id)]`` for ``names``, creating the missing rows"""
+        model.objects.bulk_create([model(name=name) for name in names], ignore_conflicts=True)
+        ids = dict(model.objects.filter(name__in=names).values_list("name", "id"))
+        return [(name, ids[name]) for name in names]
+
+    def clear(self, prefix):
+        # Raw deletes: per-row signals would take hours on a large run, and
+        # the totals and rollups are rebuilt afterwards anyway
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model in (OutShipment, InShipment):
+                cursor.execute(
+                    f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)} WHERE sub_bill_number LIKE %s",
+                    [f"{prefix}%"],
+                )
+                self.stdout.write(f"Deleted {cursor.rowcount} {model._meta.verbose_name_plural.lower()}")
+
+    def insert_batch(self, rng, prefix, numbers, companies, destinations, exported):
+        in_shipments, parts = [], []
+        for number in numbers:
+            company_name, company_id = companies[rng.randrange(len(companies))]
+            destination_name, destination_id = destinations[rng.randrange(len(destinations))]
+            arrival_date = FIRST_ARRIVAL + timedelta(days=rng.randrange(ARRIVAL_DAYS))
+            package_count = rng.randint(1, 50)
+            split = []
+            if rng.random() < exported:
+                shipped = rng.randint(1, package_count)
+                cuts = sorted(rng.sample(range(1, shipped), min(shipped, MAX_PARTS) - 1)) if shipped > 1 else []
+                split = [high - low for low, high in zip([0, *cuts], [*cuts, shipped])]
+            in_shipment = InShipment(
+                bill_number=f"{prefix}MAWB-{number // SUBS_PER_BILL:07d}",
+                sub_bill_number=f"{prefix}IN-{number:08d}",
+                arrival_date=arrival_date,
+                company_name=company_name,
+                company_ref_id=company_id,
+                package_count=package_count,
+                exported_count=sum(split),
+                export=sum(split) == package_count,
+                weight=money(rng, 1, 5000),
+                destination=destination_name,
+                destination_ref_id=destination_id,
+                payment_fees=money(rng, 10, 2000),
+                ground_fees=money(rng, 5, 500),
+                customs_certificate=f"CC-{number:08d}",
+                contract_status=rng.choice(CONTRACT_STATUSES),
+                disbursement_date=arrival_date + timedelta(days=rng.randint(1, 60)) if rng.random() < 0.5 else None,
+                receiver_name=f"مستلم {rng.randrange(1000):03d}",
+            )
+            search.populate_lookup_fields(in_shipment, "in_shipment")
+            in_shipments.append(in_shipment)
+            parts.append([(count, rng.randint(0, 30)) for count in split])
+
+        in_shipments = InShipment.objects.bulk_create(in_shipments)
+
+        out_shipments = []
+        for in_shipment, shipment_parts in zip(in_shipments, parts):
+            for index, (package_count, days) in enumerate(shipment_parts):
+                out_shipment = OutShipment(
+                    in_shipment=in_shipment,
+                    bill_number=in_shipment.bill_number,
+                    sub_bill_number=f"{in_shipment.sub_bill_number.replace('-IN-', '-OUT-')}-{index}",
+                    arrival_date=in_shipment.arrival_date,
+                    export_date=in_shipment.arrival_date + timedelta(days=days),
+                    company_name=in_shipment.company_name,
+                    company_ref_id=in_shipment.company_ref_id,
+                    package_count=package_count,
+                    weight=(in_shipment.weight * package_count / in_shipment.package_count).quantize(Decimal("0.01")),
+                    destination=in_shipment.destination,
+                    destination_ref_id=in_shipment.destination_ref_id,
+                    payment_fees=in_shipment.payment_fees,
+                    ground_fees=in_shipment.ground_fees,
+                    customs_certificate=in_shipment.customs_certificate,
+                    contract_status=in_shipment.contract_status,
+                    disbursement_date=in_shipment.disbursement_date,
+                    receiver_name=in_shipment.receiver_name,
+                )
+                search.populate_lookup_fields(out_shipment, "out_shipment")
+                out_shipments.append(out_shipment)
+        OutShipment.objects.bulk_create(out_shipments, batch_size=1000)
+        return len(in_shipments), len(out_shipments)
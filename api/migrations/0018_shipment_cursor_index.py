@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_remove_outshipment_in_shipments_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='inshipment',
+            options={'ordering': ['-created_at', 'id'], 'verbose_name': 'Inbound Shipment', 'verbose_name_plural': 'Inbound Shipments'},
+        ),
+        migrations.AlterModelOptions(
+            name='outshipment',
+            options={'ordering': ['-created_at', 'id'], 'verbose_name': 'Outbound Shipment', 'verbose_name_plural': 'Outbound Shipments'},
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['-created_at', 'id'], name='in_ship_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['-created_at', 'id'], name='out_ship_created_id_idx'),
+        ),
+    ]
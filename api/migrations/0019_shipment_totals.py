@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:05
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def populate_totals(apps, schema_editor):
+    ShipmentTotals = apps.get_model('api', 'ShipmentTotals')
+    for key, model_name in (('in_shipment', 'InShipment'), ('out_shipment', 'OutShipment')):
+        model = apps.get_model('api', model_name)
+        totals = model.objects.aggregate(
+            total_shipments=Count('id'),
+            total_weight=Sum('weight'),
+            total_payment_fees=Sum('payment_fees'),
+            total_ground_fees=Sum('ground_fees'),
+            last_updated=Max('updated_at'),
+        )
+        ShipmentTotals.objects.update_or_create(
+            model=key,
+            defaults={field: value or 0 for field, value in totals.items() if field != 'last_updated'}
+            | {'last_updated': totals['last_updated']},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_shipment_cursor_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShipmentTotals',
+            fields=[
+                ('model', models.CharField(help_text='in_shipment / out_shipment', max_length=32, primary_key=True, serialize=False)),
+                ('total_shipments', models.BigIntegerField(default=0)),
+                ('total_weight', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_payment_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_ground_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('last_updated', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Shipment Totals',
+                'verbose_name_plural': 'Shipment Totals',
+                'db_table': 'shipment_totals',
+            },
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:06
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    sources = (
+        ('in_shipment', 'InShipment', 'arrival_date'),
+        ('out_shipment', 'OutShipment', 'export_date'),
+    )
+    for rollup_name, truncate in (('DailyShipmentRollup', F), ('MonthlyShipmentRollup', TruncMonth)):
+        rollup = apps.get_model('api', rollup_name)
+        for key, model_name, bucket_field in sources:
+            model = apps.get_model('api', model_name)
+            rows = (
+                model.objects.filter(**{f'{bucket_field}__isnull': False})
+                .order_by()
+                .values(rollup_bucket=truncate(bucket_field), company=F('company_name'), dest=F('destination'))
+                .annotate(
+                    shipments=Count('id'),
+                    weight=Sum('weight'),
+                    payment_fees=Sum('payment_fees'),
+                    ground_fees=Sum('ground_fees'),
+                )
+            )
+            rollup.objects.bulk_create(
+                [
+                    rollup(
+                        model=key,
+                        bucket=row['rollup_bucket'],
+                        company_name=row['company'],
+                        destination=row['dest'],
+                        total_shipments=row['shipments'],
+                        total_weight=row['weight'] or 0,
+                        total_payment_fees=row['payment_fees'] or 0,
+                        total_ground_fees=row['ground_fees'] or 0,
+                    )
+                    for row in rows
+                ],
+                batch_size=1000,
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_shipment_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyShipmentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='in_shipment / out_shipment', max_length=32)),
+                ('bucket', models.DateField(help_text='Start of the bucket (day, or first day of the month)')),
+                ('company_name', models.CharField(max_length=255)),
+                ('destination', models.CharField(max_length=255)),
+                ('total_shipments', models.BigIntegerField(default=0)),
+                ('total_weight', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_payment_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_ground_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'db_table': 'shipment_rollups_daily',
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('model', 'bucket', 'company_name', 'destination'), name='shipment_rollup_daily_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyShipmentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(help_text='in_shipment / out_shipment', max_length=32)),
+                ('bucket', models.DateField(help_text='Start of the bucket (day, or first day of the month)')),
+                ('company_name', models.CharField(max_length=255)),
+                ('destination', models.CharField(max_length=255)),
+                ('total_shipments', models.BigIntegerField(default=0)),
+                ('total_weight', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_payment_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('total_ground_fees', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+            options={
+                'db_table': 'shipment_rollups_monthly',
+                'ordering': ['bucket'],
+                'constraints': [models.UniqueConstraint(fields=('model', 'bucket', 'company_name', 'destination'), name='shipment_rollup_monthly_key')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,135 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:07
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Frozen copies of api.search as of this migration: later changes to the
+# live module must not change what this migration does.
+
+BATCH_SIZE = 1000
+
+SOURCES = (
+    ('InShipment', ['company_name', 'sub_bill_number', 'bill_number', 'destination', 'contract_status']),
+    ('OutShipment', ['company_name', 'sub_bill_number', 'bill_number', 'destination', 'contract_status', 'in_shipment__bill_number']),
+)
+
+DOCUMENT_SEPARATOR = '\n'
+
+SEARCH_TABLES = ('in_shipments', 'out_shipments')
+
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+
+ARABIC_FOLDING = str.maketrans({
+    '\u0623': '\u0627',
+    '\u0625': '\u0627',
+    '\u0622': '\u0627',
+    '\u0671': '\u0627',
+    '\u0649': '\u064a',
+    '\u0626': '\u064a',
+    '\u06cc': '\u064a',
+    '\u0624': '\u0648',
+    '\u0629': '\u0647',
+    '\u06a9': '\u0643',
+    '\u0640': None,
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},
+})
+
+
+def normalize_text(value):
+    if value is None:
+        return ''
+    text = unicodedata.normalize('NFKC', str(value))
+    text = ARABIC_MARKS.sub('', text)
+    return text.translate(ARABIC_FOLDING).casefold()
+
+
+def sqlite_search_statements(table):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"search_document, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_document ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+        f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def backfill_search_documents(apps, schema_editor):
+    for model_name, fields in SOURCES:
+        model = apps.get_model('api', model_name)
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.filter(id__gt=last_id).order_by('id').values('id', *fields)[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            model.objects.bulk_update(
+                [
+                    model(
+                        id=row['id'],
+                        search_document=DOCUMENT_SEPARATOR.join(normalize_text(row[field]) for field in fields),
+                    )
+                    for row in rows
+                ],
+                ['search_document'],
+            )
+            last_id = rows[-1]['id']
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if connection.vendor == 'sqlite':
+                for sql in sqlite_search_statements(table):
+                    cursor.execute(sql)
+            elif connection.vendor == 'postgresql':
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_search_trgm '
+                    f'ON {table} USING gin (search_document gin_trgm_ops)'
+                )
+
+
+def remove_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if connection.vendor == 'sqlite':
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+            elif connection.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_search_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_shipment_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inshipment',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Normalized text indexed for search'),
+        ),
+        migrations.AddField(
+            model_name='outshipment',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Normalized text indexed for search'),
+        ),
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    # Walk the tables in primary-key batches so large tables are never loaded at once
+    for model_name in ('InShipment', 'OutShipment'):
+        model = apps.get_model('api', model_name)
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'bill_number', 'sub_bill_number')[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            model.objects.bulk_update(
+                [
+                    model(
+                        id=pk,
+                        bill_number_key=(bill_number or '').upper(),
+                        sub_bill_number_key=(sub_bill_number or '').upper(),
+                    )
+                    for pk, bill_number, sub_bill_number in rows
+                ],
+                ['bill_number_key', 'sub_bill_number_key'],
+            )
+            last_id = rows[-1][0]
+
+
+def key_field(source):
+    return models.CharField(default='', editable=False, help_text=f'{source} normalized for case-insensitive lookups', max_length=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_shipment_search_index'),
+    ]
+
+    # Columns are added unindexed, backfilled, and only then indexed so the
+    # backfill does not pay for index maintenance row by row. The indexes are
+    # added with AddIndex: an AlterField to db_index=True would rebuild each
+    # table on SQLite. They lead with the key and follow the default list
+    # ordering, so a filtered first page needs no sort.
+    operations = [
+        migrations.AddField(
+            model_name='inshipment',
+            name='bill_number_key',
+            field=key_field('bill_number'),
+        ),
+        migrations.AddField(
+            model_name='inshipment',
+            name='sub_bill_number_key',
+            field=key_field('sub_bill_number'),
+        ),
+        migrations.AddField(
+            model_name='outshipment',
+            name='bill_number_key',
+            field=key_field('bill_number'),
+        ),
+        migrations.AddField(
+            model_name='outshipment',
+            name='sub_bill_number_key',
+            field=key_field('sub_bill_number'),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['bill_number_key', '-created_at', 'id'], name='in_ship_bill_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['sub_bill_number_key', '-created_at', 'id'], name='in_ship_sub_bill_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['bill_number_key', '-created_at', 'id'], name='out_ship_bill_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['sub_bill_number_key', '-created_at', 'id'], name='out_ship_sub_bill_key_idx'),
+        ),
+    ]
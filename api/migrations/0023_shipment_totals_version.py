@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_bill_number_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shipmenttotals',
+            name='version',
+            field=models.BigIntegerField(default=0, help_text='Bumped by every write to the shipment table; used for ETags'),
+        ),
+    ]
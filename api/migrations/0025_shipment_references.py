@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def reference_field(to, help_text, db_index):
+    return models.ForeignKey(blank=True, db_index=db_index, help_text=help_text, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=to)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_shipment_events'),
+    ]
+
+    # Added unindexed; 0026 backfills them and 0027 adds composite indexes
+    operations = [
+        migrations.AddField(
+            model_name='inshipment',
+            name='company_ref',
+            field=reference_field('api.company', 'الشركة', db_index=False),
+        ),
+        migrations.AddField(
+            model_name='inshipment',
+            name='destination_ref',
+            field=reference_field('api.destination', 'الجهة', db_index=False),
+        ),
+        migrations.AddField(
+            model_name='outshipment',
+            name='company_ref',
+            field=reference_field('api.company', 'الشركة', db_index=False),
+        ),
+        migrations.AddField(
+            model_name='outshipment',
+            name='destination_ref',
+            field=reference_field('api.destination', 'الجهة', db_index=False),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:34
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+BATCH_SIZE = 1000
+
+# reference column -> (name column, referenced model)
+REFERENCES = {
+    'company_ref': ('company_name', 'Company'),
+    'destination_ref': ('destination', 'Destination'),
+}
+
+
+def backfill_references(apps, schema_editor):
+    # Each primary-key batch commits on its own and only fills empty
+    # references, so an interrupted run picks up where it stopped
+    for model_name in ('InShipment', 'OutShipment'):
+        model = apps.get_model('api', model_name)
+        last_id = 0
+        while True:
+            ids = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+            if not ids:
+                break
+            batch = model.objects.filter(id__gte=ids[0], id__lte=ids[-1])
+            for field, (name_field, target_name) in REFERENCES.items():
+                target = apps.get_model('api', target_name)
+                batch.filter(**{f'{field}__isnull': True}).update(**{
+                    field: Subquery(target.objects.filter(name=OuterRef(name_field)).values('id')[:1]),
+                })
+            last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0025_shipment_references'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_references, migrations.RunPython.noop),
+    ]
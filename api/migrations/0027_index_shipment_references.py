@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_backfill_shipment_references'),
+    ]
+
+    # Composites with the default list ordering rather than db_index on the
+    # foreign keys: they serve the same lookups, a filtered first page needs
+    # no sort, and AddIndex does not rebuild the table on SQLite.
+    operations = [
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['company_ref', '-created_at', 'id'], name='in_ship_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['destination_ref', '-created_at', 'id'], name='in_ship_dest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['company_ref', '-created_at', 'id'], name='out_ship_company_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['destination_ref', '-created_at', 'id'], name='out_ship_dest_created_idx'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-18 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_index_shipment_references'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['arrival_date', 'id'], name='in_ship_arrival_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['disbursement_date', 'id'], name='in_ship_disbursement_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['payment_fees', 'id'], name='in_ship_fees_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['export', '-created_at', 'id'], name='in_ship_export_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inshipment',
+            index=models.Index(fields=['contract_status', '-created_at', 'id'], name='in_ship_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['export_date', 'id'], name='out_ship_export_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['arrival_date', 'id'], name='out_ship_arrival_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['disbursement_date', 'id'], name='out_ship_disbursement_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['payment_fees', 'id'], name='out_ship_fees_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outshipment',
+            index=models.Index(fields=['contract_status', '-created_at', 'id'], name='out_ship_status_created_idx'),
+        ),
+    ]
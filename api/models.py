@@ -49,12 +49,37 @@ class BaseShipment(models.Model):
     disbursement_date = models.DateField(blank=True, null=True, help_text="تاريخ الصرف (اختياري)")
     receiver_name = models.CharField(max_length=255, help_text="المستلم")
     ground_fees = models.DecimalField(max_digits=10, decimal_places=2, help_text="رسوم الأرضية")
+    bill_number_key = models.CharField(max_length=100, default='', editable=False, help_text="bill_number normalized for case-insensitive lookups")
+    sub_bill_number_key = models.CharField(max_length=100, default='', editable=False, help_text="sub_bill_number normalized for case-insensitive lookups")
+    search_document = models.TextField(blank=True, default='', editable=False, help_text="Normalized text indexed for search")
+    # Resolved from company_name / destination on every write; null while no row has that name.
+    # Indexed by the (ref, -created_at, id) composites in each model's Meta
+    company_ref = models.ForeignKey(Company, blank=True, null=True, db_index=False, on_delete=models.SET_NULL, related_name='+', help_text="الشركة")
+    destination_ref = models.ForeignKey(Destination, blank=True, null=True, db_index=False, on_delete=models.SET_NULL, related_name='+', help_text="الجهة")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Columns recomputed from a source column on every save (see
+    # api.signals.refresh_lookup_fields); save(update_fields=...) naming the
+    # source writes them as well
+    DERIVED_FIELDS = {
+        'bill_number': ('bill_number_key', 'search_document'),
+        'sub_bill_number': ('sub_bill_number_key', 'search_document'),
+        'company_name': ('search_document', 'company_ref'),
+        'destination': ('search_document', 'destination_ref'),
+        'contract_status': ('search_document',),
+    }
+
     class Meta:
         abstract = True
-        ordering = ['-created_at']
+        ordering = ['-created_at', 'id']
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            for name in list(update_fields):
+                update_fields.update(self.DERIVED_FIELDS.get(name, ()))
+        super().save(*args, update_fields=update_fields, **kwargs)
 
 
 # In Shipments model (Inbound Shipments)
@@ -65,7 +90,22 @@ class InShipment(BaseShipment):
     
     class Meta:
         db_table = 'in_shipments'
-        ordering = ['-created_at']
+        ordering = ['-created_at', 'id']
+        # Every list ordering ends with id (see ShipmentCursorPagination);
+        # filters get composites with the default ordering so a filtered
+        # first page reads the index in order and stops after page_size rows
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='in_ship_created_id_idx'),
+            models.Index(fields=['arrival_date', 'id'], name='in_ship_arrival_id_idx'),
+            models.Index(fields=['disbursement_date', 'id'], name='in_ship_disbursement_id_idx'),
+            models.Index(fields=['payment_fees', 'id'], name='in_ship_fees_id_idx'),
+            models.Index(fields=['export', '-created_at', 'id'], name='in_ship_export_created_idx'),
+            models.Index(fields=['contract_status', '-created_at', 'id'], name='in_ship_status_created_idx'),
+            models.Index(fields=['bill_number_key', '-created_at', 'id'], name='in_ship_bill_key_idx'),
+            models.Index(fields=['sub_bill_number_key', '-created_at', 'id'], name='in_ship_sub_bill_key_idx'),
+            models.Index(fields=['company_ref', '-created_at', 'id'], name='in_ship_company_created_idx'),
+            models.Index(fields=['destination_ref', '-created_at', 'id'], name='in_ship_dest_created_idx'),
+        ]
         verbose_name = 'Inbound Shipment'
         verbose_name_plural = 'Inbound Shipments'
 
@@ -83,11 +123,111 @@ class OutShipment(BaseShipment):
     )
     export_date = models.DateField(blank=True, null=True, help_text="تاريخ التصدير")
 
+    # The search document embeds the inbound shipment's bill number
+    DERIVED_FIELDS = {
+        **BaseShipment.DERIVED_FIELDS,
+        'in_shipment': ('search_document',),
+        'in_shipment_id': ('search_document',),
+    }
+
     class Meta:
         db_table = 'out_shipments'
-        ordering = ['-created_at']
+        ordering = ['-created_at', 'id']
+        indexes = [
+            models.Index(fields=['-created_at', 'id'], name='out_ship_created_id_idx'),
+            models.Index(fields=['export_date', 'id'], name='out_ship_export_date_id_idx'),
+            models.Index(fields=['arrival_date', 'id'], name='out_ship_arrival_id_idx'),
+            models.Index(fields=['disbursement_date', 'id'], name='out_ship_disbursement_id_idx'),
+            models.Index(fields=['payment_fees', 'id'], name='out_ship_fees_id_idx'),
+            models.Index(fields=['contract_status', '-created_at', 'id'], name='out_ship_status_created_idx'),
+            models.Index(fields=['bill_number_key', '-created_at', 'id'], name='out_ship_bill_key_idx'),
+            models.Index(fields=['sub_bill_number_key', '-created_at', 'id'], name='out_ship_sub_bill_key_idx'),
+            models.Index(fields=['company_ref', '-created_at', 'id'], name='out_ship_company_created_idx'),
+            models.Index(fields=['destination_ref', '-created_at', 'id'], name='out_ship_dest_created_idx'),
+        ]
         verbose_name = 'Outbound Shipment'
         verbose_name_plural = 'Outbound Shipments'
 
     def __str__(self):
-        return f"Out Shipment {self.sub_bill_number} - {self.company_name}"
\ No newline at end of file
+        return f"Out Shipment {self.sub_bill_number} - {self.company_name}"
+
+class ShipmentTotals(models.Model):
+    """Running totals for one shipment model, kept in step with every write"""
+    model = models.CharField(primary_key=True, max_length=32, help_text="in_shipment / out_shipment")
+    total_shipments = models.BigIntegerField(default=0)
+    total_weight = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_payment_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_ground_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    last_updated = models.DateTimeField(blank=True, null=True)
+    version = models.BigIntegerField(default=0, help_text="Bumped by every write to the shipment table; used for ETags")
+
+    class Meta:
+        db_table = 'shipment_totals'
+        verbose_name = 'Shipment Totals'
+        verbose_name_plural = 'Shipment Totals'
+
+    def __str__(self):
+        return f"Totals {self.model}"
+
+
+class BaseShipmentRollup(models.Model):
+    """Pre-aggregated shipment totals for one time bucket, company and destination"""
+    model = models.CharField(max_length=32, help_text="in_shipment / out_shipment")
+    bucket = models.DateField(help_text="Start of the bucket (day, or first day of the month)")
+    company_name = models.CharField(max_length=255)
+    destination = models.CharField(max_length=255)
+    total_shipments = models.BigIntegerField(default=0)
+    total_weight = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_payment_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    total_ground_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket']
+
+
+class DailyShipmentRollup(BaseShipmentRollup):
+    class Meta:
+        db_table = 'shipment_rollups_daily'
+        ordering = ['bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model', 'bucket', 'company_name', 'destination'],
+                name='shipment_rollup_daily_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.bucket} {self.company_name} - {self.destination}"
+
+
+class MonthlyShipmentRollup(BaseShipmentRollup):
+    class Meta:
+        db_table = 'shipment_rollups_monthly'
+        ordering = ['bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['model', 'bucket', 'company_name', 'destination'],
+                name='shipment_rollup_monthly_key',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.bucket:%Y-%m} {self.company_name} - {self.destination}"
+
+
+class ShipmentEvent(models.Model):
+    """
+    Recent WebSocket events, numbered by ``id`` in the order they were
+    committed, so reconnecting clients can replay what they missed. Only the
+    last ``SHIPMENT_EVENTS["LOG_SIZE"]`` rows are kept.
+    """
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'shipment_events'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"Event {self.id} {self.payload.get('model')} {self.payload.get('action')}"
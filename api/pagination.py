@@ -0,0 +1,251 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class ShipmentCursorPagination(BasePagination):
+    """
+    Keyset (cursor) pagination for shipment lists.
+
+    Each page is fetched with a ``WHERE (col1, col2, ...) > (...)`` style
+    predicate on the full ordering tuple instead of an OFFSET, so the cost of
+    a page does not depend on how deep into the list the client is. The
+    ordering always ends with ``id`` which makes every position unique, and
+    the cursor carries the ordering it was issued for, so cursors produced
+    under ``?ordering=`` / ``?search=`` / filters keep working as long as the
+    same parameters are sent back.
+
+    Every ordering can be read off a ``(field, id)`` index in either
+    direction: the ``id`` tie-breaker follows the first field's direction,
+    and NULLs sort as the smallest value (first ascending, last descending)
+    as they do in SQLite's indexes.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['r'])
+
+        queryset = queryset.order_by(*self.get_order_by(reverse))
+        limit = self.page_size + 1
+        if cursor is None:
+            results = list(queryset[:limit])
+        else:
+            position_filter = self.get_position_filter(cursor['p'], reverse)
+            results = []
+            for bound in self.get_seek_bounds(cursor['p'], reverse):
+                results += queryset.filter(bound & position_filter)[:limit - len(results)]
+                if len(results) == limit:
+                    break
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = cursor is not None
+            self.has_next = has_more
+
+        self.first_position = self.get_position(results[0]) if results else None
+        self.last_position = self.get_position(results[-1]) if results else None
+        if not results and cursor is not None:
+            # Empty page reached through a cursor: keep the cursor position so
+            # the client can step back in the opposite direction.
+            self.first_position = self.last_position = cursor['p']
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Use the ordering chosen by ``OrderingFilter`` when the view has one,
+        falling back to the default ordering. ``id`` is always appended as a
+        unique tie-breaker, in the direction of the first field.
+        """
+        ordering = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        if not ordering:
+            return tuple(self.ordering)
+        ordering = tuple({'pk': 'id', '-pk': '-id'}.get(field, field) for field in ordering)
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering += ('-id',) if ordering[0].startswith('-') else ('id',)
+        return ordering
+
+    def get_order_by(self, reverse):
+        order_by = []
+        for field in self.ordering:
+            descending = field.startswith('-')
+            if reverse:
+                descending = not descending
+            name = field.lstrip('-')
+            # NULLs sort as the smallest value, SQLite's own placement, spelled
+            # out for backends that disagree. NOT NULL columns get no modifier.
+            nulls = {}
+            if self.model._meta.get_field(name).null:
+                nulls = {'nulls_last': True} if descending else {'nulls_first': True}
+            expression = F(name)
+            order_by.append(expression.desc(**nulls) if descending else expression.asc(**nulls))
+        return order_by
+
+    def get_position_filter(self, position, reverse):
+        """
+        Build ``(f1 > v1) OR (f1 = v1 AND f2 > v2) OR ...`` for the ordering
+        tuple, honouring each field's direction and NULL placement.
+        """
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            condition |= equal & self._beyond(name, value, descending, reverse)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    def get_seek_bounds(self, position, reverse):
+        """
+        Ranges of the first ordering field that together hold every row past
+        ``position``, in walk order. Each one is ANDed with the position
+        filter so SQLite seeks into the field's index instead of reading it
+        from the start. NULLs are a range of their own because no single
+        comparison matches both them and values.
+        """
+        field = self.ordering[0]
+        name = field.lstrip('-')
+        value = position[0]
+        if field.startswith('-') == reverse:
+            # Walking towards larger values, which is away from the NULLs
+            if value is None:
+                return [Q(**{f'{name}__isnull': True}), Q(**{f'{name}__isnull': False})]
+            return [Q(**{f'{name}__gte': value})]
+        if value is None:
+            return [Q(**{f'{name}__isnull': True})]
+        bounds = [Q(**{f'{name}__lte': value})]
+        if self.model._meta.get_field(name).null:
+            bounds.append(Q(**{f'{name}__isnull': True}))
+        return bounds
+
+    def _beyond(self, name, value, descending, reverse):
+        # NULLs are smaller than every value (see get_order_by)
+        if descending == reverse:
+            if value is None:
+                return Q(**{f'{name}__isnull': False})
+            return Q(**{f'{name}__gt': value})
+        if value is None:
+            return Q(pk__in=[])
+        condition = Q(**{f'{name}__lt': value})
+        if self.model._meta.get_field(name).null:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def get_position(self, item):
+        position = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = item[name] if isinstance(item, dict) else getattr(item, name)
+            position.append(value)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        payload = {
+            'o': list(self.ordering),
+            'p': [self._dump_value(value) for value in position],
+            'r': int(reverse),
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        token = base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            payload = json.loads(raw.decode('utf-8'))
+            if tuple(payload['o']) != self.ordering or len(payload['p']) != len(self.ordering):
+                raise ValueError('cursor ordering mismatch')
+            position = [
+                self._load_value(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, payload['p'])
+            ]
+            return {'p': position, 'r': bool(payload['r'])}
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _dump_value(self, value):
+        if value is None or isinstance(value, (int, str)):
+            return value
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def _load_value(self, name, value):
+        if value is None:
+            return None
+        try:
+            return self.model._meta.get_field(name).to_python(value)
+        except DjangoValidationError as exc:
+            raise ValueError(str(exc))
@@ -0,0 +1,80 @@
+from . import aggregates, cache, search
+from .models import Company, Destination, InShipment, OutShipment
+
+
+# Shipments rewritten per query when a company / destination is renamed
+BATCH_SIZE = 1000
+
+# reference field -> (name field, referenced model)
+REFERENCES = {
+    "company_ref": ("company_name", Company),
+    "destination_ref": ("destination", Destination),
+}
+
+
+def populate_references(instances, previous=None):
+    """
+    Point ``company_ref`` / ``destination_ref`` at the rows named by
+    ``company_name`` / ``destination``, with one query per referenced table
+    for the whole batch. Names without a row leave the reference empty.
+
+    A reference that is already set is kept unless its name changed since
+    ``previous`` (the stored values of a single updated instance), so a
+    save after the company was renamed does not unlink the shipment.
+    """
+    for field, (name_field, target) in REFERENCES.items():
+        pending = [
+            instance for instance in instances
+            if getattr(instance, f"{field}_id") is None
+            or (previous is not None and previous.get(name_field) != getattr(instance, name_field))
+        ]
+        names = {getattr(instance, name_field) for instance in pending}
+        ids = dict(target.objects.filter(name__in=names).values_list("name", "id")) if names else {}
+        for instance in pending:
+            setattr(instance, f"{field}_id", ids.get(getattr(instance, name_field)))
+
+
+def shipments_changed():
+    """
+    Shipment rows were rewritten in bulk (no save signals): bump the totals
+    versions behind the list ETags and drop the cached shipment responses
+    """
+    for model in (InShipment, OutShipment):
+        key = aggregates.model_key(model)
+        aggregates.apply_totals(key)
+        cache.invalidate(key)
+
+
+def rename_shipments(target, field, old_name):
+    """
+    Carry a company / destination rename over to the shipments that
+    reference it: their name column, search document and rollups (which are
+    keyed by name) follow the new name.
+    """
+    name_field = REFERENCES[field][0]
+    renamed = 0
+    for model in (InShipment, OutShipment):
+        shipments = model.objects.filter(**{field: target}).exclude(**{name_field: target.name})
+        if model is OutShipment:
+            shipments = shipments.select_related("in_shipment")
+        changed = []
+        for shipment in shipments.iterator(chunk_size=BATCH_SIZE):
+            setattr(shipment, name_field, target.name)
+            shipment.search_document = search.build_search_document(shipment, aggregates.model_key(model))
+            changed.append(shipment)
+        model.objects.bulk_update(changed, [name_field, "search_document"], batch_size=BATCH_SIZE)
+        if changed:
+            aggregates.rebuild_rollups(model, **{f"{name_field}__in": [old_name, target.name]})
+        renamed += len(changed)
+    if renamed:
+        shipments_changed()
+
+
+def link_shipments(target, field, name):
+    """Attach shipments that name a newly created or renamed company / destination"""
+    name_field = REFERENCES[field][0]
+    linked = 0
+    for model in (InShipment, OutShipment):
+        linked += model.objects.filter(**{f"{field}__isnull": True, name_field: name}).update(**{field: target})
+    if linked:
+        shipments_changed()
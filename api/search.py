@@ -0,0 +1,192 @@
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+
+# Columns folded into ``search_document``; also used as the viewsets' ``search_fields``
+SEARCH_FIELDS = {
+    "in_shipment": ["company_name", "sub_bill_number", "bill_number", "destination", "contract_status"],
+    "out_shipment": ["company_name", "sub_bill_number", "bill_number", "destination", "contract_status", "in_shipment__bill_number"],
+}
+
+# Separates the columns inside a document; search terms never contain it, so
+# a term cannot match across two columns
+DOCUMENT_SEPARATOR = "\n"
+
+# FTS5 trigram tokens are three characters long; shorter terms use LIKE
+FTS_MIN_TERM_LENGTH = 3
+
+# Harakat, Quranic annotation marks and the superscript alef
+ARABIC_MARKS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]")
+
+ARABIC_FOLDING = str.maketrans({
+    "\u0623": "\u0627",  # أ -> ا
+    "\u0625": "\u0627",  # إ -> ا
+    "\u0622": "\u0627",  # آ -> ا
+    "\u0671": "\u0627",  # ٱ -> ا
+    "\u0649": "\u064a",  # ى -> ي
+    "\u0626": "\u064a",  # ئ -> ي
+    "\u06cc": "\u064a",  # ی -> ي
+    "\u0624": "\u0648",  # ؤ -> و
+    "\u0629": "\u0647",  # ة -> ه
+    "\u06a9": "\u0643",  # ک -> ك
+    "\u0640": None,       # tatweel
+    **{chr(0x0660 + digit): str(digit) for digit in range(10)},  # Arabic-Indic digits
+    **{chr(0x06f0 + digit): str(digit) for digit in range(10)},  # Extended Arabic-Indic digits
+})
+
+
+def normalize_text(value) -> str:
+    """Fold Arabic letter variants, diacritics and case so equivalent spellings compare equal"""
+    if value is None:
+        return ""
+    text = unicodedata.normalize("NFKC", str(value))
+    text = ARABIC_MARKS.sub("", text)
+    return text.translate(ARABIC_FOLDING).casefold()
+
+
+def normalize_bill_number(value) -> str:
+    """Lookup key for bill numbers: ``key = normalize(value)`` matches like ``iexact``"""
+    return str(value or "").upper()
+
+
+def document_values(instance, model_key):
+    for field in SEARCH_FIELDS[model_key]:
+        if field == "in_shipment__bill_number":
+            in_shipment = instance.in_shipment if instance.in_shipment_id else None
+            yield in_shipment.bill_number if in_shipment else ""
+        else:
+            yield getattr(instance, field)
+
+
+def build_search_document(instance, model_key) -> str:
+    """Normalized text the search index is built from, computed once per write"""
+    return DOCUMENT_SEPARATOR.join(normalize_text(value) for value in document_values(instance, model_key))
+
+
+def populate_lookup_fields(instance, model_key):
+    """Set the derived lookup/search columns; run on every save and by the bulk write paths"""
+    instance.bill_number_key = normalize_bill_number(instance.bill_number)
+    instance.sub_bill_number_key = normalize_bill_number(instance.sub_bill_number)
+    instance.search_document = build_search_document(instance, model_key)
+
+
+def fts_table(model) -> str:
+    return f"{model._meta.db_table}_fts"
+
+
+# Tables carrying a ``search_document`` column
+SEARCH_TABLES = ("in_shipments", "out_shipments")
+
+
+def _sqlite_search_statements(table):
+    fts = f"{table}_fts"
+    return {
+        fts: (
+            f"CREATE VIRTUAL TABLE {fts} USING fts5("
+            f"search_document, content='{table}', content_rowid='id', tokenize='trigram')"
+        ),
+        f"{fts}_ai": (
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END"
+        ),
+        f"{fts}_ad": (
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); END"
+        ),
+        f"{fts}_au": (
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF search_document ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_document) VALUES ('delete', old.id, old.search_document); "
+            f"INSERT INTO {fts}(rowid, search_document) VALUES (new.id, new.search_document); END"
+        ),
+    }
+
+
+def ensure_search_index(connection):
+    """
+    Create whatever part of the search index is missing. On SQLite this is an
+    external-content FTS5 table per shipment table plus the triggers that keep
+    it in sync; the index is rebuilt whenever something had to be recreated
+    (a table rebuild during a migration drops the triggers). On PostgreSQL it
+    is a trigram GIN index on ``search_document``.
+
+    A table without ``search_document`` (migrated back before it existed)
+    gets any leftover index dropped instead: its triggers would break every
+    write to the table.
+    """
+    tables = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            if table not in tables:
+                continue
+            columns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+            if "search_document" not in columns:
+                _drop_table_index(connection, cursor, table)
+                continue
+            if connection.vendor == "sqlite":
+                cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE %s", [f"{table}_fts%"])
+                existing = {row[0] for row in cursor.fetchall()}
+                missing = {name: sql for name, sql in _sqlite_search_statements(table).items() if name not in existing}
+                for sql in missing.values():
+                    cursor.execute(sql)
+                if missing:
+                    cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+            elif connection.vendor == "postgresql":
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_search_trgm "
+                    f"ON {table} USING gin (search_document gin_trgm_ops)"
+                )
+
+
+def _drop_table_index(connection, cursor, table):
+    if connection.vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+    elif connection.vendor == "postgresql":
+        cursor.execute(f"DROP INDEX IF EXISTS {table}_search_trgm")
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            _drop_table_index(connection, cursor, table)
+
+
+def fts_phrase(term) -> str:
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+class ShipmentSearchFilter(SearchFilter):
+    """
+    ``?search=`` backed by the shipment search index instead of an OR of
+    ``icontains`` over every search field. Terms are normalized the same way
+    as the indexed documents, and all of them must match (as with
+    ``SearchFilter``). SQLite uses the FTS5 trigram table, PostgreSQL serves
+    the ``LIKE`` from a trigram GIN index on ``search_document``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [normalize_text(term) for term in self.get_search_terms(request)]
+        terms = [term for term in terms if term]
+        if not terms:
+            return queryset
+
+        fts_terms = []
+        if connections[queryset.db].vendor == "sqlite":
+            fts_terms = [term for term in terms if len(term) >= FTS_MIN_TERM_LENGTH]
+            terms = [term for term in terms if len(term) < FTS_MIN_TERM_LENGTH]
+
+        if fts_terms:
+            table = fts_table(queryset.model)
+            match = " AND ".join(fts_phrase(term) for term in fts_terms)
+            queryset = queryset.filter(
+                pk__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match])
+            )
+        for term in terms:
+            queryset = queryset.filter(search_document__contains=term)
+        return queryset
@@ -1,7 +1,13 @@
-from datetime import date
 from rest_framework import serializers
 from django.db import transaction
+from django.db.models import BooleanField, Case, Value, When
 from .models import Destination, Company, InShipment, OutShipment
+from . import aggregates, allocation, timing
+from .fieldsets import SparseFieldsMixin
+
+
+# Derived columns maintained on write, never exposed through the API
+INTERNAL_FIELDS = ['bill_number_key', 'sub_bill_number_key', 'search_document']
 
 
 class DestinationSerializer(serializers.ModelSerializer):
@@ -18,14 +24,29 @@ class CompanySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 
-class BaseShipmentSerializer(serializers.ModelSerializer):
-    """Base serializer with common fields and validation"""
+def status_expression(prefix=''):
+    """SQL equivalent of ``BaseShipmentSerializer.get_status`` for the values()-based list path"""
+    return Case(
+        When(**{f'{prefix}disbursement_date__isnull': False}, then=Value(True)),
+        default=Value(False),
+        output_field=BooleanField(),
+    )
+
+
+class BaseShipmentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Base serializer with common fields and validation; supports ``?fields=`` / ``?expand=``"""
     status = serializers.SerializerMethodField()
+    computed_field_sources = {'status': ['disbursement_date']}
+    sql_fields = {'status': status_expression}
     
     class Meta:
         fields = '__all__'
         read_only_fields = ['id', 'created_at', 'updated_at', 'status']
     
+    def to_representation(self, instance):
+        with timing.span("serialize"):
+            return super().to_representation(instance)
+
     def get_status(self, obj):
         """Calculate status based on disbursement_date"""
         return bool(obj.disbursement_date)
@@ -35,24 +56,47 @@ class BaseShipmentSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("رقم البوليصة مطلوب")
         return value
 
+    @transaction.atomic
+    def create(self, validated_data):
+        # Running totals are updated by the post_save signal, inside this transaction
+        return super().create(validated_data)
+
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        # The instance was loaded by the view, so hand its current values to
+        # the totals signal instead of having it re-read the row
+        instance._aggregate_snapshot = aggregates.snapshot(instance)
+        return super().update(instance, validated_data)
+
 
 class InShipmentSerializer(BaseShipmentSerializer):
     class Meta:
         model = InShipment
-        fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at', 'status']
+        exclude = INTERNAL_FIELDS
+        read_only_fields = ['id', 'created_at', 'updated_at', 'status', 'company_ref', 'destination_ref']
+
+
+class InShipmentBulkItemSerializer(InShipmentSerializer):
+    """One row of a bulk insert; sub_bill_number uniqueness is checked for the whole batch at once"""
+    sub_bill_number = serializers.CharField(max_length=100, help_text="رقم البوليصة الفرعية")
+
+    class Meta(InShipmentSerializer.Meta):
+        pass
 
 
 class OutShipmentSerializer(BaseShipmentSerializer):
-    in_shipment = InShipmentSerializer(read_only=True)
+    # The inbound shipment id; the full object with ``?expand=in_shipment``
+    in_shipment = serializers.PrimaryKeyRelatedField(read_only=True)
     in_shipment_id = serializers.PrimaryKeyRelatedField(
         queryset=InShipment.objects.all(), write_only=True, source='in_shipment'
     )
 
     class Meta:
         model = OutShipment
-        fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at', 'status', 'in_shipment']
+        exclude = INTERNAL_FIELDS
+        read_only_fields = ['id', 'created_at', 'updated_at', 'status', 'in_shipment', 'company_ref', 'destination_ref']
+
+    expandable_fields = {'in_shipment': InShipmentSerializer}
 
     def validate(self, attrs):
         in_shipment = attrs.get('in_shipment') or getattr(self.instance, 'in_shipment', None)
@@ -71,18 +115,33 @@ class OutShipmentSerializer(BaseShipmentSerializer):
     @transaction.atomic
     def create(self, validated_data):
         in_shipment = validated_data['in_shipment']
-        export_date = validated_data.get('export_date') or date.today()
-        validated_data['export_date'] = export_date
+        package_count = validated_data['package_count']
 
-        out_shipment = OutShipment.objects.create(**validated_data)
+        # validate() only pre-checked against a possibly stale in_shipment;
+        # the conditional UPDATE is what guarantees no over-export
+        if not allocation.allocate_packages(in_shipment.pk, package_count):
+            raise serializers.ValidationError(allocation.allocation_error(package_count, in_shipment.pk))
 
-        # Update inbound shipment exported_count and export flag
-        in_shipment.exported_count = int(in_shipment.exported_count or 0) + int(out_shipment.package_count or 0)
-        in_shipment.export = in_shipment.exported_count >= in_shipment.package_count
-        in_shipment.save(update_fields=['exported_count', 'export', 'updated_at'])
+        out_shipment = OutShipment.objects.create(**allocation.with_export_date(validated_data))
+        allocation.notify_allocated(in_shipment)
 
         return out_shipment
 
     @transaction.atomic
     def update(self, instance, validated_data):
         raise serializers.ValidationError("لا يمكن تعديل الشحنة الصادرة بعد إنشائها.")
+
+
+class TimeseriesQuerySerializer(serializers.Serializer):
+    """Query parameters for the ``stats/timeseries`` actions"""
+    granularity = serializers.ChoiceField(choices=['day', 'month'], default='day')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    company_name = serializers.CharField(required=False)
+    destination = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        date_from, date_to = attrs.get('date_from'), attrs.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError({"date_to": "تاريخ النهاية يجب أن يكون بعد تاريخ البداية."})
+        return attrs
@@ -1,9 +1,20 @@
-from django.db.models.signals import post_save, post_delete, pre_delete
+import json
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import connections, transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, post_migrate
 from django.dispatch import receiver
-from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 
 from .models import InShipment, OutShipment, Destination, Company
+from . import aggregates, cache, references, search
+from .authentication import get_auth_cache
+from .dispatch import get_dispatcher
+from .subscriptions import event_groups
 
 
 MODEL_LABELS = {
@@ -13,52 +24,172 @@ MODEL_LABELS = {
     "company": "الشركة",
 }
 
+MODEL_PLURAL_LABELS = {
+    "in_shipment": "شحنات واردة",
+    "out_shipment": "شحنات صادرة",
+}
+
 ACTION_LABELS = {
     "created": "تم إنشاء",
     "updated": "تم تحديث",
     "deleted": "تم حذف",
+    "bulk_created": "تم إنشاء",
+    "imported": "تم استيراد",
 }
 
-def make_message(model_key: str, action_key: str) -> str:
-    model_name = MODEL_LABELS.get(model_key, model_key)
+def make_message(model_key: str, action_key: str, count=None) -> str:
     action_name = ACTION_LABELS.get(action_key, action_key)
+    if count is not None:
+        model_name = MODEL_PLURAL_LABELS.get(model_key, model_key)
+        return f"{action_name} {count} {model_name} بنجاح"
+    model_name = MODEL_LABELS.get(model_key, model_key)
     return f"{action_name} {model_name} بنجاح"
 
 
-def broadcast_event(model: str, action: str, instance_id=None):
-    channel_layer = get_channel_layer()
-    if channel_layer is None:
+def serialize_instance(model: str, instance):
+    """
+    The row as the REST API renders it, reduced to plain JSON types. It is
+    built once per event and every connection forwards the same data.
+    """
+    # Imported here: the serializers import allocation, which imports this module
+    from .serializers import CompanySerializer, DestinationSerializer, InShipmentSerializer, OutShipmentSerializer
+
+    serializer_class = {
+        "in_shipment": InShipmentSerializer,
+        "out_shipment": OutShipmentSerializer,
+        "destination": DestinationSerializer,
+        "company": CompanySerializer,
+    }[model]
+    return json.loads(JSONRenderer().render(serializer_class(instance).data))
+
+
+def broadcast_event(
+    model: str, action: str, instance_id=None, ids=None, count=None, bill_numbers=None, instance=None,
+    master_bill_numbers=None,
+):
+    """
+    Notify the ``shipments`` group and the subscription groups the event
+    matches (its model, ids and ``bill_numbers``). Pass ``ids`` (or just
+    ``count`` when there are too many ids to send) for one summary event
+    covering many rows, with the rows' ``master_bill_numbers``: their
+    groups are always notified, however many bill numbers the event has.
+    Passing the ``instance`` of a created or updated row adds it as
+    ``data`` so clients can patch their state instead of refetching.
+
+    Once the current transaction commits the event is queued for the
+    background dispatcher, which numbers it in the event log (``seq``) and
+    sends it, so the request never waits on either and rolled back writes
+    are never announced.
+    """
+    if get_channel_layer() is None:
         return
 
     payload = {
         "type": "shipments.event",
+        # Lets a connection subscribed through several matching groups drop the copies
+        "event_id": uuid.uuid4().hex,
         "model": model,
         "action": action,
-        "message": make_message(model, action),
+        "message": make_message(model, action, len(ids) if count is None and ids is not None else count),
     }
     if instance_id is not None:
         payload["id"] = instance_id
+    if ids is not None:
+        payload["ids"] = list(ids)
+    if count is not None:
+        payload["count"] = count
+    if master_bill_numbers:
+        payload["master_bill_numbers"] = sorted({number for number in master_bill_numbers if number})
+        bill_numbers = {*(bill_numbers or ()), *payload["master_bill_numbers"]}
+    if bill_numbers:
+        payload["bill_numbers"] = sorted({number for number in bill_numbers if number})
+
+    def dispatch():
+        if instance is not None:
+            payload["data"] = serialize_instance(model, instance)
+        get_dispatcher().submit(event_groups(payload), payload, logged=True)
+
+    transaction.on_commit(dispatch)
+
+
+def shipment_bill_numbers(instance):
+    return [instance.bill_number, instance.sub_bill_number]
+
+
+def record_totals(instance, created):
+    if created:
+        aggregates.record_created(instance)
+    else:
+        aggregates.record_updated(instance, instance.__dict__.pop("_aggregate_snapshot", None))
+
+
+# Running totals
+@receiver(pre_save, sender=InShipment)
+@receiver(pre_save, sender=OutShipment)
+def capture_shipment_totals(sender, instance, update_fields=None, **kwargs):
+    # Serializers set the snapshot from the instance they already loaded;
+    # otherwise read the stored values so the update can be applied as a delta
+    if instance._state.adding or "_aggregate_snapshot" in instance.__dict__:
+        return
+    if update_fields is not None and not set(update_fields) & set(aggregates.source_fields(sender)):
+        instance._aggregate_snapshot = None
+        return
+    instance._aggregate_snapshot = aggregates.load_snapshot(instance)
+
+
+# Lookup keys and search index
+@receiver(pre_save, sender=InShipment)
+@receiver(pre_save, sender=OutShipment)
+def refresh_lookup_fields(sender, instance, **kwargs):
+    search.populate_lookup_fields(instance, aggregates.model_key(sender))
+    # capture_shipment_totals ran first: its snapshot holds the stored names
+    references.populate_references([instance], previous=instance.__dict__.get("_aggregate_snapshot"))
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using="default", **kwargs):
+    # Rebuilding a table during a migration drops the FTS triggers
+    if sender.name == "api":
+        search.ensure_search_index(connections[using])
 
-    async_to_sync(channel_layer.group_send)("shipments", payload)
+
+def refresh_out_shipment_documents(in_shipment):
+    # Out shipment documents embed the inbound bill number
+    changed = []
+    for out_shipment in in_shipment.out_shipments.all():
+        out_shipment.in_shipment = in_shipment
+        document = search.build_search_document(out_shipment, "out_shipment")
+        if document != out_shipment.search_document:
+            out_shipment.search_document = document
+            changed.append(out_shipment)
+    OutShipment.objects.bulk_update(changed, ["search_document"])
 
 
 # InShipments
 @receiver(post_save, sender=InShipment)
-def handle_in_shipment_save(sender, instance, created, **kwargs):
+def handle_in_shipment_save(sender, instance, created, update_fields=None, **kwargs):
+    record_totals(instance, created)
+    cache.invalidate("in_shipment")
+    if not created and (update_fields is None or "bill_number" in update_fields):
+        refresh_out_shipment_documents(instance)
     action = "created" if created else "updated"
-    broadcast_event("in_shipment", action, instance.id)
+    broadcast_event("in_shipment", action, instance.id, bill_numbers=shipment_bill_numbers(instance), instance=instance)
 
 
 @receiver(post_delete, sender=InShipment)
 def handle_in_shipment_delete(sender, instance, **kwargs):
-    broadcast_event("in_shipment", "deleted", instance.id)
+    aggregates.record_deleted(instance)
+    cache.invalidate("in_shipment")
+    broadcast_event("in_shipment", "deleted", instance.id, bill_numbers=shipment_bill_numbers(instance))
 
 
 # OutShipments
 @receiver(post_save, sender=OutShipment)
 def handle_out_shipment_save(sender, instance, created, **kwargs):
+    record_totals(instance, created)
+    cache.invalidate("out_shipment")
     action = "created" if created else "updated"
-    broadcast_event("out_shipment", action, instance.id)
+    broadcast_event("out_shipment", action, instance.id, bill_numbers=shipment_bill_numbers(instance), instance=instance)
 
 
 @receiver(pre_delete, sender=OutShipment)
@@ -73,28 +204,81 @@ def cache_related_in_shipment(sender, instance, **kwargs):
 @receiver(post_delete, sender=OutShipment)
 def handle_out_shipment_delete(sender, instance, **kwargs):
     # Deletion of out shipments is disabled in API; keep broadcast only for safety
-    broadcast_event("out_shipment", "deleted", instance.id)
+    aggregates.record_deleted(instance)
+    cache.invalidate("out_shipment")
+    broadcast_event("out_shipment", "deleted", instance.id, bill_numbers=shipment_bill_numbers(instance))
+
+
+# Company and destination renames
+@receiver(pre_save, sender=Destination)
+@receiver(pre_save, sender=Company)
+def capture_previous_name(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_name = sender.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+
+
+def rename_and_link_shipments(instance, field):
+    previous = instance.__dict__.pop("_previous_name", None)
+    if previous is not None and previous != instance.name:
+        references.rename_shipments(instance, field, previous)
+    references.link_shipments(instance, field, instance.name)
 
 
 # Destinations
 @receiver(post_save, sender=Destination)
 def handle_destination_save(sender, instance, created, **kwargs):
+    cache.invalidate("destination")
+    rename_and_link_shipments(instance, "destination_ref")
     action = "created" if created else "updated"
-    broadcast_event("destination", action, instance.id)
+    broadcast_event("destination", action, instance.id, instance=instance)
 
 
 @receiver(post_delete, sender=Destination)
 def handle_destination_delete(sender, instance, **kwargs):
+    cache.invalidate("destination")
+    # on_delete=SET_NULL cleared the shipments' references with a plain UPDATE
+    references.shipments_changed()
     broadcast_event("destination", "deleted", instance.id)
 
 
 # Companies
 @receiver(post_save, sender=Company)
 def handle_company_save(sender, instance, created, **kwargs):
+    cache.invalidate("company")
+    rename_and_link_shipments(instance, "company_ref")
     action = "created" if created else "updated"
-    broadcast_event("company", action, instance.id)
+    broadcast_event("company", action, instance.id, instance=instance)
 
 
 @receiver(post_delete, sender=Company)
 def handle_company_delete(sender, instance, **kwargs):
+    cache.invalidate("company")
+    # on_delete=SET_NULL cleared the shipments' references with a plain UPDATE
+    references.shipments_changed()
     broadcast_event("company", "deleted", instance.id)
+
+
+# Authentication cache
+def invalidate_auth(invalidate, *args):
+    # Again once the transaction commits: another worker may cache the old row in between
+    invalidate(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: invalidate(*args))
+
+
+@receiver(user_logged_out)
+def handle_logout(sender, request, user, **kwargs):
+    session_key = request.session.session_key if hasattr(request, "session") else None
+    if session_key:
+        invalidate_auth(get_auth_cache().invalidate, "session", session_key)
+
+
+@receiver(post_delete, sender=Token)
+def handle_token_delete(sender, instance, **kwargs):
+    invalidate_auth(get_auth_cache().invalidate, "token", instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def handle_user_change(sender, instance, **kwargs):
+    invalidate_auth(get_auth_cache().invalidate_user, instance.pk)
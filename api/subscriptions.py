@@ -0,0 +1,138 @@
+import hashlib
+
+from .search import normalize_bill_number
+
+
+# Every event goes to this group; connections that have not subscribed to
+# anything specific are in it
+ALL_GROUP = "shipments"
+
+SUBSCRIBABLE_MODELS = ("in_shipment", "out_shipment", "destination", "company")
+
+# Bulk events fan out to at most this many per-id / per-bill-number groups;
+# past that they go to the overflow groups instead (see event_groups)
+MAX_EVENT_GROUPS = 100
+
+
+def model_group(model):
+    return f"{ALL_GROUP}.{model}"
+
+
+def id_group(model, instance_id):
+    return f"{ALL_GROUP}.{model}.{int(instance_id)}"
+
+
+def bill_number_group(bill_number):
+    # Group names only allow ASCII letters, digits, "-", "_" and "."
+    digest = hashlib.sha1(normalize_bill_number(bill_number).encode("utf-8")).hexdigest()[:20]
+    return f"{ALL_GROUP}.bill.{digest}"
+
+
+def id_overflow_group(model):
+    """Every connection subscribed to some id of ``model`` is in this group"""
+    return f"{ALL_GROUP}.{model}.overflow"
+
+
+# Every connection subscribed to some bill number is in this group
+BILL_OVERFLOW_GROUP = f"{ALL_GROUP}.bill.overflow"
+
+
+def payload_ids(payload):
+    return payload.get("ids") or ([payload["id"]] if payload.get("id") is not None else [])
+
+
+def payload_bill_numbers(payload):
+    return {number for number in payload.get("bill_numbers") or () if number}
+
+
+def event_groups(payload):
+    """
+    Every group an event payload is delivered to. The master bill numbers
+    always get their groups. When an event has more than
+    ``MAX_EVENT_GROUPS`` ids (or other bill numbers) it goes to the
+    overflow group instead of the per-id (per-bill-number) groups, and each
+    connection there checks ``subscribed_to`` itself, so no subscriber is
+    skipped.
+    """
+    model = payload["model"]
+    groups = [ALL_GROUP, model_group(model)]
+    ids = payload_ids(payload)
+    if len(ids) > MAX_EVENT_GROUPS:
+        groups.append(id_overflow_group(model))
+    else:
+        groups.extend(id_group(model, instance_id) for instance_id in ids)
+    masters = {number for number in payload.get("master_bill_numbers") or () if number}
+    groups.extend(sorted({bill_number_group(number) for number in masters}))
+    others = payload_bill_numbers(payload) - masters
+    if len(others) > MAX_EVENT_GROUPS:
+        groups.append(BILL_OVERFLOW_GROUP)
+    else:
+        groups.extend(sorted({bill_number_group(number) for number in others} - set(groups)))
+    return groups
+
+
+def overflow_groups(subscriptions):
+    """The overflow groups a connection with ``subscriptions`` must be in"""
+    groups = set()
+    for kind, value in subscriptions.values():
+        if kind == "ids":
+            groups.add(id_overflow_group(value.split(":")[0]))
+        elif kind == "bill_numbers":
+            groups.add(BILL_OVERFLOW_GROUP)
+    return groups
+
+
+def subscribed_to(subscriptions, payload):
+    """Whether a connection with ``subscriptions`` wants the event"""
+    model = payload["model"]
+    if ALL_GROUP in subscriptions or model_group(model) in subscriptions:
+        return True
+    if any(id_group(model, instance_id) in subscriptions for instance_id in payload_ids(payload)):
+        return True
+    return any(bill_number_group(number) in subscriptions for number in payload_bill_numbers(payload))
+
+
+def requested_groups(content):
+    """
+    ``{group: subscription}`` for a ``subscribe`` / ``unsubscribe`` message::
+
+        {"type": "subscribe", "models": ["company"], "ids": {"in_shipment": [42]}, "bill_numbers": ["MAWB-1"]}
+
+    ``subscription`` is the readable ``(kind, value)`` the group stands for.
+    Raises ``ValueError`` for anything malformed.
+    """
+    models = content.get("models") or []
+    ids = content.get("ids") or {}
+    bill_numbers = content.get("bill_numbers") or []
+    if not isinstance(models, list) or not isinstance(ids, dict) or not isinstance(bill_numbers, list):
+        raise ValueError("models and bill_numbers must be lists, ids an object of lists")
+
+    groups = {}
+    for model in [*models, *ids]:
+        if model not in SUBSCRIBABLE_MODELS:
+            raise ValueError(f"Unknown model: {model}")
+    for model in models:
+        groups[model_group(model)] = ("models", model)
+    for model, model_ids in ids.items():
+        if not isinstance(model_ids, list):
+            raise ValueError("ids must map a model to a list of ids")
+        for instance_id in model_ids:
+            try:
+                groups[id_group(model, instance_id)] = ("ids", f"{model}:{int(instance_id)}")
+            except (TypeError, ValueError):
+                raise ValueError("ids must be integers")
+    for number in bill_numbers:
+        if number:
+            groups[bill_number_group(str(number))] = ("bill_numbers", str(number))
+    return groups
+
+
+def describe(subscriptions):
+    """Readable summary of a connection's ``{group: (kind, value)}`` subscriptions"""
+    summary = {"all": ALL_GROUP in subscriptions, "models": [], "ids": [], "bill_numbers": []}
+    for group, (kind, value) in subscriptions.items():
+        if group != ALL_GROUP:
+            summary[kind].append(value)
+    for kind in ("models", "ids", "bill_numbers"):
+        summary[kind].sort()
+    return summary
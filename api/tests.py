@@ -1,3 +1,1186 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import date
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from consumers.layers import SQLiteChannelLayer
+from consumers.shipments import OVERFLOW_CLOSE_CODE, ShipmentsConsumer, outbound_stats
+from . import aggregates, bulk, event_log, signals, subscriptions
+from .authentication import AuthCache, get_auth_cache
+from .dispatch import EventDispatcher, get_dispatcher
+from .listing import ValuesListSerializer
+from .models import Company, Destination, InShipment, OutShipment, ShipmentEvent
+from .serializers import InShipmentSerializer, OutShipmentSerializer
 
 # Create your tests here.
+
+
+def shipment_data(sub_bill_number, **overrides):
+    data = {
+        "bill_number": "BL-1000",
+        "arrival_date": "2025-01-15",
+        "sub_bill_number": sub_bill_number,
+        "company_name": "شركة الاختبار",
+        "package_count": 10,
+        "weight": "12.50",
+        "destination": "القاهرة",
+        "payment_fees": "100.00",
+        "customs_certificate": "CC-1",
+        "contract_status": "نهائي",
+        "receiver_name": "مستلم",
+        "ground_fees": "20.00",
+    }
+    data.update(overrides)
+    return data
+
+
+def create_in_shipment(sub_bill_number, **overrides):
+    data = shipment_data(sub_bill_number, **overrides)
+    for field in ("weight", "payment_fees", "ground_fees"):
+        data[field] = Decimal(data[field])
+    return InShipment.objects.create(**data)
+
+
+class OutShipmentAllocationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_export_cannot_exceed_remaining_packages(self):
+        in_shipment = create_in_shipment("IN-1", package_count=5)
+        response = self.client.post(
+            "/api/out-shipments/",
+            shipment_data("OUT-1", in_shipment_id=in_shipment.id, package_count=3),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.post(
+            "/api/out-shipments/",
+            shipment_data("OUT-2", in_shipment_id=in_shipment.id, package_count=3),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        in_shipment.refresh_from_db()
+        self.assertEqual(in_shipment.exported_count, 3)
+        self.assertFalse(in_shipment.export)
+
+    def test_allocate_across_several_in_shipments(self):
+        first = create_in_shipment("IN-1", package_count=4)
+        second = create_in_shipment("IN-2", package_count=6)
+        response = self.client.post(
+            "/api/out-shipments/allocate/",
+            [
+                shipment_data("OUT-1", in_shipment_id=first.id, package_count=4),
+                shipment_data("OUT-2", in_shipment_id=second.id, package_count=2),
+                shipment_data("OUT-3", in_shipment_id=second.id, package_count=3),
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.exported_count, first.export), (4, True))
+        self.assertEqual((second.exported_count, second.export), (5, False))
+
+    def test_allocate_is_all_or_nothing(self):
+        first = create_in_shipment("IN-1", package_count=4)
+        second = create_in_shipment("IN-2", package_count=2)
+        response = self.client.post(
+            "/api/out-shipments/allocate/",
+            [
+                shipment_data("OUT-1", in_shipment_id=first.id, package_count=2),
+                shipment_data("OUT-2", in_shipment_id=second.id, package_count=2),
+                shipment_data("OUT-3", in_shipment_id=second.id, package_count=1),
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(OutShipment.objects.count(), 0)
+        self.assertEqual(
+            list(InShipment.objects.order_by("id").values_list("exported_count", flat=True)),
+            [0, 0],
+        )
+
+
+class OutShipmentAllocationStressTests(TransactionTestCase):
+    """Parallel exports against the same inbound shipment must never over-allocate"""
+
+    THREADS = 8
+    REQUESTS_PER_THREAD = 10
+    PACKAGES = 50
+
+    def run(self, result=None):
+        # The throughput is reported at -v 2 and up, with the runner's own per-test lines
+        self.report_stream = result.stream if getattr(result, "showAll", False) else None
+        return super().run(result)
+
+    # Requests queue on the SQLite write lock here; they are slow on purpose
+    @override_settings(REQUEST_TIMING={"SLOW_REQUEST_MS": None})
+    def test_parallel_exports_do_not_over_allocate(self):
+        in_shipment = create_in_shipment("IN-STRESS", package_count=self.PACKAGES)
+        results = []
+        lock = threading.Lock()
+
+        def worker(thread_index):
+            client = APIClient()
+            try:
+                for request_index in range(self.REQUESTS_PER_THREAD):
+                    data = shipment_data(
+                        f"OUT-{thread_index}-{request_index}",
+                        in_shipment_id=in_shipment.id,
+                        package_count=1,
+                    )
+                    response = client.post("/api/out-shipments/", data, format="json")
+                    with lock:
+                        results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        in_shipment.refresh_from_db()
+        created = results.count(201)
+        self.assertEqual(len(results), self.THREADS * self.REQUESTS_PER_THREAD)
+        self.assertEqual(set(results) - {201, 400}, set())
+        self.assertEqual(created, self.PACKAGES)
+        self.assertEqual(in_shipment.exported_count, self.PACKAGES)
+        self.assertTrue(in_shipment.export)
+        self.assertEqual(OutShipment.objects.count(), self.PACKAGES)
+        # The dispatcher thread numbers every committed export in the event log
+        get_dispatcher().flush()
+        self.assertEqual(
+            ShipmentEvent.objects.filter(payload__model="out_shipment", payload__action="created").count(),
+            self.PACKAGES,
+        )
+        if self.report_stream is not None:
+            self.report_stream.write(
+                f"{len(results)} export requests, {created} allocated in {elapsed:.2f}s "
+                f"({created / elapsed:.1f} exports/s) ... "
+            )
+
+
+class EventDispatcherTests(SimpleTestCase):
+    def test_burst_is_coalesced_before_fan_out(self):
+        sent = []
+
+        class RecordingLayer:
+            async def group_send(self, group, message):
+                sent.append((group, message))
+
+        dispatcher = EventDispatcher(coalesce_window=0.2)
+        with mock.patch("api.dispatch.get_channel_layer", return_value=RecordingLayer()):
+            for number in range(5):
+                dispatcher.submit(["shipments", f"company.{number % 2}"], {"type": "shipments.event", "id": number})
+            dispatcher.flush()
+
+        # One message per group, not one per event and group
+        self.assertEqual(len(sent), 3)
+        batches = dict(sent)
+        self.assertEqual(batches["shipments"]["type"], "shipments.batch")
+        self.assertEqual([event["id"] for event in batches["shipments"]["events"]], [0, 1, 2, 3, 4])
+        self.assertEqual([event["id"] for event in batches["company.1"]["events"]], [1, 3])
+        self.assertEqual(dispatcher.stats()["dispatched"], 5)
+
+    def test_dropped_logged_event_leaves_a_gap_before_the_next_one(self):
+        entered, release = threading.Event(), threading.Event()
+        log = []
+
+        class BlockingLayer:
+            async def group_send(self, group, message):
+                entered.set()
+                release.wait(5)
+
+        def record(payload):
+            log.append(payload)
+            return len(log)
+
+        dispatcher = EventDispatcher(max_size=1, coalesce_window=0, max_batch=1)
+        with mock.patch("api.dispatch.get_channel_layer", return_value=BlockingLayer()), \
+                mock.patch("api.dispatch.event_log.record", side_effect=record), \
+                mock.patch("api.dispatch.event_log.record_gap", side_effect=lambda missing: record({"gap": missing})), \
+                mock.patch("api.dispatch.close_old_connections"):
+            dispatcher.submit(["shipments"], {"type": "shipments.event", "id": 1}, logged=True)
+            self.assertTrue(entered.wait(5))
+            dispatcher.submit(["shipments"], {"type": "shipments.event", "id": 2}, logged=True)
+            # The queue holds one event: this one is dropped
+            with self.assertLogs("api.dispatch", "WARNING"):
+                dispatcher.submit(["shipments"], {"type": "shipments.event", "id": 3}, logged=True)
+            release.set()
+            dispatcher.flush()
+
+        self.assertEqual(dispatcher.stats()["dropped"], 1)
+        self.assertEqual(log, [
+            {"type": "shipments.event", "id": 1, "seq": 1},
+            {"gap": 1},
+            {"type": "shipments.event", "id": 2, "seq": 3},
+        ])
+
+
+class EventLogTests(TestCase):
+    def test_resume_across_a_gap_needs_a_reload(self):
+        first = event_log.record({"type": "shipments.event", "model": "company", "action": "created"})
+        second = event_log.record({"type": "shipments.event", "model": "company", "action": "updated"})
+        self.assertEqual([event["seq"] for event in event_log.events_after(first)], [second])
+
+        event_log.record_gap(2)
+        event_log.record({"type": "shipments.event", "model": "company", "action": "deleted"})
+        self.assertIsNone(event_log.events_after(first))
+        self.assertEqual(len(event_log.events_after(event_log.latest_seq() - 1)), 1)
+
+    def test_import_command_sends_its_event_before_returning(self):
+        with mock.patch("api.management.commands.import_shipments.flush_dispatcher") as flush_dispatcher, \
+                mock.patch("api.management.commands.import_shipments.broadcast_event"):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "shipments.ndjson")
+                with open(path, "w", encoding="utf-8") as fh:
+                    fh.write(json.dumps(shipment_data("IMP-1")) + "\n")
+                call_command("import_shipments", path, stdout=StringIO())
+        self.assertTrue(InShipment.objects.filter(sub_bill_number="IMP-1").exists())
+        flush_dispatcher.assert_called_once_with()
+
+
+class SlowReaderConsumer(ShipmentsConsumer):
+    """A client on a poor connection: every frame takes a while to go out"""
+
+    async def send_json(self, content, close=False):
+        await asyncio.sleep(0.02)
+        await super().send_json(content, close)
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class SlowReaderTests(SimpleTestCase):
+    """A burst of events must not queue up without bound behind a slow WebSocket client"""
+
+    EVENTS = 60
+    QUEUE_SIZE = 5
+
+    async def burst(self):
+        communicator = WebsocketCommunicator(SlowReaderConsumer.as_asgi(), "/ws/shipments/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        channel_layer = get_channel_layer()
+        for seq in range(1, self.EVENTS + 1):
+            await channel_layer.group_send("shipments", {
+                "type": "shipments.event", "event_id": str(seq), "seq": seq,
+                "model": "company", "action": "updated", "id": seq, "message": "",
+            })
+        return communicator
+
+    async def receive_all(self, communicator):
+        frames = []
+        while not await communicator.receive_nothing(timeout=0.5):
+            frames.append(await communicator.receive_output())
+        return frames
+
+    @override_settings(SHIPMENT_EVENTS={"COALESCE_WINDOW": 0, "OUTBOUND_QUEUE_SIZE": QUEUE_SIZE})
+    async def test_overflow_coalesces_to_resync(self):
+        dropped, resyncs = outbound_stats.dropped, outbound_stats.resyncs
+        communicator = await self.burst()
+        frames = [frame for frame in await self.receive_all(communicator) if frame["type"] == "websocket.send"]
+        await communicator.disconnect()
+
+        self.assertLess(len(frames), self.EVENTS)
+        self.assertIn('"type": "resync"', "".join(frame["text"] for frame in frames))
+        # Nothing after the last resync is lost: the newest event still arrives
+        self.assertIn(f'"seq": {self.EVENTS}', frames[-1]["text"])
+        self.assertGreater(outbound_stats.dropped, dropped)
+        self.assertGreater(outbound_stats.resyncs, resyncs)
+        self.assertLessEqual(outbound_stats.high_water, self.QUEUE_SIZE)
+
+    @override_settings(SHIPMENT_EVENTS={
+        "COALESCE_WINDOW": 0, "OUTBOUND_QUEUE_SIZE": QUEUE_SIZE, "OVERFLOW_POLICY": "disconnect",
+    })
+    async def test_overflow_disconnects(self):
+        disconnected = outbound_stats.disconnected
+        communicator = await self.burst()
+        frames = await self.receive_all(communicator)
+        await communicator.disconnect()
+
+        self.assertEqual(frames[-1], {"type": "websocket.close", "code": OVERFLOW_CLOSE_CODE})
+        self.assertLessEqual(len(frames), self.QUEUE_SIZE + 1)
+        self.assertEqual(outbound_stats.disconnected, disconnected + 1)
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class EventDataTests(TestCase):
+    """Created and updated events carry the row as the REST API renders it"""
+
+    def submitted_events(self, write):
+        dispatcher = mock.Mock()
+        with mock.patch("api.signals.get_dispatcher", return_value=dispatcher), \
+                self.captureOnCommitCallbacks(execute=True):
+            write()
+        return [call.args[1] for call in dispatcher.submit.call_args_list]
+
+    def test_created_and_updated_events_match_the_rest_representation(self):
+        client = APIClient()
+        [created] = self.submitted_events(lambda: client.post("/api/in-shipments/", shipment_data("IN-1"), format="json"))
+        in_shipment = InShipment.objects.get(sub_bill_number="IN-1")
+        self.assertEqual(created["action"], "created")
+        self.assertEqual(created["data"], client.get(f"/api/in-shipments/{in_shipment.id}/").json())
+
+        [updated] = self.submitted_events(
+            lambda: client.patch(f"/api/in-shipments/{in_shipment.id}/", {"weight": "7.25"}, format="json")
+        )
+        detail = client.get(f"/api/in-shipments/{in_shipment.id}/").json()
+        self.assertEqual(updated["action"], "updated")
+        self.assertEqual(updated["data"], detail)
+        self.assertEqual(detail["weight"], "7.25")
+
+    def test_deleted_event_carries_only_the_id(self):
+        company = Company.objects.create(name="شركة")
+        [deleted] = self.submitted_events(lambda: APIClient().delete(f"/api/companies/{company.id}/"))
+        self.assertEqual((deleted["action"], deleted["id"]), ("deleted", company.id))
+        self.assertNotIn("data", deleted)
+
+    def test_each_event_is_serialized_once(self):
+        with mock.patch("api.signals.serialize_instance", wraps=signals.serialize_instance) as serialize:
+            events = self.submitted_events(lambda: create_in_shipment("IN-1"))
+        self.assertEqual(serialize.call_count, len([event for event in events if "data" in event]))
+        self.assertEqual(serialize.call_count, 1)
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    """Each layer on the same file stands for one worker process"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "channels.sqlite3")
+
+    def layer(self, **options):
+        return SQLiteChannelLayer(path=self.path, **options)
+
+    async def assertNothingReceived(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.3)
+
+    async def test_group_send_reaches_other_processes(self):
+        first, second = self.layer(), self.layer()
+        local, remote = await first.new_channel(), await second.new_channel()
+        await first.group_add("shipments", local)
+        await second.group_add("shipments", remote)
+        await first.group_send("shipments", {"type": "shipments.event", "id": 1})
+        self.assertEqual(await asyncio.wait_for(first.receive(local), 2), {"type": "shipments.event", "id": 1})
+        self.assertEqual(await asyncio.wait_for(second.receive(remote), 2), {"type": "shipments.event", "id": 1})
+
+    async def test_group_discard_stops_delivery(self):
+        first, second = self.layer(), self.layer()
+        remote = await second.new_channel()
+        await second.group_add("shipments", remote)
+        await second.group_discard("shipments", remote)
+        await first.group_send("shipments", {"type": "shipments.event", "id": 1})
+        await self.assertNothingReceived(second, remote)
+
+    async def test_expired_messages_are_not_delivered(self):
+        first, second = self.layer(expiry=0.1), self.layer()
+        remote = await second.new_channel()
+        await first.send(remote, {"type": "shipments.event", "id": 1})
+        await asyncio.sleep(0.2)
+        await first.send(remote, {"type": "shipments.event", "id": 2})
+        # Polling starts with the first receive, after the first message expired
+        self.assertEqual(await asyncio.wait_for(second.receive(remote), 2), {"type": "shipments.event", "id": 2})
+
+    async def test_channel_capacity(self):
+        layer = self.layer(capacity=2)
+        channel = await layer.new_channel()
+        await layer.group_add("shipments", channel)
+        await layer.send(channel, {"type": "shipments.event", "id": 1})
+        await layer.send(channel, {"type": "shipments.event", "id": 2})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {"type": "shipments.event", "id": 3})
+        # group_send drops the message for a full channel instead of raising
+        await layer.group_send("shipments", {"type": "shipments.event", "id": 4})
+        self.assertEqual([(await layer.receive(channel))["id"] for _ in range(2)], [1, 2])
+        await self.assertNothingReceived(layer, channel)
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ResumeTests(TransactionTestCase):
+    """A reconnecting client replays the logged events it missed, in seq order"""
+
+    def record_events(self, count):
+        return [
+            event_log.record({
+                "type": "shipments.event", "event_id": f"event-{number}",
+                "model": "company", "action": "updated", "id": number, "message": "",
+            })
+            for number in range(count)
+        ]
+
+    async def resume_pages(self, after):
+        """The frames answering ``resume`` from ``after``, and again while the answer says there is more"""
+        communicator = WebsocketCommunicator(ShipmentsConsumer.as_asgi(), "/ws/shipments/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        pages = []
+        while after is not None:
+            await communicator.send_json_to({"type": "resume", "after": after})
+            frames = [await communicator.receive_json_from()]
+            while frames[-1].get("type") not in ("resumed", "resync"):
+                frames.append(await communicator.receive_json_from())
+            pages.append(frames)
+            after = frames[-1]["seq"] if frames[-1].get("more") else None
+        await communicator.disconnect()
+        return pages
+
+    @staticmethod
+    def replayed_seqs(frames):
+        return [event["seq"] for frame in frames if "type" not in frame for event in frame.get("events", [frame])]
+
+    def test_replay_is_in_seq_order(self):
+        seqs = self.record_events(5)
+        [frames] = async_to_sync(self.resume_pages)(seqs[0])
+        self.assertEqual(self.replayed_seqs(frames), seqs[1:])
+        self.assertEqual(frames[-1], {"type": "resumed", "seq": seqs[-1], "replayed": 4, "more": False})
+
+    def test_evicted_seq_gets_a_resync(self):
+        seqs = self.record_events(5)
+        ShipmentEvent.objects.filter(id__lte=seqs[1]).delete()
+        [frames] = async_to_sync(self.resume_pages)(seqs[0])
+        self.assertEqual(frames, [{"type": "resync", "seq": seqs[-1]}])
+
+    @override_settings(SHIPMENT_EVENTS={"MAX_BATCH": 2, "OUTBOUND_QUEUE_SIZE": 4})
+    def test_long_replay_is_paged_below_the_outbound_queue(self):
+        seqs = self.record_events(10)
+        pages = async_to_sync(self.resume_pages)(seqs[0] - 1)
+        self.assertEqual([self.replayed_seqs(frames) for frames in pages], [seqs[0:4], seqs[4:8], seqs[8:]])
+        self.assertEqual([frames[-1]["more"] for frames in pages], [True, True, False])
+        # At most two frames of MAX_BATCH events before each answer: the queue never overflows
+        self.assertTrue(all(len(frames) <= 3 for frames in pages))
+
+
+class SubscriptionTests(SimpleTestCase):
+    ROWS = 300
+
+    def bulk_payload(self):
+        return {
+            "type": "shipments.event", "event_id": "bulk", "seq": 1, "model": "in_shipment",
+            "action": "bulk_created", "message": "", "ids": list(range(1, self.ROWS + 1)),
+            "bill_numbers": ["MAWB-1", *(f"HAWB-{number}" for number in range(self.ROWS))],
+            "master_bill_numbers": ["MAWB-1"],
+        }
+
+    def test_large_bulk_event_keeps_master_and_overflow_groups(self):
+        groups = subscriptions.event_groups(self.bulk_payload())
+        self.assertIn(subscriptions.bill_number_group("mawb-1"), groups)
+        self.assertIn(subscriptions.id_overflow_group("in_shipment"), groups)
+        self.assertIn(subscriptions.BILL_OVERFLOW_GROUP, groups)
+        self.assertNotIn(subscriptions.id_group("in_shipment", 1), groups)
+
+    async def subscriber(self, content):
+        communicator = WebsocketCommunicator(ShipmentsConsumer.as_asgi(), "/ws/shipments/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({"type": "subscribe", **content})
+        self.assertEqual((await communicator.receive_json_from())["type"], "subscriptions")
+        return communicator
+
+    async def test_every_matching_subscriber_gets_a_large_bulk_event(self):
+        wanted = [
+            await self.subscriber({"ids": {"in_shipment": [250]}}),
+            await self.subscriber({"bill_numbers": ["MAWB-1"]}),
+            await self.subscriber({"bill_numbers": ["hawb-299"]}),
+        ]
+        unwanted = await self.subscriber({"ids": {"in_shipment": [self.ROWS + 1]}})
+        payload = self.bulk_payload()
+        channel_layer = get_channel_layer()
+        for group in subscriptions.event_groups(payload):
+            await channel_layer.group_send(group, payload)
+
+        for communicator in wanted:
+            self.assertEqual((await communicator.receive_json_from())["action"], "bulk_created")
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+        self.assertTrue(await unwanted.receive_nothing())
+        await unwanted.disconnect()
+
+
+class InShipmentBulkTests(TestCase):
+    def test_sub_bill_number_taken_after_validation_is_a_row_error(self):
+        create_in_shipment("IN-1")
+        # Validation sees IN-1 as free, as if another request inserted it just after
+        with mock.patch("api.bulk.existing_sub_bill_numbers", side_effect=[set(), {"IN-1"}]):
+            response = APIClient().post(
+                "/api/in-shipments/bulk/", [shipment_data("IN-1"), shipment_data("IN-2")], format="json"
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error["index"] for error in response.json()["errors"]], [0])
+        self.assertEqual(InShipment.objects.count(), 1)
+
+
+def ndjson_lines(*records):
+    return [(record if isinstance(record, str) else json.dumps(record)).encode("utf-8") + b"\n" for record in records]
+
+
+class ImportTests(TestCase):
+    def test_chunks_report_errors_by_line_number(self):
+        lines = ndjson_lines(
+            shipment_data("IN-1"),
+            "{not json",
+            "",
+            "[1, 2]",
+            shipment_data("IN-2", package_count="many"),
+            shipment_data("IN-1"),
+            shipment_data("IN-3"),
+        )
+        chunks = []
+        report = bulk.import_ndjson(lines, chunk_size=2, on_chunk=lambda report: chunks.append(report.line))
+
+        self.assertEqual(report.imported, 2)
+        self.assertEqual(report.failed, 4)
+        self.assertEqual([error["index"] for error in report.errors], [2, 4, 5, 6])
+        self.assertIn("package_count", report.errors[2]["errors"])
+        # Blank lines count as lines but not as records
+        self.assertEqual(chunks, [2, 5, 7])
+        self.assertEqual(set(InShipment.objects.values_list("sub_bill_number", flat=True)), {"IN-1", "IN-3"})
+
+    def test_chunk_retries_without_rows_taken_after_validation(self):
+        create_in_shipment("IN-1")
+        with mock.patch("api.bulk.existing_sub_bill_numbers", side_effect=[set(), {"IN-1"}]):
+            report = bulk.import_ndjson(ndjson_lines(shipment_data("IN-1"), shipment_data("IN-2")))
+        self.assertEqual(report.imported, 1)
+        self.assertEqual([error["index"] for error in report.errors], [1])
+        self.assertTrue(InShipment.objects.filter(sub_bill_number="IN-2").exists())
+
+    def test_command_resumes_from_its_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "shipments.ndjson")
+            with open(path, "wb") as fh:
+                fh.writelines(ndjson_lines(*(shipment_data(f"IN-{number}") for number in range(1, 5))))
+            with open(f"{path}.checkpoint", "w") as fh:
+                json.dump({"path": path, "line": 2, "imported": 2, "failed": 0}, fh)
+            stdout = StringIO()
+            call_command("import_shipments", path, "--chunk-size", "1", stdout=stdout)
+            self.assertFalse(os.path.exists(f"{path}.checkpoint"))
+
+        self.assertIn("Resuming after line 2", stdout.getvalue())
+        self.assertEqual(set(InShipment.objects.values_list("sub_bill_number", flat=True)), {"IN-3", "IN-4"})
+
+    def test_endpoint_resumes_from_start_line(self):
+        upload = SimpleUploadedFile(
+            "shipments.ndjson", b"".join(ndjson_lines(shipment_data("IN-1"), "{not json", shipment_data("IN-3"))),
+        )
+        response = APIClient().post("/api/in-shipments/import/?start_line=1", {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["imported"], body["failed"], body["start_line"], body["next_line"]), (1, 1, 1, 3))
+        self.assertEqual([error["index"] for error in body["errors"]], [2])
+        self.assertEqual(list(InShipment.objects.values_list("sub_bill_number", flat=True)), ["IN-3"])
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        create_in_shipment("IN-1", bill_number="BL-1", payment_fees="300.00", company_name="=HYPERLINK(\"http://x\")")
+        create_in_shipment("IN-2", bill_number="BL-1", payment_fees="100.00", company_name="Nile Cargo")
+        create_in_shipment("IN-3", bill_number="BL-9", payment_fees="200.00", company_name="Nile Cargo")
+
+    def export(self, query):
+        response = self.client.get("/api/in-shipments/export/", query)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def csv_rows(self, query):
+        return list(csv.reader(StringIO(self.export({"file_format": "csv", **query}).decode("utf-8-sig"))))
+
+    def test_csv_applies_filters_search_and_ordering(self):
+        rows = self.csv_rows({"bill_number": "bl-1", "ordering": "payment_fees"})
+        header, *rows = rows
+        self.assertEqual(header[:3], ["ID", "رقم البوليصة", "رقم البوليصة الفرعية"])
+        self.assertEqual([(row[2], row[9]) for row in rows], [("IN-2", "100.00"), ("IN-1", "300.00")])
+
+        rows = self.csv_rows({"search": "nile", "ordering": "-payment_fees"})[1:]
+        self.assertEqual([row[2] for row in rows], ["IN-3", "IN-2"])
+
+    def test_csv_escapes_formulas(self):
+        rows = {row[2]: row for row in self.csv_rows({})[1:]}
+        self.assertEqual(rows["IN-1"][4], "'=HYPERLINK(\"http://x\")")
+        self.assertEqual(rows["IN-2"][4], "Nile Cargo")
+
+    def test_xlsx_sheet(self):
+        with zipfile.ZipFile(BytesIO(self.export({"file_format": "xlsx", "ordering": "payment_fees"}))) as archive:
+            sheet = archive.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        rows = re.findall(r"<row>(.*?)</row>", sheet)
+        self.assertEqual(len(rows), 4)
+        self.assertIn(">ID<", rows[0])
+        # Numbers are numeric cells, text is escaped, formulas do not run
+        self.assertIn("<c><v>100.00</v></c>", rows[1])
+        self.assertIn("<t xml:space=\"preserve\">'=HYPERLINK(\"http://x\")</t>", rows[3])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.in_shipment = create_in_shipment("IN-1", package_count=5)
+        self.spare = create_in_shipment("IN-2")
+
+    def revalidate(self, url):
+        """The ETag of ``url``, after checking that sending it back gets a 304"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b"")
+        return etag
+
+    def test_unchanged_reads_are_not_modified(self):
+        for url in ("/api/in-shipments/", f"/api/in-shipments/{self.in_shipment.id}/", "/api/in-shipments/stats/"):
+            with self.subTest(url=url):
+                self.revalidate(url)
+
+    def test_etag_changes_after_a_delete(self):
+        urls = ("/api/in-shipments/", "/api/in-shipments/stats/")
+        etags = [self.revalidate(url) for url in urls]
+        self.assertEqual(self.client.delete(f"/api/in-shipments/{self.spare.id}/").status_code, 204)
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_etag_changes_after_a_related_table_write(self):
+        response = self.client.post(
+            "/api/out-shipments/", shipment_data("OUT-1", in_shipment_id=self.in_shipment.id, package_count=1),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        url = "/api/out-shipments/?expand=in_shipment"
+        etag = self.revalidate(url)
+        # Outbound lists embed the inbound shipment
+        updated = self.client.patch(f"/api/in-shipments/{self.in_shipment.id}/", {"bill_number": "BL-2"}, format="json")
+        self.assertEqual(updated.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["in_shipment"]["bill_number"], "BL-2")
+
+
+class ResponseCacheTests(TestCase):
+    def test_cursor_links_follow_the_request_host(self):
+        for number in range(3):
+            create_in_shipment(f"IN-{number}")
+        client = APIClient()
+        first = client.get("/api/in-shipments/?page_size=1", HTTP_HOST="a.example")
+        second = client.get("/api/in-shipments/?page_size=1", HTTP_HOST="b.example", secure=True)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "MISS")
+        self.assertTrue(first.json()["next"].startswith("http://a.example/"))
+        self.assertTrue(second.json()["next"].startswith("https://b.example/"))
+
+
+class AuthCacheTests(TestCase):
+    """Each AuthCache on the same file stands for one worker process"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "auth_cache.sqlite3")
+        settings_override = override_settings(AUTH_CACHE={"TTL": 60, "MAX_ENTRIES": 100, "PATH": self.path})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = get_user_model().objects.create_user("clerk", password="secret-password")
+        self.other_worker = AuthCache(path=self.path)
+
+    def test_logout_reaches_other_workers(self):
+        client = APIClient()
+        self.assertTrue(client.login(username="clerk", password="secret-password"))
+        session_key = client.session.session_key
+        self.other_worker.set("session", session_key, self.user)
+        self.assertIsNotNone(self.other_worker.get("session", session_key))
+        client.logout()
+        self.assertIsNone(self.other_worker.get("session", session_key))
+
+    def test_token_delete_reaches_other_workers(self):
+        token = Token.objects.create(user=self.user)
+        self.other_worker.set("token", token.key, self.user, token)
+        token.delete()
+        self.assertIsNone(self.other_worker.get("token", token.key))
+
+    def test_user_change_reaches_other_workers(self):
+        self.other_worker.set("token", "key-1", self.user)
+        self.other_worker.set("session", "session-1", self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.other_worker.get("token", "key-1"))
+        self.assertIsNone(self.other_worker.get("session", "session-1"))
+
+    def test_worker_behind_the_pruned_log_starts_over(self):
+        self.other_worker.set("token", "key-1", self.user)
+        with mock.patch("api.authentication.INVALIDATION_LOG_SIZE", 2):
+            for number in range(4):
+                get_auth_cache().invalidate("token", f"unrelated-{number}")
+        self.assertIsNone(self.other_worker.get("token", "key-1"))
+
+
+class StatsTimeseriesTests(TestCase):
+    def test_bucket_sums_are_rounded_to_cents(self):
+        # 0.10 + 0.20 summed as floats is 0.30000000000000004
+        create_in_shipment("IN-1", weight="0.10")
+        create_in_shipment("IN-2", weight="0.20", company_name="شركة أخرى")
+        response = APIClient().get("/api/in-shipments/stats/timeseries/?granularity=month")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["total_weight"], 0.3)
+
+
+class RequestTimingTests(TestCase):
+    def test_server_timing_skips_streaming_exports(self):
+        create_in_shipment("IN-1")
+        client = APIClient()
+        listed = client.get("/api/in-shipments/")
+        self.assertIn("total;dur=", listed["Server-Timing"])
+        exported = client.get("/api/in-shipments/export/?file_format=csv")
+        self.assertTrue(exported.streaming)
+        self.assertFalse(exported.has_header("Server-Timing"))
+
+
+class LookupFieldTests(TestCase):
+    def test_update_fields_writes_the_derived_columns(self):
+        company = Company.objects.create(name="Nile Cargo")
+        in_shipment = create_in_shipment("IN-1")
+        out_shipment = OutShipment.objects.create(in_shipment=in_shipment, **shipment_data("OUT-1", package_count=1))
+        in_shipment.bill_number = "mawb-9"
+        in_shipment.company_name = "Nile Cargo"
+        in_shipment.save(update_fields=["bill_number", "company_name"])
+
+        in_shipment.refresh_from_db()
+        self.assertEqual(in_shipment.bill_number_key, "MAWB-9")
+        self.assertIn("mawb-9", in_shipment.search_document)
+        self.assertIn("nile cargo", in_shipment.search_document)
+        self.assertEqual(in_shipment.company_ref_id, company.id)
+        out_shipment.refresh_from_db()
+        self.assertIn("mawb-9", out_shipment.search_document)
+
+        out_shipment.sub_bill_number = "out-2"
+        out_shipment.save(update_fields=["sub_bill_number"])
+        out_shipment.refresh_from_db()
+        self.assertEqual(out_shipment.sub_bill_number_key, "OUT-2")
+        self.assertIn("out-2", out_shipment.search_document)
+
+
+class ShipmentReferenceTests(TestCase):
+    def test_rename_carries_over_to_shipments_and_rollups(self):
+        company = Company.objects.create(name="شركة الاختبار")
+        in_shipment = create_in_shipment("IN-1", weight="4.00")
+        create_in_shipment("IN-2", weight="6.00", company_name="شركة أخرى")
+        OutShipment.objects.create(in_shipment=in_shipment, **shipment_data("OUT-1", package_count=1))
+
+        company.name = "شركة جديدة"
+        company.save()
+
+        for model in (InShipment, OutShipment):
+            self.assertFalse(model.objects.filter(company_name="شركة الاختبار").exists())
+            self.assertEqual(aggregates.verify_rollups(model), {})
+        in_shipment.refresh_from_db()
+        self.assertEqual((in_shipment.company_name, in_shipment.company_ref_id), ("شركة جديدة", company.id))
+        self.assertIn("شركه جديده", in_shipment.search_document)
+        [bucket] = aggregates.get_timeseries(InShipment, company_name="شركة جديدة")
+        self.assertEqual((bucket["total_shipments"], bucket["total_weight"]), (1, 4.0))
+        self.assertEqual(aggregates.get_timeseries(InShipment, company_name="شركة الاختبار"), [])
+
+    def test_rename_keeps_reference_on_save(self):
+        company = Company.objects.create(name="شركة الاختبار")
+        in_shipment = create_in_shipment("IN-1")
+        self.assertEqual(in_shipment.company_ref_id, company.id)
+
+        company.name = "شركة جديدة"
+        company.save()
+        in_shipment.refresh_from_db()
+        in_shipment.receiver_name = "مستلم آخر"
+        in_shipment.save()
+        in_shipment.refresh_from_db()
+        self.assertEqual(in_shipment.company_ref_id, company.id)
+
+        # A changed name is resolved again
+        in_shipment.company_name = "شركة غير مسجلة"
+        in_shipment.save()
+        in_shipment.refresh_from_db()
+        self.assertIsNone(in_shipment.company_ref_id)
+
+    def test_linking_and_unlinking_refresh_cached_lists(self):
+        create_in_shipment("IN-1")
+        client = APIClient()
+        first = client.get("/api/in-shipments/")
+        self.assertIsNone(first.json()["results"][0]["company_ref"])
+
+        company = Company.objects.create(name="شركة الاختبار")
+        linked = client.get("/api/in-shipments/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(linked.status_code, 200)
+        self.assertEqual(linked.json()["results"][0]["company_ref"], company.id)
+
+        company.delete()
+        unlinked = client.get("/api/in-shipments/", HTTP_IF_NONE_MATCH=linked["ETag"])
+        self.assertEqual(unlinked.status_code, 200)
+        self.assertIsNone(unlinked.json()["results"][0]["company_ref"])
+
+
+class ShipmentPaginationTests(TestCase):
+    def walk(self, client, url, link):
+        pages = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row["id"] for row in response.json()["results"]])
+            url = response.json()[link]
+        return pages
+
+    def test_nullable_ordering_walks_both_ways(self):
+        dates = [None, "2025-02-01", None, "2025-01-01", "2025-02-01", None]
+        shipments = [
+            create_in_shipment(f"IN-{number}", disbursement_date=date) for number, date in enumerate(dates)
+        ]
+        client = APIClient()
+        for descending in (False, True):
+            with self.subTest(descending=descending):
+                # NULLs are the smallest value; ties go by id in the same direction
+                expected = [
+                    shipment.id for shipment in sorted(
+                        shipments,
+                        key=lambda shipment: (shipment.disbursement_date is not None, str(shipment.disbursement_date), shipment.id),
+                        reverse=descending,
+                    )
+                ]
+                ordering = "-disbursement_date" if descending else "disbursement_date"
+                forward = self.walk(client, f"/api/in-shipments/?ordering={ordering}&page_size=2", "next")
+                self.assertEqual([pk for page in forward for pk in page], expected)
+
+                last = client.get(f"/api/in-shipments/?ordering={ordering}&page_size=2").json()
+                while last["next"]:
+                    last = client.get(last["next"]).json()
+                backward = self.walk(client, last["previous"], "previous")
+                self.assertEqual([pk for page in reversed(backward) for pk in page], expected[:-2])
+
+
+@skipUnlessDBFeature("supports_explaining_query_execution")
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.in_shipment = create_in_shipment("IN-1", package_count=5)
+        response = self.client.post(
+            "/api/out-shipments/", shipment_data("OUT-1", in_shipment_id=self.in_shipment.id, package_count=1),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.out_shipment_id = response.json()["id"]
+
+    def selects(self, url, table):
+        """The JSON of ``url`` and the SQL of the queries reading ``table``"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query["sql"] for query in queries if f'FROM "{table}"' in query["sql"]]
+
+    def test_fields_limits_the_representation_and_the_columns(self):
+        for url in ("/api/in-shipments/", f"/api/in-shipments/{self.in_shipment.id}/"):
+            url += "?fields=id,bill_number"
+            body, statements = self.selects(url, "in_shipments")
+            row = body["results"][0] if "results" in body else body
+            self.assertEqual(row, {"id": self.in_shipment.id, "bill_number": "BL-1000"})
+            self.assertTrue(statements)
+            for sql in statements:
+                self.assertNotIn('"receiver_name"', sql)
+
+    def test_expand_nests_the_inbound_shipment_with_one_join(self):
+        url = f"/api/out-shipments/{self.out_shipment_id}/"
+        plain, _ = self.selects(url, "out_shipments")
+        self.assertEqual(plain["in_shipment"], self.in_shipment.id)
+
+        for expanded_url in (f"{url}?expand=in_shipment", "/api/out-shipments/?expand=in_shipment"):
+            body, statements = self.selects(expanded_url, "out_shipments")
+            row = body["results"][0] if "results" in body else body
+            self.assertEqual(row["in_shipment"]["sub_bill_number"], "IN-1")
+            self.assertTrue(any('JOIN "in_shipments"' in sql for sql in statements))
+
+    def test_fields_and_expand_combine(self):
+        body, _ = self.selects(
+            f"/api/out-shipments/{self.out_shipment_id}/?fields=id,in_shipment&expand=in_shipment", "out_shipments"
+        )
+        self.assertEqual(set(body), {"id", "in_shipment"})
+        self.assertEqual(body["in_shipment"]["id"], self.in_shipment.id)
+
+
+class ValuesListSerializerTests(TestCase):
+    """The values()-based list path renders the same JSON as the ModelSerializer"""
+
+    def setUp(self):
+        self.in_shipments = [
+            create_in_shipment("IN-1", weight="12.5", payment_fees="0.1"),
+            create_in_shipment("IN-2", package_count=3, disbursement_date=date(2025, 2, 1), ground_fees="1234.99"),
+        ]
+        self.client = APIClient()
+        for number, in_shipment in enumerate(self.in_shipments):
+            response = self.client.post(
+                "/api/out-shipments/",
+                shipment_data(f"OUT-{number}", in_shipment_id=in_shipment.id, package_count=1, weight="3.30"),
+                format="json",
+            )
+            self.assertEqual(response.status_code, 201)
+        OutShipment.objects.filter(sub_bill_number="OUT-1").update(disbursement_date=date(2025, 3, 1))
+
+    def assertParity(self, serializer_class, query):
+        request = Request(APIRequestFactory().get("/", query))
+        serializer = serializer_class(context={"request": request})
+        reader = ValuesListSerializer(serializer)
+        queryset = serializer_class.Meta.model.objects.order_by("id")
+        expected = serializer_class(queryset, many=True, context={"request": request}).data
+        self.assertEqual(
+            json.loads(JSONRenderer().render(reader.serialize(reader.queryset(queryset)))),
+            json.loads(JSONRenderer().render(expected)),
+        )
+
+    def test_in_shipments(self):
+        for query in ({}, {"fields": "id,status,weight,payment_fees,arrival_date,disbursement_date,created_at"}):
+            with self.subTest(query=query):
+                self.assertParity(InShipmentSerializer, query)
+
+    def test_out_shipments(self):
+        queries = ({}, {"fields": "id,status,weight,export_date,in_shipment"}, {"expand": "in_shipment"})
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertParity(OutShipmentSerializer, query)
+
+
+class QueryPlanTests(TestCase):
+    """
+    Every shipment query the list endpoints and admin filters issue must be
+    served from an index: ``EXPLAIN QUERY PLAN`` may not show a bare
+    ``SCAN`` of a shipment table, a filtered walk over a whole index, or a
+    sort unless the rows come from a lookup that cannot share the list order.
+    """
+
+    FULL_SCAN = re.compile(r"^SCAN (in|out)_shipments$")
+    # Walking an index in order is how an unfiltered first page reads its
+    # LIMIT rows; with a WHERE clause it means every row is checked instead
+    INDEX_WALK = re.compile(r"^SCAN (in|out)_shipments USING (COVERING )?INDEX ")
+    SORT = re.compile(r"USE TEMP B-TREE")
+
+    IN_SHIPMENT_URLS = [
+        "/api/in-shipments/",
+        "/api/in-shipments/?ordering=arrival_date",
+        "/api/in-shipments/?ordering=-arrival_date",
+        "/api/in-shipments/?ordering=disbursement_date",
+        "/api/in-shipments/?ordering=-disbursement_date",
+        "/api/in-shipments/?ordering=payment_fees",
+        "/api/in-shipments/?ordering=-payment_fees",
+        "/api/in-shipments/?export=true",
+        "/api/in-shipments/?export=false",
+        "/api/in-shipments/?bill_number=bl-1000",
+        "/api/in-shipments/?sub_bill_number=in-1",
+        "/api/in-shipments/?company_ref={company}",
+        "/api/in-shipments/?destination_ref={destination}",
+        "/api/in-shipments/?search=bl-1000",
+    ]
+    OUT_SHIPMENT_URLS = [
+        "/api/out-shipments/",
+        "/api/out-shipments/?ordering=export_date",
+        "/api/out-shipments/?ordering=-export_date",
+        "/api/out-shipments/?ordering=arrival_date",
+        "/api/out-shipments/?ordering=disbursement_date",
+        "/api/out-shipments/?ordering=-payment_fees",
+        "/api/out-shipments/?bill_number=bl-1000",
+        "/api/out-shipments/?company_ref={company}",
+        "/api/out-shipments/?destination_ref={destination}",
+        "/api/out-shipments/?search=bl-1000",
+    ]
+    # Rows found through the search index or the in shipment's bill number
+    # come in no list order; they are sorted after the lookup
+    SORTED_AFTER_LOOKUP = {
+        "/api/in-shipments/?search=bl-1000",
+        "/api/out-shipments/?bill_number=bl-1000",
+        "/api/out-shipments/?search=bl-1000",
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="شركة الاختبار")
+        cls.destination = Destination.objects.create(name="القاهرة")
+        for number in range(3):
+            in_shipment = create_in_shipment(f"IN-{number}", disbursement_date=None if number else "2025-02-01")
+            data = shipment_data(f"OUT-{number}", package_count=1, export_date="2025-01-20")
+            for field in ("weight", "payment_fees", "ground_fees"):
+                data[field] = Decimal(data[field])
+            OutShipment.objects.create(in_shipment=in_shipment, **data)
+
+    def assertIndexed(self, sql, params=None, sorted_after_lookup=False):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        filtered = " WHERE " in sql
+        bad = [
+            step for step in plan
+            if self.FULL_SCAN.match(step)
+            or (filtered and self.INDEX_WALK.match(step))
+            or (not sorted_after_lookup and self.SORT.search(step))
+        ]
+        self.assertFalse(bad, "Not served from an index:\n{}\n{}".format(sql, "\n".join(plan)))
+
+    def assertListIndexed(self, url):
+        """The first page and the page after it (a keyset predicate) both use an index"""
+        client = APIClient()
+        sorted_after_lookup = url in self.SORTED_AFTER_LOOKUP
+        url = url.format(company=self.company.id, destination=self.destination.id)
+        separator = "&" if "?" in url else "?"
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"{url}{separator}page_size=1")
+            self.assertEqual(response.status_code, 200)
+            if response.json()["next"]:
+                self.assertEqual(client.get(response.json()["next"]).status_code, 200)
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT") and "_shipments" in query["sql"]]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertIndexed(sql, sorted_after_lookup=sorted_after_lookup)
+
+    def test_in_shipment_lists(self):
+        for url in self.IN_SHIPMENT_URLS:
+            with self.subTest(url=url):
+                self.assertListIndexed(url)
+
+    def test_out_shipment_lists(self):
+        for url in self.OUT_SHIPMENT_URLS:
+            with self.subTest(url=url):
+                self.assertListIndexed(url)
+
+    def test_admin_filters(self):
+        for queryset in (
+            InShipment.objects.filter(contract_status="نهائي"),
+            OutShipment.objects.filter(contract_status="نهائي"),
+        ):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexed(*queryset.query.sql_with_params())
+        # Date filters are ranges like the admin's "this month"; the range is
+        # read off the date's index and the matching rows are sorted
+        for queryset in (
+            InShipment.objects.filter(arrival_date__gte="2025-01-01", arrival_date__lt="2025-02-01"),
+            OutShipment.objects.filter(export_date__gte="2025-01-01", export_date__lt="2025-02-01"),
+        ):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexed(*queryset.query.sql_with_params(), sorted_after_lookup=True)
+
+
+class ShipmentSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hope = create_in_shipment("IN-A", company_name="شركة الأمل", bill_number="MAWB-77")
+        self.nile = create_in_shipment("IN-B", company_name="Nile Cargo", bill_number="BL-2", destination="الإسكندرية")
+        response = self.client.post(
+            "/api/out-shipments/",
+            shipment_data("OUT-A", in_shipment_id=self.hope.id, package_count=1, bill_number="OUT-BL"),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.out_shipment_id = response.json()["id"]
+
+    def search(self, term, path="/api/in-shipments/"):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, {"search": term})
+        self.assertEqual(response.status_code, 200)
+        self.queries = [query["sql"] for query in queries]
+        return sorted(row["id"] for row in response.json()["results"])
+
+    def test_arabic_variants_and_case_fold(self):
+        self.assertEqual(self.search("شركه الامل"), [self.hope.id])
+        self.assertEqual(self.search("الأَمَل"), [self.hope.id])
+        self.assertEqual(self.search("NILE cargo"), [self.nile.id])
+        self.assertEqual(self.search("mawb-77"), [self.hope.id])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search("nile الاسكندريه"), [self.nile.id])
+        self.assertEqual(self.search("nile القاهرة"), [])
+
+    def test_short_terms_fall_back_to_like(self):
+        self.assertEqual(self.search("2"), [self.nile.id])
+        self.assertTrue(any("LIKE" in sql for sql in self.queries))
+        self.assertFalse(any("MATCH" in sql for sql in self.queries))
+
+    def test_out_shipments_match_the_inbound_bill_number(self):
+        self.assertEqual(self.search("MAWB-77", "/api/out-shipments/"), [self.out_shipment_id])
+        self.assertEqual(self.search("BL-2", "/api/out-shipments/"), [])
+
+
+class SearchIndexMigrationTests(TransactionTestCase):
+    def test_migrating_back_past_the_search_document_drops_the_index(self):
+        try:
+            call_command("migrate", "api", "0020", verbosity=0)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT name FROM sqlite_master WHERE name LIKE %s", ["%_fts%"])
+                self.assertEqual(cursor.fetchall(), [])
+        finally:
+            call_command("migrate", "api", verbosity=0)
+        create_in_shipment("IN-1")
+        self.assertEqual(InShipment.objects.count(), 1)
+        get_dispatcher().flush()
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def seed(self, **options):
+        call_command("seed_shipments", in_shipments=60, companies=4, destinations=3, batch_size=25, stdout=StringIO(), **options)
+
+    def seeded(self):
+        return list(
+            OutShipment.objects.filter(sub_bill_number__startswith="SEED3-")
+            .order_by("sub_bill_number")
+            .values_list("sub_bill_number", "in_shipment__sub_bill_number", "package_count", "export_date", "weight")
+        )
+
+    def test_seed_is_deterministic_and_consistent(self):
+        self.seed(seed=3)
+        first = self.seeded()
+        self.assertTrue(first)
+        self.seed(seed=3, clear=True)
+        self.assertEqual(self.seeded(), first)
+        self.assertEqual(InShipment.objects.filter(sub_bill_number__startswith="SEED3-").count(), 60)
+
+        for in_shipment in InShipment.objects.filter(sub_bill_number__startswith="SEED3-"):
+            exported = sum(in_shipment.out_shipments.values_list("package_count", flat=True))
+            self.assertEqual(in_shipment.exported_count, exported)
+            self.assertEqual(in_shipment.export, exported == in_shipment.package_count)
+        # Totals and rollups were rebuilt: the checker raises on any mismatch
+        call_command("rebuild_shipment_stats", check=True, stdout=StringIO())
+
+    def test_benchmark_reports_every_scenario(self):
+        self.seed(seed=4)
+        output = StringIO()
+        call_command("benchmark_api", requests=3, warmup=1, stdout=output, stderr=StringIO())
+        report = json.loads(output.getvalue())
+
+        self.assertEqual(report["dataset"]["in_shipments"], 60)
+        self.assertEqual(set(report["scenarios"]), {
+            "list", "search", "filter", "stats", "detail", "create_in_shipment", "create_out_shipment",
+        })
+        for name, result in report["scenarios"].items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result["errors"], 0)
+                self.assertEqual(result["requests"], 3)
+                self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+                self.assertLessEqual(result["p95_ms"], result["p99_ms"])
+        # Created shipments are removed afterwards
+        self.assertFalse(InShipment.objects.filter(sub_bill_number__startswith="BENCH-").exists())
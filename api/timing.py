@@ -0,0 +1,155 @@
+import contextlib
+import heapq
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+
+slow_log = logging.getLogger("api.slow_requests")
+
+DEFAULT_SLOW_REQUEST_MS = 500
+DEFAULT_SLOWEST_STATEMENTS = 5
+
+# SQL kept in the slow log is cut to this many characters
+STATEMENT_MAX_LENGTH = 2000
+
+_current = ContextVar("request_timing", default=None)
+
+
+def timing_settings():
+    return getattr(settings, "REQUEST_TIMING", {})
+
+
+class RequestTiming:
+    """
+    Where one request spends its time: SQL (count, total and the slowest
+    statements) and named spans such as ``serialize`` and ``render``. A span
+    excludes the SQL it issues, so the metrics add up instead of overlapping,
+    and a span opened inside the same span (a nested serializer) is not
+    counted twice.
+    """
+
+    def __init__(self, keep_statements=DEFAULT_SLOWEST_STATEMENTS):
+        self.started = time.perf_counter()
+        self.keep_statements = keep_statements
+        self.sql_count = 0
+        self.sql_time = 0.0
+        # min-heap of (duration, sequence, sql) holding the slowest statements
+        self.statements = []
+        self.spans = {}
+        self.open_spans = set()
+
+    def record_sql(self, sql, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+        entry = (duration, self.sql_count, sql)
+        if len(self.statements) < self.keep_statements:
+            heapq.heappush(self.statements, entry)
+        elif self.statements and duration > self.statements[0][0]:
+            heapq.heapreplace(self.statements, entry)
+
+    def add(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        metrics = [f'sql;dur={self.sql_time * 1000:.2f};desc="{self.sql_count} queries"']
+        metrics.extend(f"{name};dur={duration * 1000:.2f}" for name, duration in self.spans.items())
+        metrics.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(metrics)
+
+    def slowest_statements(self):
+        return [
+            {"ms": round(duration * 1000, 2), "sql": sql[:STATEMENT_MAX_LENGTH]}
+            for duration, _, sql in sorted(self.statements, reverse=True)
+        ]
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_sql(sql, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Add the time spent in the block, minus its SQL, to ``name``"""
+    timing = _current.get()
+    if timing is None or name in timing.open_spans:
+        yield
+        return
+    timing.open_spans.add(name)
+    started, sql_before = time.perf_counter(), timing.sql_time
+    try:
+        yield
+    finally:
+        timing.open_spans.discard(name)
+        timing.add(name, time.perf_counter() - started - (timing.sql_time - sql_before))
+
+
+class RequestTimingMiddleware:
+    """
+    Measures every request (SQL through an execute wrapper on each database
+    connection, serializer and render spans) and reports it in a
+    ``Server-Timing`` header. Requests slower than
+    ``REQUEST_TIMING["SLOW_REQUEST_MS"]`` are written to the
+    ``api.slow_requests`` logger as one JSON object with their slowest SQL.
+
+    Streaming responses (the CSV / XLSX exports) are left out: the view
+    returns before the body is produced, so the numbers would only cover
+    the time to the first byte.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = timing_settings()
+        timing = RequestTiming(config.get("SLOWEST_STATEMENTS", DEFAULT_SLOWEST_STATEMENTS))
+        token = _current.set(timing)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timing))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        if response.streaming:
+            return response
+        response["Server-Timing"] = timing.server_timing()
+        threshold = config.get("SLOW_REQUEST_MS", DEFAULT_SLOW_REQUEST_MS)
+        elapsed = timing.elapsed() * 1000
+        if threshold is not None and elapsed >= threshold:
+            slow_log.warning(json.dumps({
+                "method": request.method,
+                "path": request.get_full_path(),
+                "status": response.status_code,
+                "ms": round(elapsed, 2),
+                "sql_count": timing.sql_count,
+                "sql_ms": round(timing.sql_time * 1000, 2),
+                **{f"{name}_ms": round(duration * 1000, 2) for name, duration in timing.spans.items()},
+                "slowest_sql": timing.slowest_statements(),
+            }, ensure_ascii=False))
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns; time it up to the
+        # post-render callback
+        timing = _current.get()
+        if timing is not None:
+            started, sql_before = time.perf_counter(), timing.sql_time
+
+            def rendered(response):
+                timing.add("render", time.perf_counter() - started - (timing.sql_time - sql_before))
+
+            response.add_post_render_callback(rendered)
+        return response
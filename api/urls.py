@@ -1,4 +1,4 @@
-from .views import DestinationViewSet, CompanyViewSet, InShipmentViewSet, OutShipmentViewSet
+from .views import DestinationViewSet, CompanyViewSet, InShipmentViewSet, OutShipmentViewSet, metrics
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
 
@@ -13,6 +13,7 @@ router.register('in-shipments', InShipmentViewSet, basename='in-shipment')
 router.register('out-shipments', OutShipmentViewSet, basename='out-shipment')
 
 urlpatterns = [
+    path("api/metrics/", metrics, name="metrics"),
     path("api/", include(router.urls)),
 ]
 
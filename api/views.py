@@ -1,10 +1,13 @@
 from rest_framework import viewsets, status
 from rest_framework.exceptions import ValidationError
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from django.db.models import Sum, Count, Max
+from rest_framework.filters import OrderingFilter
+from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models.deletion import ProtectedError
-from datetime import datetime
+
+from consumers.shipments import outbound_stats
 
 from .models import Destination, Company, InShipment, OutShipment
 from .serializers import (
@@ -12,8 +15,18 @@ from .serializers import (
     CompanySerializer,
     InShipmentSerializer,
     OutShipmentSerializer,
+    TimeseriesQuerySerializer,
 )
 from .filters import InShipmentFilter, OutShipmentFilter
+from .pagination import ShipmentCursorPagination
+from .search import SEARCH_FIELDS, ShipmentSearchFilter
+from .signals import broadcast_event
+from . import aggregates, allocation, bulk, exports, fieldsets
+from .authentication import get_auth_cache
+from .cache import cached_response, get_response_cache
+from .conditional import conditional_get
+from .dispatch import get_dispatcher
+from .listing import ValuesListSerializer
 
 
 class DestinationViewSet(viewsets.ModelViewSet):
@@ -22,6 +35,11 @@ class DestinationViewSet(viewsets.ModelViewSet):
     serializer_class = DestinationSerializer
     search_fields = ["name"]
     ordering_fields = ["name", "created_at"]
+    depends_on = ("destination",)
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     def update(self, request, *args, **kwargs):
         """Disable PUT/PATCH updates"""
@@ -44,6 +62,11 @@ class CompanyViewSet(viewsets.ModelViewSet):
     serializer_class = CompanySerializer
     search_fields = ["name"]
     ordering_fields = ["name", "created_at"]
+    depends_on = ("company",)
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     def update(self, request, *args, **kwargs):
         """Disable PUT/PATCH updates"""
@@ -60,40 +83,125 @@ class CompanyViewSet(viewsets.ModelViewSet):
         )
 
 
-class InShipmentViewSet(viewsets.ModelViewSet):
+class ShipmentReadMixin:
+    """
+    Fetch only the columns the (``?fields=``-restricted) serializer renders
+    on reads, plus the ones the paginator orders by, and join the inbound
+    shipment only when it is expanded. Lists skip model instances and the
+    ``ModelSerializer`` machinery altogether (see ``ValuesListSerializer``).
+    Reads answer conditional requests from the tables in ``depends_on``,
+    and lists and stats are served from the response cache.
+    """
+    sparse_actions = ('list', 'retrieve')
+    depends_on = ()
+
+    def paginated_columns(self):
+        return ['created_at', *self.ordering_fields]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in self.sparse_actions:
+            return queryset
+        return fieldsets.restrict_queryset(queryset, self.get_serializer(), self.paginated_columns())
+
+    @conditional_get
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @conditional_get
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        reader = ValuesListSerializer(self.get_serializer(), keep=self.paginated_columns())
+        queryset = reader.queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.serialize(page))
+        return Response(reader.serialize(queryset))
+
+
+class InShipmentViewSet(ShipmentReadMixin, viewsets.ModelViewSet):
     """ViewSet for InShipment model (Inbound Shipments)"""
     queryset = InShipment.objects.all()
     serializer_class = InShipmentSerializer
     filterset_class = InShipmentFilter
+    pagination_class = ShipmentCursorPagination
+    filter_backends = [DjangoFilterBackend, ShipmentSearchFilter, OrderingFilter]
 
-    search_fields = ["company_name", "sub_bill_number", "bill_number", "destination", "contract_status"]
+    search_fields = SEARCH_FIELDS["in_shipment"]
+    depends_on = ("in_shipment",)
     ordering_fields = ["disbursement_date", "arrival_date", "payment_fees"]
 
     @action(detail=False, methods=['get'])
+    @conditional_get
+    @cached_response
     def stats(self, request):
-        stats = InShipment.objects.aggregate(
-            total_shipments=Count('id'),
-            total_weight=Sum('weight'),
-            total_payment_fees=Sum('payment_fees'),
-            total_ground_fees=Sum('ground_fees'),
-            last_updated=Max('updated_at'),
+        return Response(aggregates.get_totals(InShipment))
+
+    @action(detail=False, methods=['get'], url_path='stats/timeseries')
+    @conditional_get
+    @cached_response
+    def stats_timeseries(self, request):
+        params = TimeseriesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(aggregates.get_timeseries(InShipment, **params.validated_data))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered/searched/ordered list as CSV or XLSX (?file_format=csv|xlsx)"""
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.STREAMS:
+            raise ValidationError({"file_format": "الصيغة المدعومة: csv أو xlsx."})
+        queryset = self.filter_queryset(self.get_queryset())
+        return exports.export_response(queryset, "in_shipment", file_format)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create many inbound shipments at once; nothing is inserted if any row is invalid"""
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({"detail": "يجب إرسال قائمة من الشحنات."})
+        if len(rows) > bulk.BULK_MAX_ROWS:
+            raise ValidationError({"detail": f"الحد الأقصى {bulk.BULK_MAX_ROWS} شحنة في الطلب الواحد."})
+
+        valid, errors = bulk.validate_in_shipment_rows(rows)
+        if errors:
+            return Response({"created": 0, "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            created = bulk.insert_in_shipments([data for _, data in valid])
+        except ValidationError as exc:
+            # Another request took some of the sub_bill_numbers since validation
+            errors = bulk.conflicting_rows(valid, exc.detail) or [{"index": None, "errors": exc.detail}]
+            return Response({"created": 0, "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+        ids = [instance.id for instance in created]
+        broadcast_event(
+            "in_shipment",
+            "bulk_created",
+            ids=ids,
+            bill_numbers={instance.sub_bill_number for instance in created},
+            master_bill_numbers={instance.bill_number for instance in created},
         )
-        
-        stats['total_shipments'] = stats['total_shipments'] or 0
-        stats['total_weight'] = stats['total_weight'] or 0
-        stats['total_payment_fees'] = stats['total_payment_fees'] or 0
-        stats['total_ground_fees'] = stats['total_ground_fees'] or 0
-        stats['last_updated'] = stats['last_updated'] or datetime.now()
-
-        for key, value in stats.items():
-            if key == 'total_shipments':
-                continue
-            elif key == 'last_updated':
-                stats[key] = value.isoformat() if value else None
-            else:   
-                stats[key] = float(value or 0)
-
-        return Response(stats)
+        return Response({"created": len(ids), "ids": ids, "errors": []}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_ndjson(self, request):
+        """
+        Import an uploaded NDJSON file (multipart field ``file``) chunk by chunk.
+        Pass ``start_line`` (the ``next_line`` of an interrupted import) to resume.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({"file": "يجب رفع ملف NDJSON."})
+        try:
+            start_line = max(0, int(request.query_params.get('start_line', 0)))
+            chunk_size = min(max(1, int(request.query_params.get('chunk_size', 1000))), bulk.BULK_MAX_ROWS)
+        except ValueError:
+            raise ValidationError({"detail": "start_line و chunk_size يجب أن تكون أرقاماً."})
+
+        report = bulk.import_ndjson(upload, chunk_size, start_line)
+        if report.imported:
+            broadcast_event("in_shipment", "imported", count=report.imported)
+        return Response(report.as_dict())
     
     def perform_destroy(self, instance):
         try:
@@ -105,40 +213,52 @@ class InShipmentViewSet(viewsets.ModelViewSet):
             })
 
 
-class OutShipmentViewSet(viewsets.ModelViewSet):
+class OutShipmentViewSet(ShipmentReadMixin, viewsets.ModelViewSet):
     """ViewSet for OutShipment model (Outbound Shipments)"""
     queryset = OutShipment.objects.select_related('in_shipment').all()
     serializer_class = OutShipmentSerializer
     filterset_class = OutShipmentFilter
+    pagination_class = ShipmentCursorPagination
+    filter_backends = [DjangoFilterBackend, ShipmentSearchFilter, OrderingFilter]
 
-    search_fields = ["company_name", "sub_bill_number", "bill_number", "destination", "contract_status", "in_shipment__bill_number"]
+    search_fields = SEARCH_FIELDS["out_shipment"]
+    # Expanded / searched inbound shipment columns show up in outbound responses
+    depends_on = ("in_shipment", "out_shipment")
     ordering_fields = ["export_date", "disbursement_date", "arrival_date", "payment_fees"]
 
     @action(detail=False, methods=['get'])
+    @conditional_get
+    @cached_response
     def stats(self, request):
-        stats = OutShipment.objects.aggregate(
-            total_shipments=Count('id'),
-            total_weight=Sum('weight'),
-            total_payment_fees=Sum('payment_fees'),
-            total_ground_fees=Sum('ground_fees'),
-            last_updated=Max('updated_at'),
-        )
-        
-        stats['total_shipments'] = stats['total_shipments'] or 0
-        stats['total_weight'] = stats['total_weight'] or 0
-        stats['total_payment_fees'] = stats['total_payment_fees'] or 0
-        stats['total_ground_fees'] = stats['total_ground_fees'] or 0
-        stats['last_updated'] = stats['last_updated'] or datetime.now()
-
-        for key, value in stats.items():
-            if key == 'total_shipments':
-                continue
-            elif key == 'last_updated':
-                stats[key] = value.isoformat() if value else None
-            else:   
-                stats[key] = float(value or 0)
-
-        return Response(stats)
+        return Response(aggregates.get_totals(OutShipment))
+
+    @action(detail=False, methods=['get'], url_path='stats/timeseries')
+    @conditional_get
+    @cached_response
+    def stats_timeseries(self, request):
+        params = TimeseriesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(aggregates.get_timeseries(OutShipment, **params.validated_data))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered/searched/ordered list as CSV or XLSX (?file_format=csv|xlsx)"""
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.STREAMS:
+            raise ValidationError({"file_format": "الصيغة المدعومة: csv أو xlsx."})
+        queryset = self.filter_queryset(self.get_queryset())
+        return exports.export_response(queryset, "out_shipment", file_format)
+
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        """Create several partial exports, across one or more inbound shipments, in one transaction"""
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        numbers = [item['sub_bill_number'] for item in serializer.validated_data]
+        if len(numbers) != len(set(numbers)):
+            raise ValidationError({"sub_bill_number": "رقم البوليصة الفرعية مكرر في الطلب."})
+        created = allocation.create_allocations(serializer.validated_data)
+        return Response(self.get_serializer(created, many=True).data, status=status.HTTP_201_CREATED)
 
     def update(self, request, *args, **kwargs):
         return Response({"detail": "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -148,3 +268,15 @@ class OutShipmentViewSet(viewsets.ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         return Response({"detail": "Method not allowed."}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@api_view(['GET'])
+def metrics(request):
+    """Process-level counters for the performance features"""
+    cache = get_response_cache()
+    return Response({
+        "response_cache": cache.stats() if cache is not None else None,
+        "event_dispatcher": get_dispatcher().stats(),
+        "websockets": outbound_stats.stats(),
+        "auth_cache": get_auth_cache().stats(),
+    })
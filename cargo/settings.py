@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -79,9 +80,14 @@ TEMPLATES = [
     },
 ]
 
+# Shared by every daphne process on the host through a SQLite file, so
+# broadcasts reach clients connected to any worker
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+        "BACKEND": "consumers.layers.SQLiteChannelLayer",
+        "CONFIG": {
+            "path": BASE_DIR / "channels.sqlite3",
+        },
     }
 }
 
@@ -95,6 +101,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file-backed test database lets threaded tests wait on SQLite's
+        # busy timeout instead of failing on shared-cache table locks
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -126,8 +137,8 @@ DATABASES = {
 # REST Framework config
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+        'api.authentication.CachedSessionAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -136,6 +147,64 @@ REST_FRAMEWORK = {
     ],
 }
 
+# WebSocket fan-out of shipment events. Events are sent after commit by a
+# background dispatcher holding at most DISPATCH_QUEUE_SIZE pending events;
+# events within COALESCE_WINDOW seconds are sent to each group as one
+# message, and reach each client as one frame, of at most MAX_BATCH events
+SHIPMENT_EVENTS = {
+    "DISPATCH_QUEUE_SIZE": 10000,
+    "COALESCE_WINDOW": 0.1,
+    "MAX_BATCH": 100,
+    # Events kept for clients resuming after a reconnect
+    "LOG_SIZE": 10000,
+    # Frames waiting to be written to one WebSocket, and what happens when
+    # a slow client lets them pile up: "resync" or "disconnect"
+    "OUTBOUND_QUEUE_SIZE": 100,
+    "OVERFLOW_POLICY": "resync",
+}
+
+# Server-side cache for list and stats responses, invalidated by the model
+# signals. "sqlite" is a file shared by every worker on the host, so one
+# worker's invalidation reaches the others; "memory" is per process and
+# only safe with a single worker. Set BACKEND to None to disable it.
+RESPONSE_CACHE = {
+    "BACKEND": "sqlite",
+    "MAX_BYTES": 32 * 1024 * 1024,
+    "PATH": BASE_DIR / "response_cache.sqlite3",
+}
+
+# Server-Timing header on every response; requests slower than
+# SLOW_REQUEST_MS go to the "api.slow_requests" logger with their
+# SLOWEST_STATEMENTS slowest SQL statements (None turns the log off)
+REQUEST_TIMING = {
+    "SLOW_REQUEST_MS": 500,
+    "SLOWEST_STATEMENTS": 5,
+}
+
+# The slow request log goes to stderr with the server's own output
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "timestamped": {"format": "{asctime} {levelname} {name} {message}", "style": "{"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "timestamped"},
+    },
+    "loggers": {
+        "api.slow_requests": {"handlers": ["console"], "level": "WARNING", "propagate": False},
+    },
+}
+
+# Token / session key -> user, per process (see api/authentication.py).
+# Logout, token deletion and user changes reach every worker on the host
+# through the PATH file (None: other workers wait for the TTL)
+AUTH_CACHE = {
+    "TTL": 60,
+    "MAX_ENTRIES": 10000,
+    "PATH": BASE_DIR / "auth_cache.sqlite3",
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,28 @@
+from channels.auth import AuthMiddleware, get_user
+from channels.sessions import CookieMiddleware, SessionMiddleware
+
+from api.authentication import get_auth_cache
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    """
+    ``AuthMiddleware`` that resolves the session's user through the auth
+    cache, so clients reconnecting together after a restart do not each
+    cost a session and a user query.
+    """
+
+    async def resolve_scope(self, scope):
+        session_key = scope["session"].session_key
+        cache = get_auth_cache()
+        cached = cache.get("session", session_key) if session_key else None
+        if cached is not None:
+            user = cached[0]
+        else:
+            user = await get_user(scope)
+            if session_key and user.is_authenticated:
+                cache.set("session", session_key, user)
+        scope["user"]._wrapped = user
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
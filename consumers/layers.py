@@ -0,0 +1,284 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.conf import settings
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """
+    Channel layer shared by every worker process on one host through a
+    SQLite file, so ``group_send`` from any daphne process reaches
+    WebSocket clients connected to all of them. No broker is needed.
+
+    Group memberships live in the database. A message for a channel of this
+    process is handed straight to the local queue; a message for another
+    process is inserted as a row keyed by that process's channel prefix.
+    Each process runs one poller that watches ``PRAGMA data_version`` (which
+    changes only when another connection commits) and fetches and deletes
+    its rows in one transaction. The poll interval starts at
+    ``poll_interval`` and doubles while nothing changes, up to
+    ``max_poll_interval``, so an idle layer costs a pragma read every
+    ``max_poll_interval``.
+
+    Messages must be JSON-serializable.
+    """
+
+    extensions = ["groups", "flush"]
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS channel_messages ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, prefix TEXT NOT NULL, channel TEXT NOT NULL, "
+        "message TEXT NOT NULL, expires REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS channel_messages_prefix ON channel_messages (prefix, id)",
+        "CREATE TABLE IF NOT EXISTS channel_groups ("
+        "group_name TEXT NOT NULL, channel TEXT NOT NULL, expires REAL NOT NULL, "
+        "PRIMARY KEY (group_name, channel))",
+    )
+
+    # Expired rows and memberships are purged at most this often (seconds)
+    CLEANUP_INTERVAL = 30
+
+    def __init__(
+        self,
+        path=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.005,
+        max_poll_interval=0.1,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path or settings.BASE_DIR / "channels.sqlite3")
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.prefix = f"specific.{uuid.uuid4().hex[:12]}!"
+        self.local = threading.local()
+        # channel -> (loop, queue) for channels received on in this process
+        self.queues = {}
+        self.poller = None
+        self.poll_connection = None
+        with self._transaction() as connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    # Database
+
+    def _connect(self, **kwargs):
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, **kwargs)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = self._connect()
+        return connection
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def _insert(self, rows):
+        expires = time.time() + self.expiry
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO channel_messages (prefix, channel, message, expires) VALUES (?, ?, ?, ?)",
+                [(self.non_local_name(channel), channel, json.dumps(message), expires) for channel, message in rows],
+            )
+
+    def _group_channels(self, group):
+        # A single autocommit SELECT reads a consistent snapshot without the write lock
+        return [row[0] for row in self._connection().execute(
+            "SELECT channel FROM channel_groups WHERE group_name = ? AND expires > ?", [group, time.time()]
+        )]
+
+    def _fetch(self, prefixes):
+        """Take every pending row addressed to ``prefixes``"""
+        connection = self.poll_connection
+        placeholders = ",".join("?" * len(prefixes))
+        # Most commits are other processes' messages; check without the write lock first
+        pending = connection.execute(
+            f"SELECT 1 FROM channel_messages WHERE prefix IN ({placeholders}) LIMIT 1", prefixes
+        ).fetchone()
+        if pending is None:
+            return []
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                f"SELECT id, channel, message FROM channel_messages "
+                f"WHERE prefix IN ({placeholders}) AND expires > ? ORDER BY id",
+                [*prefixes, time.time()],
+            ).fetchall()
+            connection.execute(f"DELETE FROM channel_messages WHERE prefix IN ({placeholders})", prefixes)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return [(channel, json.loads(message)) for _, channel, message in rows]
+
+    def _cleanup(self):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM channel_messages WHERE expires <= ?", [now])
+            connection.execute("DELETE FROM channel_groups WHERE expires <= ?", [now])
+
+    # Local delivery
+
+    def _is_local(self, channel):
+        return channel.startswith(self.prefix)
+
+    def _queue(self, channel):
+        entry = self.queues.get(channel)
+        if entry is None:
+            entry = self.queues[channel] = (asyncio.get_running_loop(), asyncio.Queue())
+        return entry[1]
+
+    def _deliver(self, channel, message, strict):
+        """
+        Put ``message`` on a local queue. Full queues raise ``ChannelFull``
+        when ``strict`` (``send``) and drop the message otherwise
+        (``group_send``), like the other channel layers.
+        """
+        entry = self.queues.get(channel)
+        if entry is None:
+            return
+        loop, queue = entry
+        if queue.qsize() >= self.get_capacity(channel):
+            if strict:
+                raise ChannelFull(channel)
+            return
+        if loop.is_closed():
+            self.queues.pop(channel, None)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            queue.put_nowait(message)
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+
+    async def _poll(self):
+        last_version = None
+        last_cleanup = 0
+        interval = self.poll_interval
+        while self.queues:
+            version = self.poll_connection.execute("PRAGMA data_version").fetchone()[0]
+            if version != last_version:
+                last_version = version
+                interval = self.poll_interval
+                prefixes = sorted({self.prefix} | {name for name in self.queues if "!" not in name})
+                for channel, message in await asyncio.to_thread(self._fetch, prefixes):
+                    self._deliver(channel, message, strict=False)
+            else:
+                # Back off while idle
+                interval = min(interval * 2, self.max_poll_interval)
+            if time.monotonic() - last_cleanup > self.CLEANUP_INTERVAL:
+                last_cleanup = time.monotonic()
+                await asyncio.to_thread(self._cleanup)
+            await asyncio.sleep(interval)
+
+    def _ensure_poller(self):
+        if self.poller is not None and not self.poller.done() and not self.poller.get_loop().is_closed():
+            return
+        if self.poll_connection is None:
+            self.poll_connection = self._connect(check_same_thread=False)
+        self.poller = asyncio.get_running_loop().create_task(self._poll())
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        if self._is_local(channel):
+            self._deliver(channel, message, strict=True)
+        else:
+            await asyncio.to_thread(self._insert, [(channel, message)])
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        queue = self._queue(channel)
+        self._ensure_poller()
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            # The consumer is gone
+            self.queues.pop(channel, None)
+            raise
+
+    async def new_channel(self, prefix="specific"):
+        channel = f"{self.prefix}{prefix}.{uuid.uuid4().hex}"
+        self._queue(channel)
+        return channel
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def add():
+            with self._transaction() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?)",
+                    [group, channel, time.time() + self.group_expiry],
+                )
+        await asyncio.to_thread(add)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def discard():
+            with self._transaction() as connection:
+                connection.execute(
+                    "DELETE FROM channel_groups WHERE group_name = ? AND channel = ?", [group, channel]
+                )
+        await asyncio.to_thread(discard)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        remote = []
+        for channel in await asyncio.to_thread(self._group_channels, group):
+            if self._is_local(channel):
+                self._deliver(channel, message, strict=False)
+            else:
+                remote.append((channel, message))
+        if remote:
+            await asyncio.to_thread(self._insert, remote)
+
+    async def flush(self):
+        def clear():
+            with self._transaction() as connection:
+                connection.execute("DELETE FROM channel_messages")
+                connection.execute("DELETE FROM channel_groups")
+        await asyncio.to_thread(clear)
+        self.queues.clear()
+
+    async def close(self):
+        if self.poller is not None:
+            self.poller.cancel()
+            self.poller = None
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT`` around a block on an autocommit connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
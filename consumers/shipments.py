@@ -1,18 +1,266 @@
+import asyncio
+from collections import OrderedDict, deque
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from api import event_log, subscriptions
+
+
+# Event ids remembered per connection to drop copies arriving through
+# several subscription groups
+RECENT_EVENTS = 1000
+
+# Close code used by the "disconnect" overflow policy
+OVERFLOW_CLOSE_CODE = 4008
+
+
+def event_settings():
+    return getattr(settings, "SHIPMENT_EVENTS", {})
+
+
+class OutboundStats:
+    """Process-wide counters for the WebSocket outbound queues"""
+
+    def __init__(self):
+        self.open_connections = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.disconnected = 0
+        self.high_water = 0
+
+    def stats(self):
+        return {
+            "open_connections": self.open_connections,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+            "disconnected": self.disconnected,
+            "queue_high_water": self.high_water,
+        }
+
+
+outbound_stats = OutboundStats()
+
+
+def event_message(event):
+    message = {
+        "model": event.get("model"),
+        "action": event.get("action"),
+        "id": event.get("id"),
+        "message": event.get("message"),
+    }
+    for key in ("seq", "ids", "count", "data"):
+        if key in event:
+            message[key] = event[key]
+    return message
+
+
+def batch_message(messages):
+    """
+    One frame for several events: ``changes`` lists the affected ids per
+    model and action (a client can refetch each list at most once) and
+    ``events`` keeps the individual messages in order.
+    """
+    changes = {}
+    for message in messages:
+        ids = changes.setdefault(message["model"], {}).setdefault(message["action"], [])
+        for instance_id in message.get("ids") or [message["id"]]:
+            if instance_id is not None and instance_id not in ids:
+                ids.append(instance_id)
+    return {
+        "model": None,
+        "action": "batch",
+        "count": len(messages),
+        "message": f"{len(messages)} تحديثات جديدة",
+        "changes": changes,
+        "events": messages,
+    }
 
 
 class ShipmentsConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes shipment events to the client. The dispatcher already coalesces
+    events queued within ``SHIPMENT_EVENTS["COALESCE_WINDOW"]`` seconds into
+    one ``shipments.batch`` message per group, which goes out as a single
+    ``batch`` frame; a lone event is sent as is. Events within a frame are
+    in order; frames arriving through different subscriptions may
+    interleave, ``seq`` gives the overall order.
+
+    A new connection receives every event. Clients narrow that down with
+    ``{"type": "subscribe", "models": [...], "ids": {model: [...]},
+    "bill_numbers": [...]}``; the first such subscription leaves the
+    catch-all group, and ``{"type": "subscribe", "all": true}`` rejoins it.
+    ``unsubscribe`` takes the same fields. Each subscription is a channel
+    layer group, so events only travel to the connections that match. A
+    bulk event with too many ids or bill numbers for one group each goes to
+    an overflow group that every id (bill number) subscriber is in instead,
+    and the connection checks whether the event concerns it.
+
+    Every event carries the ``seq`` it was logged under. After reconnecting
+    (and subscribing again), a client sends ``{"type": "resume", "after":
+    <last seq it saw>}`` and gets the matching events it missed, then
+    ``{"type": "resumed", "seq": ..., "more": ...}``; if the log no longer
+    goes back that far it gets ``{"type": "resync", "seq": ...}`` and should
+    reload its lists instead. One replay covers at most half the outbound
+    queue's worth of frames so it never overflows it: while ``more`` is
+    true, the client resumes again after the ``seq`` it got.
+
+    Frames go through a queue of at most ``OUTBOUND_QUEUE_SIZE`` frames per
+    connection, drained by a writer task, so a slow reader cannot make the
+    backlog grow without bound. When it is full, ``OVERFLOW_POLICY``
+    "resync" drops the queued frames for a single ``resync`` message and
+    "disconnect" closes the connection with code 4008.
+    """
+
     async def connect(self):
-        await self.channel_layer.group_add("shipments", self.channel_name)
+        config = event_settings()
+        self.max_batch = config.get("MAX_BATCH", 100)
+        self.outbound_size = config.get("OUTBOUND_QUEUE_SIZE", 100)
+        self.overflow_policy = config.get("OVERFLOW_POLICY", "resync")
+        self.outbound = deque()
+        self.outbound_ready = asyncio.Event()
+        self.writer = asyncio.ensure_future(self.write_outbound())
+        self.overflowed = False
+        self.last_seq = None
+        self.recent_events = OrderedDict()
+        self.subscriptions = {}
+        self.overflow_groups = set()
+        await self.join({subscriptions.ALL_GROUP: ("all", True)})
         await self.accept()
+        outbound_stats.open_connections += 1
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("shipments", self.channel_name)
+        self.writer.cancel()
+        outbound_stats.open_connections -= 1
+        await self.leave(list(self.subscriptions))
+        await self.sync_overflow_groups()
 
-    async def shipments_event(self, event):
-        await self.send_json({
-            "model": event.get("model"),
-            "action": event.get("action"),
-            "id": event.get("id"),
-            "message": event.get("message"),
+    def push(self, frame):
+        """Queue ``frame`` for the writer, applying the overflow policy"""
+        if self.overflowed:
+            return
+        if len(self.outbound) >= self.outbound_size:
+            outbound_stats.dropped += len(self.outbound) + 1
+            self.outbound.clear()
+            if self.overflow_policy == "disconnect":
+                self.overflowed = True
+                self.writer.cancel()
+                outbound_stats.disconnected += 1
+                asyncio.ensure_future(self.close(code=OVERFLOW_CLOSE_CODE))
+                return
+            outbound_stats.resyncs += 1
+            frame = {"type": "resync", "seq": self.last_seq}
+        self.outbound.append(frame)
+        outbound_stats.high_water = max(outbound_stats.high_water, len(self.outbound))
+        self.outbound_ready.set()
+
+    async def write_outbound(self):
+        while True:
+            while not self.outbound:
+                self.outbound_ready.clear()
+                await self.outbound_ready.wait()
+            await self.send_json(self.outbound.popleft())
+
+    async def join(self, groups):
+        for group, subscription in groups.items():
+            if group not in self.subscriptions:
+                await self.channel_layer.group_add(group, self.channel_name)
+            self.subscriptions[group] = subscription
+
+    async def leave(self, groups):
+        for group in groups:
+            if self.subscriptions.pop(group, None) is not None:
+                await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def sync_overflow_groups(self):
+        needed = subscriptions.overflow_groups(self.subscriptions)
+        for group in needed - self.overflow_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.overflow_groups - needed:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.overflow_groups = needed
+
+    async def receive_json(self, content, **kwargs):
+        kind = content.get("type") if isinstance(content, dict) else None
+        if kind == "resume":
+            await self.resume(content.get("after"))
+            return
+        if kind not in ("subscribe", "unsubscribe"):
+            self.push({"type": "error", "message": "Unknown message type"})
+            return
+        try:
+            groups = subscriptions.requested_groups(content)
+        except ValueError as exc:
+            self.push({"type": "error", "message": str(exc)})
+            return
+        if content.get("all"):
+            groups[subscriptions.ALL_GROUP] = ("all", True)
+
+        if kind == "subscribe":
+            if not content.get("all") and groups:
+                await self.leave([subscriptions.ALL_GROUP])
+            await self.join(groups)
+        else:
+            await self.leave(list(groups))
+        await self.sync_overflow_groups()
+        self.push({"type": "subscriptions", **subscriptions.describe(self.subscriptions)})
+
+    async def resume(self, after):
+        if isinstance(after, bool) or not isinstance(after, int) or after < 0:
+            self.push({"type": "error", "message": "after must be a non-negative integer"})
+            return
+        # Handlers run one at a time: live events wait until the replay is queued
+        limit = self.max_batch * max(1, self.outbound_size // 2)
+        events = await database_sync_to_async(event_log.events_after)(after, limit)
+        if events is None:
+            seq = await database_sync_to_async(event_log.latest_seq)()
+            self.push({"type": "resync", "seq": seq})
+            return
+        replayed = [
+            event for event in events
+            if subscriptions.subscribed_to(self.subscriptions, event) and self.remember(event)
+        ]
+        self.deliver(replayed)
+        self.push({
+            "type": "resumed",
+            "seq": max([after, *(event["seq"] for event in events)]),
+            "replayed": len(replayed),
+            "more": len(events) == limit,
         })
+
+    def remember(self, event):
+        """False if the event was already delivered on this connection"""
+        event_id = event.get("event_id")
+        if event_id is None:
+            return True
+        if event_id in self.recent_events:
+            return False
+        self.recent_events[event_id] = None
+        if len(self.recent_events) > RECENT_EVENTS:
+            self.recent_events.popitem(last=False)
+        return True
+
+    async def shipments_event(self, event):
+        await self.shipments_batch({"events": [event]})
+
+    async def shipments_batch(self, batch):
+        # The same event may also arrive through another subscription group,
+        # and one sent to an overflow group may not concern this connection
+        self.deliver([
+            event for event in batch["events"]
+            if subscriptions.subscribed_to(self.subscriptions, event) and self.remember(event)
+        ])
+
+    def deliver(self, events):
+        """Queue ``events`` as frames of at most ``max_batch`` events"""
+        for event in events:
+            if event.get("seq") is not None:
+                self.last_seq = max(self.last_seq or 0, event["seq"])
+        messages = [event_message(event) for event in events]
+        for start in range(0, len(messages), self.max_batch):
+            chunk = messages[start:start + self.max_batch]
+            outbound_stats.coalesced += len(chunk) - 1
+            self.push(chunk[0] if len(chunk) == 1 else batch_message(chunk))